@@ -0,0 +1,51 @@
+"""
+Swagger UI built on the first request to the documentation.
+
+WHY: Importing flasgger (jsonschema, yaml, mistune) is about a sixth of the import time of the
+application and no API client needs it. Requests under the documentation paths are handed to
+a second Flask app, created with the same routes and Flasgger on the first of them, so
+workers start without it.
+"""
+import threading
+from flask import Flask
+from routes import register_routes
+
+# URL prefixes served by Flasgger (Swagger UI, spec JSON and static files)
+DOCS_PREFIXES = ('/apidocs', '/apispec', '/flasgger_static')
+
+
+class LazyApiDocs:
+    """
+    WSGI middleware sending the documentation requests to the lazily built docs app.
+
+    @param app Flask application documented
+    @param wsgi_app WSGI callable handling the other requests (app.wsgi_app)
+    """
+
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self._docs = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._docs is not None
+
+    def docs_app(self):
+        with self._lock:
+            if self._docs is None:
+                from flasgger import Swagger
+
+                docs = Flask(self.app.import_name)
+                docs.config['SWAGGER'] = self.app.config['SWAGGER']
+                Swagger(docs)
+                # only the rules and docstrings are read, the views never run here
+                register_routes(docs)
+                self._docs = docs
+            return self._docs
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith(DOCS_PREFIXES):
+            return self.docs_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
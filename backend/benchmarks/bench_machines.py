@@ -0,0 +1,103 @@
+"""
+Latency benchmark of GET /machines on a large metric history.
+
+Loads N machines with D days of daily metrics, then times the listing endpoint with the
+former implementation (latest metric of every machine loaded in Python on each call) and
+with the current one (machine_latest_status projection, page-restricted fallback) and
+reports p50/p99 latencies, along with the fleet dashboard over the last 30 days (default
+group levels, and one page of the machine level).
+
+Usage:
+    python benchmarks/bench_machines.py                     # 10k machines x 365 days
+    python benchmarks/bench_machines.py --machines 1000 --days 90 --requests 50
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask, jsonify, request
+from models import db, Machine, MachineMetric
+from routes import register_routes
+from importer import run_import
+from bench_import import generate_csvs
+
+
+def legacy_get_machines():
+    """
+    GET /machines as it was before the projection: latest metric of every machine loaded on each call
+    (the former DISTINCT ON, written with MAX(id) so that it also runs on SQLite).
+    """
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 30, type=int)
+    machines_paginated = Machine.query.paginate(page=page, per_page=per_page, error_out=False)
+    latest_metrics = (
+        db.session.query(MachineMetric)
+        .filter(MachineMetric.id.in_(
+            db.session.query(db.func.max(MachineMetric.id)).group_by(MachineMetric.machine_id)
+        ))
+        .all()
+    )
+    latest_status_map = {metric.machine_id: metric.status for metric in latest_metrics}
+    return jsonify({
+        "machines": [{"id": m.id, "name": m.name, "status": latest_status_map.get(m.id)} for m in machines_paginated.items],
+        "total": machines_paginated.total,
+    })
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))]
+
+
+def measure(client, url, requests):
+    timings = []
+    for i in range(requests):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200
+    return statistics.median(timings), percentile(timings, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='target database (default: temporary SQLite file)')
+    parser.add_argument('--machines', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--per-page', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        generate_csvs(tmp, args.machines, tools=10, users=10, metrics=args.machines * args.days, logs=10)
+
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app.config['CACHE_BACKEND'] = 'none'  # times the queries, not the response cache
+        db.init_app(app)
+        register_routes(app)
+        app.add_url_rule('/legacy/machines', 'legacy_machines', legacy_get_machines)
+
+        with app.app_context():
+            start = time.perf_counter()
+            rows = run_import('reset', csv_dir=tmp)
+            print(f"loaded {rows['machine_metrics']:,} metrics in {time.perf_counter() - start:.1f}s")
+
+            client = app.test_client()
+            print(f"{'GET /machines':<16}{'p50 ms':>10}{'p99 ms':>10}")
+            for label, url in (('before', '/legacy/machines'), ('after', '/machines')):
+                p50, p99 = measure(client, f"{url}?per_page={args.per_page}&page=2", args.requests)
+                print(f"{label:<16}{p50:>10.1f}{p99:>10.1f}")
+            for label, query in (('fleet groups', ''), ('fleet machines', f'&group_by=machine&per_page={args.per_page}')):
+                p50, p99 = measure(client, f'/fleet/dashboard?days=30{query}', args.requests)
+                print(f"{label:<16}{p50:>10.1f}{p99:>10.1f}")
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
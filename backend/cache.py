@@ -0,0 +1,269 @@
+"""
+Response cache of the read endpoints, invalidated by table tags.
+
+WHY: Reference data (users, tool and machine pages, dashboard series) only changes on an
+import or a few write endpoints, yet every request rebuilt it. A GET view decorated with
+@cached('machines', ...) stores its JSON response under the path, the query arguments and
+the current version of each table it reads. Write paths bump the versions of the tables
+they change, so exactly the affected entries stop matching and age out of the LRU.
+
+Backends (CACHE_BACKEND): 'memory' (per process LRU with TTL, the default), 'redis'
+(shared by all the workers, needs the redis package and CACHE_REDIS_URL) or 'none'.
+With the memory backend a write only invalidates the entries of its own process, the
+other workers serve theirs until CACHE_DEFAULT_TTL expires.
+
+The same table versions make the ETag and Last-Modified of the responses: a request whose
+If-None-Match (or If-Modified-Since) still matches gets a 304 without touching the database.
+"""
+import json
+import time
+import functools
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from flask import Response, current_app, has_app_context, request
+from commit_hooks import on_commit
+from routing import is_sticky, replica_may_lag
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 1024
+
+# key of the tags to invalidate once the transaction committed
+_PENDING = 'cache_invalidations'
+# guards the creation of the cache of each application
+_caches_lock = threading.Lock()
+
+
+class MemoryBackend:
+    """
+    In-process LRU of at most max_entries entries, each expiring after its TTL.
+
+    Table versions are only seen by this process (shared = False).
+    """
+    shared = False
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._modified = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def state(self, tags):
+        """
+        (version of each tag, time of the last bump of any of them or None)
+        """
+        with self._lock:
+            modified = [self._modified[tag] for tag in tags if tag in self._modified]
+            return [self._versions.get(tag, 0) for tag in tags], max(modified, default=None)
+
+    def bump(self, tags):
+        now = time.time()
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+                self._modified[tag] = now
+
+
+class RedisBackend:
+    """
+    Entries and tag versions kept in a Redis-compatible server, shared by all the workers.
+    """
+    shared = True
+
+    def __init__(self, url, prefix='machine_management:cache:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND 'redis' needs the redis package (pip install redis)") from e
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self._redis.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self._redis.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def state(self, tags):
+        values = self._redis.mget([f"{self.prefix}tag:{tag}" for tag in tags] +
+                                  [f"{self.prefix}modified:{tag}" for tag in tags])
+        modified = [float(value) for value in values[len(tags):] if value is not None]
+        return [int(version or 0) for version in values[:len(tags)]], max(modified, default=None)
+
+    def bump(self, tags):
+        now = time.time()
+        pipeline = self._redis.pipeline()
+        for tag in tags:
+            pipeline.incr(f"{self.prefix}tag:{tag}")
+            pipeline.set(f"{self.prefix}modified:{tag}", now)
+        pipeline.execute()
+
+
+class ResponseCache:
+    """
+    Cached responses of an application and the versions of the tables they were built from.
+
+    @param backend MemoryBackend or RedisBackend
+    @param ttl Seconds an entry is served at most
+    """
+
+    def __init__(self, backend, ttl=DEFAULT_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.started = time.time()
+
+    @classmethod
+    def for_app(cls, app):
+        """
+        Cache of an application, created (from its CACHE_* config) on first use.
+        """
+        with _caches_lock:
+            if 'response_cache' not in app.extensions:
+                name = app.config.get('CACHE_BACKEND', 'memory')
+                if name == 'none':
+                    # keeps the table versions (ETags) but no response
+                    backend = MemoryBackend(0)
+                elif name == 'memory':
+                    backend = MemoryBackend(app.config.get('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+                elif name == 'redis':
+                    backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+                else:
+                    raise ValueError(f"Unknown CACHE_BACKEND '{name}'. Must be memory, redis or none.")
+                app.extensions['response_cache'] = cls(backend, app.config.get('CACHE_DEFAULT_TTL', DEFAULT_TTL))
+            return app.extensions['response_cache']
+
+    def validators(self, tags):
+        """
+        ETag and Last-Modified of the current versions of the tables, read from the backend only.
+
+        WHY: Versions kept in memory miss the writes of the other workers, so their validators
+        also change with each TTL window: a stale 304 is bounded like a stale cache entry.
+        Last-Modified only has whole seconds: while the current second may still see writes
+        it is left out, otherwise two writes within one second would share it.
+
+        @return (ETag, Last-Modified or None, epoch seconds of the last write to the tables or None)
+        """
+        now = time.time()
+        versions, last_write = self.backend.state(tags)
+        modified = last_write or self.started
+        if not self.backend.shared:
+            window = now // self.ttl
+            versions += [int(self.started), int(window)]
+            modified = max(modified, window * self.ttl)
+        last_modified = datetime.fromtimestamp(int(modified), timezone.utc) if int(modified) < int(now) else None
+        return '.'.join(map(str, versions)), last_modified, last_write
+
+    def key(self, etag):
+        """
+        Key of the current request: path, sorted query arguments and table versions.
+        """
+        args = urlencode(sorted(request.args.items(multi=True)))
+        return f"{request.path}?{args}#{etag}"
+
+    def invalidate(self, *tags):
+        self.backend.bump(tags)
+
+
+def not_modified(etag, last_modified):
+    """
+    Whether the conditional headers of the request still match these validators.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return None not in (request.if_modified_since, last_modified) and last_modified <= request.if_modified_since
+
+
+def add_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # browsers revalidate each time instead of guessing a freshness from Last-Modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def cached(*tags, ttl=None):
+    """
+    Caches the 200 responses of a GET view and answers its conditional requests.
+
+    @param tags Tables the view reads
+    @param ttl Seconds an entry is served, defaults to CACHE_DEFAULT_TTL
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = ResponseCache.for_app(current_app)
+            # read before the view runs, a write during the request only makes them older
+            etag, last_modified, last_write = cache.validators(tags)
+            if not_modified(etag, last_modified):
+                return add_validators(Response(status=304), etag, last_modified)
+
+            # a client reading its own writes bypasses entries filled from the replica
+            use_cache = not is_sticky()
+            # rows read from a replica that may lag behind the last write get no validators and are not
+            # stored, a 304 or a cache hit would otherwise keep them under the versions of the write
+            lagging = replica_may_lag(last_write)
+            store = use_cache and not lagging
+            key = cache.key(etag)
+            entry = cache.backend.get(key) if use_cache else None
+            if entry is not None:
+                response = Response(entry['body'], entry['status'], mimetype=entry['mimetype'])
+                response.headers['X-Cache'] = 'HIT'
+                return add_validators(response, etag, last_modified)
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed or lagging:
+                return response
+            if store:
+                cache.backend.set(key, {
+                    "status": response.status_code,
+                    "mimetype": response.mimetype,
+                    "body": response.get_data(as_text=True),
+                }, ttl or cache.ttl)
+                response.headers['X-Cache'] = 'MISS'
+            return add_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def invalidate(*tags):
+    """
+    Invalidates the entries built from these tables, call it after the write committed.
+    """
+    ResponseCache.for_app(current_app).invalidate(*tags)
+
+
+def invalidate_on_commit(connection, *tags):
+    """
+    Invalidates the entries built from these tables once the Session transaction of the
+    connection committed.
+
+    WHY: Bumping the versions before the rows are visible would let a concurrent request
+    cache the old rows under the new versions.
+    """
+    if has_app_context():
+        cache = ResponseCache.for_app(current_app)
+        pending = on_commit(connection, (_PENDING, id(cache)), lambda tags: cache.invalidate(*tags))
+        pending.update(dict.fromkeys(tags))
@@ -0,0 +1,44 @@
+"""
+Flask CLI commands managing the database schema.
+
+WHY: Workers no longer touch the schema when they start (CREATE_SCHEMA_ON_STARTUP is off
+outside the dev profile), so creating and upgrading it is an explicit deployment step:
+
+    flask --app "app:create_app('prod')" schema upgrade
+"""
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect, select
+from models import db
+from migrations import MIGRATIONS, run_migrations, schema_migrations
+
+schema_cli = AppGroup('schema', help="Create and upgrade the database schema.")
+
+
+@schema_cli.command('upgrade')
+def upgrade():
+    """Create the missing tables, then apply the pending migrations."""
+    db.create_all(bind_key=None)
+    applied = run_migrations(db.engine)
+    click.echo(f"Applied migrations: {', '.join(applied)}" if applied else "Database is up to date")
+
+
+@schema_cli.command('status')
+def status():
+    """List the missing tables and the pending migrations."""
+    existing = set(inspect(db.engine).get_table_names())
+    missing = [table for table in db.metadata.tables if table not in existing]
+    done = set()
+    if schema_migrations.name in existing:
+        with db.engine.connect() as connection:
+            done = set(connection.execute(select(schema_migrations.c.version)).scalars())
+    pending = [version for version, _ in MIGRATIONS if version not in done]
+
+    click.echo(f"Missing tables: {', '.join(missing) or 'none'}")
+    click.echo(f"Pending migrations: {', '.join(pending) or 'none'}")
+    if missing or pending:
+        raise SystemExit(1)
+
+
+def register_commands(app):
+    app.cli.add_command(schema_cli)
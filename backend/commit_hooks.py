@@ -0,0 +1,65 @@
+"""
+Work deferred until the Session transaction of a connection has committed.
+
+WHY: Engine 'commit' events fire before the DBAPI commit. Live events or cache invalidations
+sent from them describe rows other connections cannot see yet, and are still sent when the
+commit fails. Session 'after_commit' fires once every connection of the transaction committed.
+"""
+import weakref
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Connection.info key of the Session whose transaction uses the connection
+_SESSION = 'commit_hooks_session'
+# Session.info key of the {key: (callback, pending)} hooks of the current transaction
+_HOOKS = 'commit_hooks'
+
+
+def on_commit(connection, key, callback):
+    """
+    State collected by the writes of a transaction, handed to callback(pending) after it commits.
+
+    Dropped when the transaction rolls back. Every call with the same key during one
+    transaction returns the same dict, the callback of the first call is used.
+
+    @param connection Connection of a Session transaction (Session.connection())
+    @return Dict the writes add their pending work to
+    @raise RuntimeError when the connection is not used by a Session transaction
+    """
+    session_ref = connection.info.get(_SESSION)
+    session = session_ref() if session_ref is not None else None
+    if session is None:
+        raise RuntimeError("Writes that publish after commit must use a Session connection (Session.connection())")
+    hooks = session.info.setdefault(_HOOKS, {})
+    if key not in hooks:
+        hooks[key] = (callback, {})
+    return hooks[key][1]
+
+
+@event.listens_for(Engine, 'begin')
+def _forget_session(connection):
+    # a pooled connection keeps its info, the Session of its previous checkout is gone
+    connection.info.pop(_SESSION, None)
+
+
+@event.listens_for(Session, 'after_begin')
+def _remember_session(session, transaction, connection):
+    connection.info[_SESSION] = weakref.ref(session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_hooks(session):
+    # a released savepoint is not durable yet, the outer commit runs the hooks
+    if session.in_nested_transaction():
+        return
+    for callback, pending in session.info.pop(_HOOKS, {}).values():
+        if pending:
+            callback(pending)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _discard_hooks(session, transaction):
+    # rollback or close without commit
+    if transaction.parent is None:
+        session.info.pop(_HOOKS, None)
@@ -0,0 +1,131 @@
+"""
+In-process publisher of machine status/KPI changes, fanned out to the GET /machines/stream clients.
+
+WHY: Clients used to re-download /machines to notice a status change. Metric writes now
+collect the latest reading of each machine on their Session transaction and publish it
+once that transaction committed (commit_hooks), so an idle client costs one blocked thread and nothing else.
+Only the clients of the process that wrote the metrics are notified.
+"""
+import queue
+import itertools
+import threading
+from commit_hooks import on_commit
+
+# events kept for a slow client before it is told to reload instead
+SUBSCRIBER_QUEUE_SIZE = 1000
+# seconds between two SSE comments keeping idle connections open through proxies
+KEEPALIVE_SECONDS = 15
+
+# key of the pending deltas of a transaction
+_PENDING = 'machine_metric_events'
+
+
+class Subscription:
+    """
+    Events waiting for one client.
+
+    @param machine_ids Machines the client follows, None for all of them
+    """
+
+    def __init__(self, machine_ids=None, max_size=SUBSCRIBER_QUEUE_SIZE):
+        self.machine_ids = set(machine_ids) if machine_ids is not None else None
+        self._events = queue.Queue(max_size)
+        self.lagging = False
+
+    def wants(self, event_type, data):
+        return event_type != 'metric' or self.machine_ids is None or data['machine_id'] in self.machine_ids
+
+    def offer(self, item):
+        try:
+            self._events.put_nowait(item)
+        except queue.Full:
+            # deltas were lost, the client has to reload the full state
+            self.lagging = True
+
+    def get(self, timeout=None):
+        """
+        Next (id, event type, data) tuple, None when nothing came within timeout seconds.
+        """
+        if self.lagging:
+            self.lagging = False
+            with self._events.mutex:
+                self._events.queue.clear()
+            return None, 'reload', {"reason": "lagging"}
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Publisher:
+    """
+    Fans events out to every subscription of the process.
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, machine_ids=None):
+        subscription = Subscription(machine_ids)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    @property
+    def subscribers(self):
+        return len(self._subscriptions)
+
+    def publish(self, event_type, data):
+        with self._lock:
+            item = (next(self._ids), event_type, data)
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.wants(event_type, data):
+                subscription.offer(item)
+
+
+publisher = Publisher()
+
+
+def metrics_written(connection, metrics, replace=False):
+    """
+    Queues the latest reading of each machine, published once the transaction committed.
+
+    @param connection Session connection used for the metric writes
+    @param metrics Iterable of dicts holding the machine_metrics columns (id included)
+    @param replace True when the metrics are the current latest readings even if older than
+                   the queued ones (the newer ones were deleted or moved to another machine)
+    """
+    pending = on_commit(connection, _PENDING, _publish_pending)
+    for metric in metrics:
+        current = pending.get(metric['machine_id'])
+        if current is None or replace or metric['id'] > current['metric_id']:
+            pending[metric['machine_id']] = {
+                "machine_id": metric['machine_id'],
+                "metric_id": metric['id'],
+                "timestamp": metric['timestamp'].isoformat(),
+                "status": metric['status'],
+                "oee": metric['oee'],
+                "availability": metric['availability'],
+                "performance": metric['performance'],
+                "output_quality": metric['output_quality'],
+            }
+
+
+def publish_reload(reason):
+    """
+    Tells every client to reload the full state (after an import replaced the tables).
+    """
+    publisher.publish('reload', {"reason": reason})
+
+
+def _publish_pending(pending):
+    # the deltas carry their data so clients need no read
+    for data in pending.values():
+        publisher.publish('metric', data)
@@ -0,0 +1,5 @@
+from .sources import CSV_DIR, CSV_SOURCES, SOURCES_BY_NAME, CsvSource, parse_date
+from .loader import DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, bulk_load, load_all, stream_load
+from .incremental import incremental_load, row_hash, upsert_rows
+from .scheduler import dependencies, parallel_load
+from .jobs import IMPORT_MODES, ImportJob, ImportJobRunner, run_import
@@ -0,0 +1,92 @@
+import hashlib
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from .sources import CSV_DIR
+from .loader import DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, batched, reset_sequence
+
+# dialects offering INSERT ... ON CONFLICT DO UPDATE
+_INSERT_CONSTRUCTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+# ids per lookup query of stored_hashes()
+LOOKUP_BATCH_SIZE = 1000
+
+
+def row_hash(row):
+    """
+    Content hash of a row tuple, used to detect CSV rows that did not change.
+    """
+    return hashlib.blake2b(repr(tuple(row)).encode(), digest_size=16).digest()
+
+
+def stored_hashes(connection, source, ids):
+    """
+    Hashes of the rows currently stored for the given ids, with the stored rows themselves.
+
+    WHY: Only the ids of the chunk are looked up, in IN lists of at most LOOKUP_BATCH_SIZE
+    ids, so the cost follows the size of the delta even when its ids are far apart. The
+    stored rows tell what an update replaced, e.g. the machine and day a metric leaves.
+
+    @return Dict of id to (hash, stored row tuple)
+    """
+    table = source.table
+    columns = [table.c[name] for name in source.columns]
+    hashes = {}
+    for batch in batched(sorted(set(ids)), LOOKUP_BATCH_SIZE):
+        for row in connection.execute(select(*columns).where(table.c.id.in_(batch))):
+            hashes[row[0]] = (row_hash(row), tuple(row))
+    return hashes
+
+
+def upsert_rows(connection, source, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Inserts rows or updates the existing ones with the same id.
+    """
+    dialect = connection.dialect.name
+    if dialect not in _INSERT_CONSTRUCTS:
+        raise ValueError(f"Incremental import is not supported on {dialect}")
+
+    statement = _INSERT_CONSTRUCTS[dialect](source.table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[source.table.c.id],
+        set_={name: statement.excluded[name] for name in source.columns if name != 'id'}
+    )
+    for batch in batched(rows, batch_size):
+        connection.execute(statement, [dict(zip(source.columns, row)) for row in batch])
+
+
+def incremental_load(session, source, csv_dir=CSV_DIR, chunk_size=DEFAULT_CHUNK_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                     on_write=None):
+    """
+    Upserts one CSV file keyed on its id column, skipping rows whose content is unchanged.
+
+    @param session SQLAlchemy session used to get a connection and commit
+    @param source CsvSource describing the file
+    @param csv_dir Folder holding the CSV file
+    @param chunk_size Rows compared and committed at once
+    @param batch_size Rows per upsert statement
+    @param on_write Optional callback receiving (connection, source, rows inserted, rows updated, rows they replaced)
+        before each commit
+    @return Generator yielding (rows read, rows written) so far after each commit
+    """
+    read = written = 0
+    for chunk in batched(source.iter_rows(csv_dir), chunk_size):
+        connection = session.connection()
+        existing = stored_hashes(connection, source, [row[0] for row in chunk])
+        changed = [row for row in chunk if existing.get(row[0], (None,))[0] != row_hash(row)]
+        if changed:
+            upsert_rows(connection, source, changed, batch_size)
+            if on_write:
+                updated = [row for row in changed if row[0] in existing]
+                on_write(connection, source, [row for row in changed if row[0] not in existing], updated,
+                         [existing[row[0]][1] for row in updated])
+        session.commit()
+
+        read += len(chunk)
+        written += len(changed)
+        yield read, written
+
+    reset_sequence(session.connection(), source.table)
+    session.commit()
@@ -0,0 +1,235 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from models import db, Machine, MachineMetric
+import events
+import projections
+import cache
+from .sources import CSV_DIR, CSV_SOURCES
+from .loader import DEFAULT_CHUNK_SIZE, load_all, stream_load
+from .incremental import incremental_load
+from .scheduler import parallel_load
+
+IMPORT_MODES = ('reset', 'stream', 'incremental', 'parallel')
+# finished jobs kept in memory for the status endpoint
+MAX_KEPT_JOBS = 50
+
+
+def count_rows(path):
+    """
+    Number of data lines of a CSV file (used to estimate the progress of a job).
+    """
+    with open(path, 'rb') as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+
+def run_import(mode, csv_dir=CSV_DIR, chunk_size=DEFAULT_CHUNK_SIZE, load_workers=4, parse_workers=None, progress=None):
+    """
+    Runs one import of the CSV folder, needs an application context.
+
+    @param mode One of IMPORT_MODES:
+                reset loads everything in one transaction,
+                stream commits every chunk_size rows,
+                incremental keeps the tables and only upserts rows whose content changed,
+                parallel loads independent tables at the same time (one transaction per table)
+    @param progress Optional callback receiving (table name, rows processed so far)
+    @return Rows loaded per table ({"read", "written"} per table in incremental mode)
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Invalid mode '{mode}'. Must be one of {list(IMPORT_MODES)}.")
+    if chunk_size < 1:
+        # checked before the tables are dropped
+        raise ValueError(f"chunk_size must be at least 1, got {chunk_size}")
+    progress = progress or (lambda table, rows: None)
+
+    def metrics_written(connection, source, inserted, updated, previous):
+        if source.table is MachineMetric.__table__:
+            projections.metrics_written(connection, [dict(zip(source.columns, row)) for row in inserted])
+            # an update may move a metric: the machine and buckets it left are refreshed too
+            projections.metrics_changed(connection, [dict(zip(source.columns, row)) for row in updated + previous])
+
+    if mode == 'incremental':
+        # only creates missing tables, existing data is kept
+        db.create_all(bind_key=None)
+        rows = {}
+        for source in CSV_SOURCES:
+            # a delta folder only needs the files that changed
+            if not os.path.exists(source.path(csv_dir)):
+                continue
+            rows[source.name] = {"read": 0, "written": 0}
+            for read, written in incremental_load(db.session, source, csv_dir, chunk_size, on_write=metrics_written):
+                rows[source.name] = {"read": read, "written": written}
+                progress(source.name, read)
+            if source.table is Machine.__table__ and rows[source.name]["written"]:
+                # machines may have changed group, category or manufacturer
+                projections.refresh_fleet_rollups(db.session.connection())
+                db.session.commit()
+        return rows
+
+    # Drop and recreate tables
+    db.drop_all(bind_key=None)
+    db.create_all(bind_key=None)
+
+    if mode == 'parallel':
+        rows = parallel_load(db.engine, csv_dir=csv_dir, load_workers=load_workers,
+                             parse_workers=parse_workers, progress=progress)
+        with db.engine.begin() as connection:
+            projections.rebuild_projections(connection)
+        return rows
+
+    if mode == 'stream':
+        rows = {}
+        for source in CSV_SOURCES:
+            rows[source.name] = 0
+            for loaded in stream_load(db.session, source, csv_dir, chunk_size):
+                rows[source.name] = loaded
+                progress(source.name, loaded)
+        projections.rebuild_projections(db.session.connection())
+        db.session.commit()
+        return rows
+
+    # Stream every CSV straight into its table (COPY on PostgreSQL, batched inserts otherwise)
+    rows = load_all(db.session.connection(), csv_dir=csv_dir, progress=progress)
+    projections.rebuild_projections(db.session.connection())
+    db.session.commit()
+    return rows
+
+
+class ImportJob:
+    """
+    State of one background import, as reported by GET /import-jobs/<id>.
+    """
+
+    def __init__(self, mode, csv_dir):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.csv_dir = csv_dir
+        self.status = 'queued'
+        self.expected_rows = {}
+        self.rows = {}
+        self.result = None
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self._started = None
+        self._elapsed = None
+        self.future = None
+
+    def start(self):
+        self.status = 'running'
+        self.started_at = datetime.utcnow()
+        self._started = time.monotonic()
+        self.expected_rows = {
+            source.name: count_rows(source.path(self.csv_dir))
+            for source in CSV_SOURCES if os.path.exists(source.path(self.csv_dir))
+        }
+
+    def update(self, table, rows):
+        self.rows[table] = rows
+
+    def finish(self, result=None, error=None):
+        self.status = 'failed' if error else 'done'
+        self.result = result
+        self.error = error
+        self.finished_at = datetime.utcnow()
+        if self._started is not None:
+            self._elapsed = time.monotonic() - self._started
+
+    def to_dict(self):
+        # copy first, the job thread keeps updating the counters
+        rows = dict(self.rows)
+        loaded = sum(rows.values())
+        expected = sum(self.expected_rows.values())
+        elapsed = self._elapsed
+        if elapsed is None and self._started is not None:
+            elapsed = time.monotonic() - self._started
+
+        throughput = loaded / elapsed if elapsed else None
+        eta = None
+        if self.status == 'running' and throughput:
+            eta = round(max(expected - loaded, 0) / throughput, 1)
+        elif self.status in ('done', 'failed'):
+            eta = 0
+
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "status": self.status,
+            "rows": {
+                table: {"loaded": rows.get(table, 0), "expected": count}
+                for table, count in self.expected_rows.items()
+            },
+            "rows_loaded": loaded,
+            "rows_expected": expected,
+            "elapsed_seconds": round(elapsed, 2) if elapsed is not None else None,
+            "throughput_rows_per_second": round(throughput) if throughput is not None else None,
+            "eta_seconds": eta,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class ImportJobRunner:
+    """
+    Runs imports in a background thread pool and keeps their status in memory.
+
+    WHY: A full reset can take minutes, it must not hold the HTTP request (nor the worker
+    serving it) open. One import runs at a time, later ones wait in the queue, since two
+    resets of the same database would step on each other. Job status lives in the process
+    that ran the job.
+    """
+
+    def __init__(self, max_workers=1):
+        self._max_workers = max_workers
+        self._executor = None
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, app, mode='reset', csv_dir=CSV_DIR, **options):
+        """
+        Queues an import and returns its ImportJob right away.
+
+        @param app Flask application the job runs in
+        @param mode One of IMPORT_MODES
+        @param csv_dir Folder holding the CSV files
+        @param options Extra keyword arguments for run_import()
+        """
+        if mode not in IMPORT_MODES:
+            raise ValueError(f"Invalid mode '{mode}'. Must be one of {list(IMPORT_MODES)}.")
+
+        job = ImportJob(mode, csv_dir)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._max_workers, thread_name_prefix='import-job')
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_KEPT_JOBS:
+                self._jobs.popitem(last=False)
+        job.future = self._executor.submit(self._run, app, job, options)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _run(self, app, job, options):
+        with app.app_context():
+            try:
+                job.start()
+                result = run_import(job.mode, job.csv_dir, progress=job.update, **options)
+                job.finish(result)
+                # live clients hold a state the import replaced
+                events.publish_reload('import')
+            except Exception as e:
+                db.session.rollback()
+                job.finish(error=str(e))
+            finally:
+                db.session.remove()
+                # even a failed import may have committed chunks
+                cache.invalidate(*db.metadata.tables)
@@ -0,0 +1,197 @@
+import io
+import csv
+from itertools import islice
+from functools import partial
+from sqlalchemy import text
+from .sources import CSV_DIR, CSV_SOURCES
+
+# rows sent per executemany() call when COPY is not available
+DEFAULT_BATCH_SIZE = 5000
+# rows committed at once by the streaming import
+DEFAULT_CHUNK_SIZE = 50000
+# rows between two progress callbacks of the single-transaction loaders
+PROGRESS_EVERY = 10000
+
+
+def batched(rows, size):
+    """
+    Splits an iterable into lists of at most `size` items without materializing it.
+
+    @raise ValueError when size is below 1 (nothing would ever be yielded)
+    """
+    if size < 1:
+        raise ValueError(f"Batch size must be at least 1, got {size}")
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class RowCounter:
+    """
+    Iterable wrapper counting the rows consumed by a loader.
+
+    @param rows Iterable of rows
+    @param progress Optional callback receiving the count every PROGRESS_EVERY rows and at the end
+    """
+
+    def __init__(self, rows, progress=None):
+        self._rows = rows
+        self._progress = progress
+        self.count = 0
+
+    def __iter__(self):
+        for row in self._rows:
+            self.count += 1
+            if self._progress and self.count % PROGRESS_EVERY == 0:
+                self._progress(self.count)
+            yield row
+        if self._progress:
+            self._progress(self.count)
+
+
+class _CsvStream:
+    """
+    Read-only file object turning row tuples into CSV text on demand.
+
+    WHY: psycopg2's copy_expert() pulls data through read(), this lets COPY
+    consume a generator without building the whole file in memory.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+        self._pending = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow(['\\N' if value is None else value for value in row])
+            self._pending += self._buffer.getvalue()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+
+        if size < 0:
+            size = len(self._pending)
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+
+def copy_rows(connection, table, columns, rows):
+    """
+    Streams rows into a PostgreSQL table with COPY FROM STDIN.
+
+    @param connection SQLAlchemy connection bound to a PostgreSQL database
+    @param table Target Table object
+    @param columns Column names, in the order of the values in each row
+    @param rows Iterable of tuples
+    """
+    column_list = ', '.join(connection.dialect.identifier_preparer.quote(c) for c in columns)
+    target = f"{connection.dialect.identifier_preparer.format_table(table)} ({column_list})"
+    cursor = connection.connection.cursor()
+    try:
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2
+            cursor.copy_expert(f"COPY {target} FROM STDIN WITH (FORMAT csv, NULL '\\N')", _CsvStream(rows))
+        else:
+            # psycopg 3
+            with cursor.copy(f"COPY {target} FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+    finally:
+        cursor.close()
+
+
+def insert_rows(connection, table, columns, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Inserts rows with one executemany() per batch (fallback for SQLite and co).
+    """
+    statement = table.insert()
+    for batch in batched(rows, batch_size):
+        connection.execute(statement, [dict(zip(columns, row)) for row in batch])
+
+
+def reset_sequence(connection, table):
+    """
+    Moves the id sequence past the ids loaded from the CSV files.
+
+    WHY: COPY and explicit inserts bypass the serial default, without this the next
+    row created through the API would collide with an imported id.
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    connection.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+        f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table.name}"
+    ))
+
+
+def write_rows(connection, source, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Writes rows of a CSV source with COPY on PostgreSQL and batched inserts elsewhere.
+    """
+    if connection.dialect.name == 'postgresql':
+        copy_rows(connection, source.table, source.columns, rows)
+    else:
+        insert_rows(connection, source.table, source.columns, rows, batch_size)
+
+
+def bulk_load(connection, source, csv_dir=CSV_DIR, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Loads one CSV file into its table, using COPY on PostgreSQL.
+
+    @param connection SQLAlchemy connection, the caller owns the transaction
+    @param source CsvSource describing the file
+    @param csv_dir Folder holding the CSV file
+    @param batch_size Rows per executemany() call on the fallback path
+    @param progress Optional callback receiving the number of rows sent so far
+    @return Number of rows loaded
+    """
+    rows = RowCounter(source.iter_rows(csv_dir), progress)
+    write_rows(connection, source, rows, batch_size)
+    reset_sequence(connection, source.table)
+    return rows.count
+
+
+def load_all(connection, sources=CSV_SOURCES, csv_dir=CSV_DIR, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Loads every CSV source in order and returns the number of rows per table.
+
+    @param progress Optional callback receiving (table name, rows sent so far)
+    """
+    return {
+        source.name: bulk_load(connection, source, csv_dir, batch_size,
+                               partial(progress, source.name) if progress else None)
+        for source in sources
+    }
+
+
+def stream_load(session, source, csv_dir=CSV_DIR, chunk_size=DEFAULT_CHUNK_SIZE, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Loads one CSV file in chunks, committing after each one.
+
+    WHY: Only one chunk of parsed rows is alive at a time and nothing is kept in the
+    session, so memory stays the same whatever the size of the file.
+
+    @param session SQLAlchemy session used to get a connection and commit
+    @param source CsvSource describing the file
+    @param csv_dir Folder holding the CSV file
+    @param chunk_size Rows per transaction
+    @param batch_size Rows per executemany() call on the fallback path
+    @return Generator yielding the number of rows loaded so far after each commit
+    @raise ValueError when chunk_size is below 1
+    """
+    loaded = 0
+    for chunk in batched(source.iter_rows(csv_dir), chunk_size):
+        write_rows(session.connection(), source, chunk, batch_size)
+        session.commit()
+        loaded += len(chunk)
+        yield loaded
+
+    reset_sequence(session.connection(), source.table)
+    session.commit()
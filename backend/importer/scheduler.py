@@ -0,0 +1,126 @@
+import csv
+import multiprocessing
+from collections import deque
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from .sources import CSV_DIR, CSV_SOURCES, SOURCES_BY_NAME
+from .loader import DEFAULT_BATCH_SIZE, RowCounter, batched, reset_sequence, write_rows
+
+# raw CSV lines handed to a parser process at once
+PARSE_CHUNK_SIZE = 10000
+# parsed chunks waiting to be written, per table (bounds memory when parsing outruns the database)
+MAX_PENDING_CHUNKS = 4
+# parser processes are started fresh rather than forked: parallel_load() runs in an import job
+# thread, and a fork would copy the locks other threads hold (database pool, metric buffer)
+PARSE_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def dependencies(sources=CSV_SOURCES):
+    """
+    Reads the foreign-key graph of the sources from the SQLAlchemy metadata.
+
+    @param sources CsvSource objects to schedule
+    @return Dict mapping each table name to the set of table names it references
+    """
+    names = {source.name for source in sources}
+    return {
+        source.name: {
+            fk.column.table.name for fk in source.table.foreign_keys
+            if fk.column.table.name in names and fk.column.table.name != source.name
+        }
+        for source in sources
+    }
+
+
+def convert_chunk(name, header, lines):
+    """
+    Converts raw CSV lines of one source into row tuples (runs in a parser process).
+    """
+    convert = SOURCES_BY_NAME[name].convert
+    return [convert(dict(zip(header, values))) for values in lines]
+
+
+def parsed_rows(source, csv_dir=CSV_DIR, parse_pool=None, chunk_size=PARSE_CHUNK_SIZE):
+    """
+    Yields converted rows of a CSV source, the type conversion being done in parse_pool.
+
+    WHY: Splitting lines is cheap, converting dates and numbers is what keeps a core busy,
+    so only that part is shipped to the worker processes while the file is read here.
+    """
+    if parse_pool is None:
+        yield from source.iter_rows(csv_dir)
+        return
+
+    with open(source.path(csv_dir), newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        pending = deque()
+        for lines in batched(reader, chunk_size):
+            pending.append(parse_pool.submit(convert_chunk, source.name, header, lines))
+            if len(pending) >= MAX_PENDING_CHUNKS:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _load_table(engine, source, csv_dir, parse_pool, batch_size, progress):
+    """
+    Loads one table on its own pooled connection and transaction.
+    """
+    rows = RowCounter(parsed_rows(source, csv_dir, parse_pool), partial(progress, source.name) if progress else None)
+    with engine.begin() as connection:
+        write_rows(connection, source, rows, batch_size)
+        reset_sequence(connection, source.table)
+    return rows.count
+
+
+def parallel_load(engine, sources=CSV_SOURCES, csv_dir=CSV_DIR, load_workers=4, parse_workers=None,
+                  batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Loads the CSV sources concurrently, starting a table as soon as the tables it references are loaded.
+
+    WHY: machines, tools and users do not depend on each other, and each child table only
+    waits for its own parents, so the wall-clock time is close to the longest chain
+    instead of the sum of all tables.
+
+    @param engine SQLAlchemy engine, each table gets its own connection from its pool
+    @param sources CsvSource objects to load
+    @param csv_dir Folder holding the CSV files
+    @param load_workers Tables loaded at the same time (forced to 1 on SQLite, which has a single writer)
+    @param parse_workers Parser processes, None for one per core and 0 to parse in the loading threads
+    @param batch_size Rows per executemany() call on the fallback path
+    @param progress Optional callback receiving (table name, rows sent so far), called from the loading threads
+    @return Number of rows loaded per table
+    """
+    graph = dependencies(sources)
+    by_name = {source.name: source for source in sources}
+    if engine.dialect.name == 'sqlite':
+        load_workers = 1
+
+    parse_pool = None
+    if parse_workers != 0:
+        parse_pool = ProcessPoolExecutor(parse_workers, mp_context=multiprocessing.get_context(PARSE_START_METHOD))
+    rows, loaded, running = {}, set(), {}
+    waiting = [source.name for source in sources]
+    try:
+        with ThreadPoolExecutor(load_workers) as threads:
+            while waiting or running:
+                for name in [name for name in waiting if graph[name] <= loaded]:
+                    waiting.remove(name)
+                    future = threads.submit(_load_table, engine, by_name[name], csv_dir, parse_pool, batch_size, progress)
+                    running[future] = name
+
+                if not running:
+                    raise ValueError(f"Circular foreign keys between {waiting}")
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    rows[name] = future.result()
+                    loaded.add(name)
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown(cancel_futures=True)
+
+    # report tables in the usual import order
+    return {source.name: rows[source.name] for source in sources}
@@ -0,0 +1,101 @@
+import os
+import csv
+from datetime import datetime
+from models import Machine, Tool, User, MaintenanceLog, MachineMetric, ToolMetric, ToolAssignment
+
+CSV_DIR = os.path.join(os.path.dirname(__file__), '..', 'csv')
+
+
+def parse_date(date_str):
+    try:
+        # try full ISO format first
+        return datetime.fromisoformat(date_str)
+    except ValueError:
+        try:
+            # try date only
+            return datetime.strptime(date_str, "%Y-%m-%d")
+        except ValueError:
+            # try date with time
+            return datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
+
+
+class CsvSource:
+    """
+    Describes how one file of the csv/ folder maps onto a database table.
+
+    WHY: Every loader (COPY, batched inserts, ...) needs the same parsing rules,
+    so the conversion of a CSV row into column values lives here only once.
+    """
+
+    def __init__(self, filename, model, convert):
+        self.filename = filename
+        self.table = model.__table__
+        self.columns = [column.name for column in self.table.columns]
+        self.convert = convert
+
+    @property
+    def name(self):
+        return self.table.name
+
+    def path(self, csv_dir=CSV_DIR):
+        return os.path.join(csv_dir, self.filename)
+
+    def iter_rows(self, csv_dir=CSV_DIR):
+        """
+        Lazily yields converted rows as tuples ordered like self.columns.
+
+        @param csv_dir Folder holding the CSV file
+        @return Generator of tuples, one per CSV line
+        """
+        with open(self.path(csv_dir), newline='') as f:
+            for row in csv.DictReader(f):
+                yield self.convert(row)
+
+
+def _machine(row):
+    return (int(row['id']), row['name'], row['category'], row['group'],
+            row['manufacturer'], parse_date(row['created_at']))
+
+
+def _tool(row):
+    return (int(row['id']), row['name'], row['type'], parse_date(row['created_at']))
+
+
+def _tool_metric(row):
+    # only tools in storage have a meaningful location
+    location = row['storage_location'] if row['status'] == 'in storage' else "N/A"
+    return (int(row['id']), int(row['tool_id']), row['status'], location, int(row['wear_level']))
+
+
+def _tool_assignment(row):
+    return (int(row['id']), int(row['machine_id']), int(row['tool_id']))
+
+
+def _user(row):
+    return (int(row['id']), row['username'], row['firstname'], row['lastname'],
+            parse_date(row['created_at']))
+
+
+def _maintenance_log(row):
+    return (int(row['id']), int(row['machine_id']), int(row['performed_by']),
+            parse_date(row['date']), row['notes'], row['planned'].lower() == 'true')
+
+
+def _machine_metric(row):
+    return (int(row['id']), int(row['machine_id']), parse_date(row['timestamp']),
+            float(row['oee']), float(row['availability']), float(row['performance']),
+            float(row['output_quality']), row['status'])
+
+
+# parents first: referenced tables must be loaded before the tables pointing at them
+CSV_SOURCES = [
+    CsvSource('machines.csv', Machine, _machine),
+    CsvSource('tools.csv', Tool, _tool),
+    CsvSource('tool_metrics.csv', ToolMetric, _tool_metric),
+    CsvSource('tool_assignments.csv', ToolAssignment, _tool_assignment),
+    CsvSource('users.csv', User, _user),
+    CsvSource('maintenance_logs.csv', MaintenanceLog, _maintenance_log),
+    CsvSource('machine_metrics.csv', MachineMetric, _machine_metric),
+]
+
+SOURCES_BY_NAME = {source.name: source for source in CSV_SOURCES}
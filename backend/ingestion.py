@@ -0,0 +1,399 @@
+"""
+Parsing, validation and insertion of machine metric readings pushed by shop-floor collectors.
+
+WHY: Collectors send thousands of readings at once. Each field is validated column by column
+(machine ids with one set-based query) and the rows are written with multi-row INSERT
+statements, so the cost per reading stays a few microseconds.
+"""
+import io
+import csv
+import json
+import time
+import atexit
+import threading
+from collections import deque
+from sqlalchemy import select
+from sqlalchemy.exc import DataError, IntegrityError
+from importer import DEFAULT_BATCH_SIZE, parse_date
+from importer.loader import batched
+from timeseries import to_utc
+from models import db, Machine, MachineMetric
+import projections
+
+METRIC_FIELDS = ['machine_id', 'timestamp', 'oee', 'availability', 'performance', 'output_quality', 'status']
+KPI_FIELDS = ['oee', 'availability', 'performance', 'output_quality']
+# readings accepted in one request
+MAX_BATCH_ROWS = 100000
+# validation errors returned to the client, the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+# write-behind buffer defaults, overridden by the METRIC_BUFFER_* config keys
+BUFFER_MAX_SIZE = 100000
+BUFFER_BATCH_SIZE = 5000
+BUFFER_FLUSH_INTERVAL = 1.0
+BUFFER_PUT_TIMEOUT = 2.0
+# seconds close() waits for the last batches when the process exits
+BUFFER_CLOSE_TIMEOUT = 10.0
+# attempts of a batch failing for another reason than its rows (lost connection, ...)
+BUFFER_WRITE_ATTEMPTS = 3
+# readings that could not be written, kept for GET /machine-metrics/buffer
+BUFFER_DEAD_LETTERS = 100
+# guards the creation of the buffer of each application
+_buffers_lock = threading.Lock()
+
+
+class InvalidReadings(ValueError):
+    """
+    Raised when a batch holds invalid readings, nothing of the batch is written.
+
+    @param errors List of {"row", "field", "error"} dicts, rows numbered from 0
+    """
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid value(s)")
+        self.errors = errors
+
+
+def parse_readings(body, mimetype):
+    """
+    Decodes a request body into a list of reading dicts.
+
+    @param body Raw request body (bytes)
+    @param mimetype application/json (array of objects), application/x-ndjson (one object per line)
+                    or text/csv (header line with the METRIC_FIELDS)
+    @return List of dicts, values still unconverted
+    """
+    text = body.decode('utf-8-sig')
+    if mimetype == 'text/csv':
+        return list(csv.DictReader(io.StringIO(text)))
+    if mimetype in ('application/x-ndjson', 'application/jsonl'):
+        readings = [json.loads(line) for line in text.splitlines() if line.strip()]
+    elif mimetype == 'application/json':
+        readings = json.loads(text)
+        if not isinstance(readings, list):
+            raise ValueError("JSON body must be an array of readings")
+    else:
+        raise ValueError(f"Unsupported content type '{mimetype}'. Use application/json, application/x-ndjson or text/csv.")
+    if not all(isinstance(reading, dict) for reading in readings):
+        raise ValueError("Every reading must be a JSON object")
+    return readings
+
+
+def _integer(value):
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError("must be an integer")
+    return int(value)
+
+
+def _kpi(value):
+    if isinstance(value, bool):
+        raise ValueError("must be a number")
+    number = float(value)
+    if not 0 <= number <= 100:
+        raise ValueError("must be between 0 and 100")
+    return number
+
+
+def _timestamp(value):
+    if not isinstance(value, str):
+        raise ValueError("must be an ISO date or timestamp string")
+    return to_utc(parse_date(value))
+
+
+def _status(value):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError("must be a non-empty string")
+    if len(value) > MachineMetric.__table__.c.status.type.length:
+        raise ValueError("is too long")
+    return value
+
+
+CONVERTERS = {
+    'machine_id': _integer,
+    'timestamp': _timestamp,
+    **{kpi: _kpi for kpi in KPI_FIELDS},
+    'status': _status,
+}
+
+
+def validate_readings(connection, readings, known_machines=None):
+    """
+    Converts and validates readings field by field.
+
+    @param connection SQLAlchemy connection or session used to check that the machines exist
+    @param readings List of dicts from parse_readings()
+    @param known_machines Optional set of machine ids known to exist, only the others are
+                          looked up and the ones found are added to it
+    @return List of dicts holding the machine_metrics columns (without id)
+    @raise InvalidReadings listing every invalid value
+    """
+    errors = []
+    columns = {}
+    for field, convert in CONVERTERS.items():
+        converted = []
+        for row, value in enumerate(reading.get(field) for reading in readings):
+            if value is None or value == '':
+                errors.append({"row": row, "field": field, "error": "is missing"})
+                converted.append(None)
+                continue
+            try:
+                converted.append(convert(value))
+            except (TypeError, ValueError) as e:
+                errors.append({"row": row, "field": field, "error": str(e)})
+                converted.append(None)
+        columns[field] = converted
+
+    # one lookup for all the machines of the batch
+    known = known_machines if known_machines is not None else set()
+    machine_ids = set(columns['machine_id']) - {None} - known
+    if machine_ids:
+        known.update(connection.execute(select(Machine.id).where(Machine.id.in_(machine_ids))).scalars())
+    errors += [
+        {"row": row, "field": 'machine_id', "error": f"unknown machine {machine_id}"}
+        for row, machine_id in enumerate(columns['machine_id'])
+        if machine_id is not None and machine_id not in known
+    ]
+
+    if errors:
+        raise InvalidReadings(sorted(errors, key=lambda error: error["row"]))
+    return [dict(zip(METRIC_FIELDS, values)) for values in zip(*(columns[field] for field in METRIC_FIELDS))]
+
+
+def insert_readings(connection, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Writes validated readings and updates the projections, the caller owns the transaction.
+
+    WHY: The projections need the ids, so rows go through INSERT ... RETURNING, which SQLAlchemy
+    sends as multi-row VALUES statements of up to batch_size rows. Whole rows are returned
+    because the database does not promise to return them in the order of the VALUES.
+
+    @param rows List of dicts from validate_readings()
+    @return Inserted rows as dicts, id included
+    """
+    table = MachineMetric.__table__
+    statement = table.insert().returning(*table.c)
+    written = []
+    for batch in batched(rows, batch_size):
+        written += [dict(row) for row in connection.execute(statement, batch).mappings()]
+    projections.metrics_written(connection, written)
+    return written
+
+
+class BufferFull(Exception):
+    """
+    Raised by MetricBuffer.put() when the buffer stayed full for the whole timeout.
+    """
+
+
+class MetricBuffer:
+    """
+    Write-behind buffer for readings posted one at a time.
+
+    WHY: One transaction per reading caps single-reading POSTs at a few hundred per second.
+    Readings are acknowledged once queued and a background thread writes them with
+    insert_readings(), one transaction per batch, when batch_size readings are waiting or
+    flush_interval seconds have passed. max_size bounds the memory used: when the buffer is
+    full put() waits up to put_timeout seconds, then raises BufferFull so clients back off.
+    Readings still queued when the process is killed are lost (clean exits flush them).
+
+    A batch rejected because of its rows (a machine deleted since validation, ...) is split
+    in halves until the bad readings are isolated, only those are dropped (dead_letters).
+    Other errors are retried BUFFER_WRITE_ATTEMPTS times before the batch is dropped.
+    known_machines caches the machine ids seen by validate_readings() so that single
+    readings are accepted without a query.
+
+    @param app Flask application the readings are written with
+    """
+
+    def __init__(self, app, max_size=BUFFER_MAX_SIZE, batch_size=BUFFER_BATCH_SIZE,
+                 flush_interval=BUFFER_FLUSH_INTERVAL, put_timeout=BUFFER_PUT_TIMEOUT):
+        self.app = app
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+
+        self._rows = deque()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)  # a batch is waiting, or a flush/close was asked
+        self._not_full = threading.Condition(self._lock)
+        self._drained = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = None
+        self.known_machines = set()
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.rejected = 0
+        self.dead_letters = deque(maxlen=BUFFER_DEAD_LETTERS)
+        self.last_flush_seconds = None
+        self.max_flush_seconds = 0.0
+        self._total_flush_seconds = 0.0
+
+    @classmethod
+    def for_app(cls, app):
+        """
+        Buffer of an application, created (from its METRIC_BUFFER_* config) on first use.
+        """
+        with _buffers_lock:
+            buffer = app.extensions.get('metric_buffer')
+            if buffer is None:
+                buffer = app.extensions['metric_buffer'] = cls(
+                    app,
+                    max_size=app.config.get('METRIC_BUFFER_SIZE', BUFFER_MAX_SIZE),
+                    batch_size=app.config.get('METRIC_BUFFER_BATCH_SIZE', BUFFER_BATCH_SIZE),
+                    flush_interval=app.config.get('METRIC_BUFFER_FLUSH_INTERVAL', BUFFER_FLUSH_INTERVAL),
+                    put_timeout=app.config.get('METRIC_BUFFER_PUT_TIMEOUT', BUFFER_PUT_TIMEOUT),
+                )
+            return buffer
+
+    def put(self, row):
+        """
+        Queues one validated reading (a dict from validate_readings()).
+
+        @return Number of readings waiting after this one
+        @raise BufferFull when no room was made within put_timeout seconds
+        """
+        with self._lock:
+            if self._closed:
+                raise BufferFull("Metric buffer is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='metric-buffer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close, BUFFER_CLOSE_TIMEOUT)
+
+            if not self._not_full.wait_for(lambda: len(self._rows) < self.max_size, self.put_timeout):
+                self.rejected += 1
+                raise BufferFull(f"Metric buffer is full ({self.max_size} readings waiting)")
+            self._rows.append(row)
+            if len(self._rows) >= self.batch_size:
+                self._ready.notify()
+            return len(self._rows)
+
+    def flush(self, timeout=None):
+        """
+        Writes the waiting readings now and blocks until they are in the database.
+
+        @return False if the timeout expired first
+        """
+        with self._lock:
+            if self._thread is None:
+                return True
+            self._flush_requested = True
+            self._ready.notify()
+            return self._drained.wait_for(lambda: not self._rows and not self._in_flight, timeout)
+
+    def close(self, timeout=None):
+        """
+        Writes the waiting readings and stops the background thread, later put() calls fail.
+        """
+        with self._lock:
+            self._closed = True
+            self._ready.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self):
+        """
+        Queue depth and flush metrics, as reported by GET /machine-metrics/buffer.
+        """
+        with self._lock:
+            return {
+                "queue_depth": len(self._rows),
+                "in_flight": self._in_flight,
+                "max_size": self.max_size,
+                "batch_size": self.batch_size,
+                "flush_interval_seconds": self.flush_interval,
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+                "rows_failed": self.rows_failed,
+                "rejected": self.rejected,
+                "dead_letters": [
+                    {"reading": {**row, "timestamp": row['timestamp'].isoformat()}, "error": error}
+                    for row, error in self.dead_letters
+                ],
+                "last_flush_seconds": self.last_flush_seconds,
+                "avg_flush_seconds": self._total_flush_seconds / self.flushes if self.flushes else None,
+                "max_flush_seconds": self.max_flush_seconds,
+            }
+
+    def _next_batch(self):
+        # waits for a full batch, the timer, a flush or close; None once closed and drained
+        with self._lock:
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._rows) < self.batch_size and not (self._flush_requested or self._closed):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._ready.wait(remaining)
+
+            if not self._rows:
+                self._flush_requested = False
+                self._drained.notify_all()
+                return None if self._closed else []
+            batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+            self._in_flight = len(batch)
+            self._not_full.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        started = time.monotonic()
+        with self.app.app_context():
+            try:
+                written = self._write_rows(batch)
+            finally:
+                db.session.remove()
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.flushes += 1
+            self.rows_written += written
+            self.rows_failed += len(batch) - written
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            self._total_flush_seconds += elapsed
+            self._in_flight = 0
+            self._drained.notify_all()
+
+    def _write_rows(self, rows, attempt=1):
+        # one transaction for the rows, returns the number written
+        try:
+            insert_readings(db.session.connection(), rows)
+            db.session.commit()
+            return len(rows)
+        except (IntegrityError, DataError) as e:
+            db.session.rollback()
+            if len(rows) == 1:
+                self._dead_letter(rows[0], e)
+                return 0
+            # isolate the bad readings, the others are written
+            half = len(rows) // 2
+            return self._write_rows(rows[:half]) + self._write_rows(rows[half:])
+        except Exception as e:
+            db.session.rollback()
+            if attempt < BUFFER_WRITE_ATTEMPTS:
+                time.sleep(min(self.flush_interval, 1.0) * attempt)
+                return self._write_rows(rows, attempt + 1)
+            self.app.logger.exception("Could not write %d buffered machine metrics", len(rows))
+            for row in rows:
+                self._dead_letter(row, e)
+            return 0
+
+    def _dead_letter(self, row, error):
+        self.app.logger.error("Dropped buffered machine metric %s: %s", row, error)
+        # the machine may have been deleted since it was cached
+        self.known_machines.discard(row['machine_id'])
+        with self._lock:
+            self.dead_letters.append((row, str(getattr(error, 'orig', error))))
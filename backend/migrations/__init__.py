@@ -0,0 +1,51 @@
+"""
+Schema migrations for existing databases.
+
+WHY: db.create_all() only creates missing tables, it never changes a table that already
+exists. Changes to existing tables (new indexes, ...) are applied here, in order, and
+recorded in the schema_migrations table so each one runs once.
+
+Run with: python -m migrations (or: flask --app app schema upgrade)
+"""
+from datetime import datetime
+from sqlalchemy import Column, DateTime, MetaData, String, Table, select
+from . import m0001_hot_path_indexes, m0002_machine_latest_status, m0003_machine_metric_rollups, \
+    m0004_fleet_rollup_index, m0005_keyset_pagination_indexes, m0006_machine_fleet_rollups
+
+# (version, module with an upgrade(connection) function), oldest first
+MIGRATIONS = [
+    ('0001_hot_path_indexes', m0001_hot_path_indexes),
+    ('0002_machine_latest_status', m0002_machine_latest_status),
+    ('0003_machine_metric_rollups', m0003_machine_metric_rollups),
+    ('0004_fleet_rollup_index', m0004_fleet_rollup_index),
+    ('0005_keyset_pagination_indexes', m0005_keyset_pagination_indexes),
+    ('0006_machine_fleet_rollups', m0006_machine_fleet_rollups),
+]
+
+# kept out of db.metadata so that drop_all() in /import-csv leaves it alone
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', String(100), primary_key=True),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def run_migrations(engine):
+    """
+    Applies the migrations not yet recorded in schema_migrations.
+
+    @param engine SQLAlchemy engine of the database to upgrade
+    @return Versions applied by this call
+    """
+    applied = []
+    with engine.begin() as connection:
+        schema_migrations.create(connection, checkfirst=True)
+        done = set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+        for version, migration in MIGRATIONS:
+            if version in done:
+                continue
+            migration.upgrade(connection)
+            connection.execute(schema_migrations.insert().values(version=version, applied_at=datetime.utcnow()))
+            applied.append(version)
+    return applied
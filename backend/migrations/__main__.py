@@ -0,0 +1,9 @@
+from app import create_app
+from models import db
+from migrations import run_migrations
+
+with create_app(config={'CREATE_SCHEMA_ON_STARTUP': False}).app_context():
+    db.create_all(bind_key=None)
+    applied = run_migrations(db.engine)
+
+print(f"Applied migrations: {', '.join(applied)}" if applied else "Database is up to date")
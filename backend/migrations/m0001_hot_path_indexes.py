@@ -0,0 +1,33 @@
+"""
+Indexes behind the dashboard, maintenance and tool endpoints.
+
+- machine_metrics (machine_id, timestamp DESC): dashboard series and latest status per machine
+- maintenance_logs (machine_id, date): maintenance history of a machine
+- maintenance_logs (performed_by): logs of a user
+- tool_metrics (tool_id): metrics of the tools listed by /tools
+"""
+from models import MachineMetric, MaintenanceLog, ToolMetric
+
+INDEX_NAMES = {
+    'ix_machine_metrics_machine_id_timestamp',
+    'ix_maintenance_logs_machine_id_date',
+    'ix_maintenance_logs_performed_by',
+    'ix_tool_metrics_tool_id',
+}
+
+INDEXES = [
+    index
+    for model in (MachineMetric, MaintenanceLog, ToolMetric)
+    for index in model.__table__.indexes
+    if index.name in INDEX_NAMES
+]
+
+
+def upgrade(connection):
+    for index in sorted(INDEXES, key=lambda index: index.name):
+        index.create(connection, checkfirst=True)
+
+
+def downgrade(connection):
+    for index in INDEXES:
+        index.drop(connection, checkfirst=True)
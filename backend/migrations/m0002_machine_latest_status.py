@@ -0,0 +1,14 @@
+"""
+machine_latest_status projection, backfilled from the existing machine_metrics.
+"""
+from models import MachineLatestStatus
+from projections import refresh_latest_status
+
+
+def upgrade(connection):
+    MachineLatestStatus.__table__.create(connection, checkfirst=True)
+    refresh_latest_status(connection)
+
+
+def downgrade(connection):
+    MachineLatestStatus.__table__.drop(connection, checkfirst=True)
@@ -0,0 +1,14 @@
+"""
+machine_metric_rollups table, backfilled from the existing machine_metrics.
+"""
+from models import MachineMetricRollup
+from projections import refresh_rollups
+
+
+def upgrade(connection):
+    MachineMetricRollup.__table__.create(connection, checkfirst=True)
+    refresh_rollups(connection)
+
+
+def downgrade(connection):
+    MachineMetricRollup.__table__.drop(connection, checkfirst=True)
@@ -0,0 +1,15 @@
+"""
+machine_metric_rollups (granularity, bucket_start) index behind the fleet dashboard.
+"""
+from models import MachineMetricRollup
+
+INDEX_NAME = 'ix_machine_metric_rollups_granularity_bucket_start'
+INDEX = next(index for index in MachineMetricRollup.__table__.indexes if index.name == INDEX_NAME)
+
+
+def upgrade(connection):
+    INDEX.create(connection, checkfirst=True)
+
+
+def downgrade(connection):
+    INDEX.drop(connection, checkfirst=True)
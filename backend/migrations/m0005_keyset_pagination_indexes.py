@@ -0,0 +1,28 @@
+"""
+Indexes behind the keyset pagination of /machines and /tools sorted by name or creation date.
+"""
+from models import Machine, Tool
+
+INDEX_NAMES = {
+    'ix_machines_name_id',
+    'ix_machines_created_at_id',
+    'ix_tools_name_id',
+    'ix_tools_created_at_id',
+}
+
+INDEXES = [
+    index
+    for model in (Machine, Tool)
+    for index in model.__table__.indexes
+    if index.name in INDEX_NAMES
+]
+
+
+def upgrade(connection):
+    for index in sorted(INDEXES, key=lambda index: index.name):
+        index.create(connection, checkfirst=True)
+
+
+def downgrade(connection):
+    for index in INDEXES:
+        index.drop(connection, checkfirst=True)
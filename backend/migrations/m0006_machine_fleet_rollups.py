@@ -0,0 +1,14 @@
+"""
+machine_fleet_rollups table, backfilled from machine_metric_rollups.
+"""
+from models import MachineFleetRollup
+from projections import refresh_fleet_rollups
+
+
+def upgrade(connection):
+    MachineFleetRollup.__table__.create(connection, checkfirst=True)
+    refresh_fleet_rollups(connection)
+
+
+def downgrade(connection):
+    MachineFleetRollup.__table__.drop(connection, checkfirst=True)
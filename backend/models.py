@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
+from routing import RoutingSession
 
-db = SQLAlchemy()
+# GET requests read from the replica bind when one is configured (see routing.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Machine(db.Model):
@@ -17,6 +19,12 @@ class Machine(db.Model):
     manufacturer = db.Column(db.String(100), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False)
 
+    # keyset pagination of /machines sorted by name or creation date
+    __table_args__ = (
+        db.Index('ix_machines_name_id', name, id),
+        db.Index('ix_machines_created_at_id', created_at, id),
+    )
+
 class User(db.Model):
     """
     Stores user credentials and roles.
@@ -38,7 +46,7 @@ class ToolMetric(db.Model):
     """
     __tablename__ = 'tool_metrics'
     id = db.Column(db.Integer, primary_key=True)
-    tool_id = db.Column(db.Integer, db.ForeignKey('tools.id'), nullable=False)
+    tool_id = db.Column(db.Integer, db.ForeignKey('tools.id'), nullable=False, index=True)
     status = db.Column(db.String(50), nullable=False)
     storage_location = db.Column(db.String(100), nullable=False)
     wear_level = db.Column(db.Integer, nullable=False)
@@ -56,6 +64,12 @@ class Tool(db.Model):
     created_at = db.Column(db.DateTime, nullable=False) #default=datetime.now()
     metrics = db.relationship('ToolMetric', backref='tool', lazy=True)
 
+    # keyset pagination of /tools sorted by name or creation date
+    __table_args__ = (
+        db.Index('ix_tools_name_id', name, id),
+        db.Index('ix_tools_created_at_id', created_at, id),
+    )
+
 class MaintenanceLog(db.Model):
     """
     Logs a maintenance action performed on a machine.
@@ -65,12 +79,17 @@ class MaintenanceLog(db.Model):
     __tablename__ = 'maintenance_logs'
     id = db.Column(db.Integer, primary_key=True)
     machine_id = db.Column(db.Integer, db.ForeignKey('machines.id'),nullable=False)
-    performed_by = db.Column(db.Integer, db.ForeignKey('users.id'),nullable=False)
+    performed_by = db.Column(db.Integer, db.ForeignKey('users.id'),nullable=False, index=True)
     date = db.Column(db.DateTime, nullable=False) #default=datetime.now()
     notes = db.Column(db.Text)
     planned = db.Column(db.Boolean, nullable=False)
     performer = db.relationship('User', backref='maintenance_logs')
 
+    # maintenance history of one machine, ordered by date
+    __table_args__ = (
+        db.Index('ix_maintenance_logs_machine_id_date', machine_id, date),
+    )
+
 class MachineMetric(db.Model):
     """
     Daily performance metrics for a machine.
@@ -87,6 +106,76 @@ class MachineMetric(db.Model):
     output_quality = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(50), nullable=False)
 
+    # dashboard series and latest status of one machine, newest first
+    __table_args__ = (
+        db.Index('ix_machine_metrics_machine_id_timestamp', machine_id, timestamp.desc()),
+    )
+
+class MachineLatestStatus(db.Model):
+    """
+    Copy of the latest metric of each machine (highest metric id).
+
+    WHY: Lets the machine list read the current status with a primary-key join instead of
+    scanning the whole metric history. Maintained by projections.py on every metric insert and import.
+    """
+    __tablename__ = 'machine_latest_status'
+    machine_id = db.Column(db.Integer, db.ForeignKey('machines.id'), primary_key=True)
+    metric_id = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    oee = db.Column(db.Float, nullable=False)
+    availability = db.Column(db.Float, nullable=False)
+    performance = db.Column(db.Float, nullable=False)
+    output_quality = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+
+class MachineMetricRollup(db.Model):
+    """
+    Count/sum/min/max of the KPIs of a machine per day, week (starting Monday) or month.
+
+    WHY: Bucketed dashboard series read one row per bucket instead of every raw metric.
+    Refreshed incrementally by projections.py when metrics are written or imported.
+    """
+    __tablename__ = 'machine_metric_rollups'
+    machine_id = db.Column(db.Integer, db.ForeignKey('machines.id'), primary_key=True)
+    granularity = db.Column(db.String(10), primary_key=True)  # day, week or month
+    bucket_start = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    oee_sum = db.Column(db.Float, nullable=False)
+    oee_min = db.Column(db.Float, nullable=False)
+    oee_max = db.Column(db.Float, nullable=False)
+    availability_sum = db.Column(db.Float, nullable=False)
+    availability_min = db.Column(db.Float, nullable=False)
+    availability_max = db.Column(db.Float, nullable=False)
+    performance_sum = db.Column(db.Float, nullable=False)
+    performance_min = db.Column(db.Float, nullable=False)
+    performance_max = db.Column(db.Float, nullable=False)
+    output_quality_sum = db.Column(db.Float, nullable=False)
+    output_quality_min = db.Column(db.Float, nullable=False)
+    output_quality_max = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        # fleet-wide reads: every machine over a range of buckets
+        db.Index('ix_machine_metric_rollups_granularity_bucket_start', granularity, bucket_start),
+    )
+
+class MachineFleetRollup(db.Model):
+    """
+    Record count and KPI sums of every machine group, category and manufacturer per day, week or month.
+
+    WHY: The group levels of the fleet dashboard read a few rows per bucket instead of one per machine.
+    Kept in step with machine_metric_rollups by projections.py.
+    """
+    __tablename__ = 'machine_fleet_rollups'
+    granularity = db.Column(db.String(10), primary_key=True)  # day, week or month
+    bucket_start = db.Column(db.Date, primary_key=True)
+    grouping = db.Column(db.String(20), primary_key=True)  # group, category or manufacturer
+    name = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    oee_sum = db.Column(db.Float, nullable=False)
+    availability_sum = db.Column(db.Float, nullable=False)
+    performance_sum = db.Column(db.Float, nullable=False)
+    output_quality_sum = db.Column(db.Float, nullable=False)
+
 class ToolAssignment(db.Model):
     """
     Represents a fixed assignment between a tool and a machine.
@@ -0,0 +1,109 @@
+"""
+Page parameters and keyset (cursor) pagination shared by the list endpoints.
+
+WHY: OFFSET makes the database walk every skipped row and paginate() adds a COUNT(*) to
+each page. A cursor holding the sort key of the last row continues with an index range
+scan, so deep pages cost the same as the first one, and count=false skips the COUNT.
+"""
+import json
+import base64
+from datetime import datetime
+from flask import request
+from sqlalchemy import DateTime, tuple_
+from models import db
+
+DEFAULT_PER_PAGE = 30
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """
+    Opaque cursor string holding the sort key of a row.
+    """
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """
+    Sort key held by a cursor, converted for the given sort columns.
+
+    @raise InvalidCursor when the cursor was not made by encode_cursor() for these columns
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("wrong number of values")
+        return tuple(
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+            for column, value in zip(columns, values)
+        )
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(f"Invalid cursor '{cursor}'.") from e
+
+
+def parse_page_args(sortable):
+    """
+    Reads the page, per_page, cursor, sort, order and count query parameters.
+
+    Pages are read by cursor as soon as a cursor parameter is given (empty for the first page).
+
+    @param sortable Dict mapping the accepted sort names to their column, 'id' must be one of them
+    @return (dict with page, per_page, keyset, columns, cursor, descending and count; error message)
+    """
+    sort = request.args.get('sort', 'id')
+    order = request.args.get('order', 'asc')
+    if sort not in sortable:
+        return None, f"Invalid sort '{sort}'. Must be one of {list(sortable)}."
+    if order not in ('asc', 'desc'):
+        return None, f"Invalid order '{order}'. Must be asc or desc."
+
+    per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    # the id breaks ties so that every row has its own sort key
+    columns = [sortable[sort]] if sort == 'id' else [sortable[sort], sortable['id']]
+    args = {
+        "page": max(request.args.get('page', 1, type=int), 1),
+        "per_page": per_page if per_page > 0 else DEFAULT_PER_PAGE,
+        "keyset": 'cursor' in request.args,
+        "columns": columns,
+        "cursor": None,
+        "descending": order == 'desc',
+        "count": request.args.get('count', 'true').lower() not in ('false', '0', 'no'),
+    }
+    if request.args.get('cursor'):
+        try:
+            args["cursor"] = decode_cursor(request.args['cursor'], columns)
+        except InvalidCursor as e:
+            return None, str(e)
+    return args, None
+
+
+def page_rows(statement, args, key):
+    """
+    Runs the query of one page, by cursor or by offset depending on the parameters.
+
+    @param statement select() of the rows, without ORDER BY or LIMIT
+    @param args Dict from parse_page_args()
+    @param key Function giving the values of args["columns"] for a result row
+    @return (rows of the page, cursor of the next page or None; always None with offsets)
+    """
+    columns = args["columns"]
+    per_page = args["per_page"]
+    order = [column.desc() if args["descending"] else column for column in columns]
+    statement = statement.order_by(*order)
+
+    if not args["keyset"]:
+        return db.session.execute(statement.limit(per_page).offset((args["page"] - 1) * per_page)).all(), None
+
+    if args["cursor"] is not None:
+        after = tuple_(*columns) < tuple_(*args["cursor"]) if args["descending"] else tuple_(*columns) > tuple_(*args["cursor"])
+        statement = statement.where(after)
+    # one extra row tells whether there is a next page
+    rows = db.session.execute(statement.limit(per_page + 1)).all()
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    return rows, encode_cursor(key(rows[-1]))
@@ -0,0 +1,373 @@
+"""
+Read-side projections derived from machine_metrics.
+
+WHY: Listing machines only needs the current status of each one, and dashboards only need
+one point per day/week/month. Keeping machine_latest_status, machine_metric_rollups and
+machine_fleet_rollups up to date when metrics are written makes reads independent of the
+history size.
+"""
+from datetime import datetime, time
+from sqlalchemy import String, event, func, inspect, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import Machine, MachineMetric, MachineLatestStatus, MachineMetricRollup, MachineFleetRollup
+from timeseries import BUCKETS, bucket_floor, bucket_start
+import events
+import cache
+
+# dialects offering INSERT ... ON CONFLICT DO UPDATE
+_INSERT_CONSTRUCTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+LATEST_STATUS_COLUMNS = ['timestamp', 'oee', 'availability', 'performance', 'output_quality', 'status']
+ROLLUP_KPIS = ['oee', 'availability', 'performance', 'output_quality']
+# machine attributes machine_fleet_rollups sums the rollups over
+FLEET_GROUPINGS = ['group', 'category', 'manufacturer']
+FLEET_ROLLUP_COLUMNS = ['count', *[f'{kpi}_sum' for kpi in ROLLUP_KPIS]]
+
+
+def refresh_latest_status(connection, machine_ids=None):
+    """
+    Rebuilds machine_latest_status from machine_metrics.
+
+    @param connection SQLAlchemy connection, the caller owns the transaction
+    @param machine_ids Machines to refresh, None to rebuild the whole table (after an import)
+    """
+    projection = MachineLatestStatus.__table__
+    metrics = MachineMetric.__table__
+
+    latest = select(metrics.c.machine_id, func.max(metrics.c.id).label('metric_id')).group_by(metrics.c.machine_id)
+    delete = projection.delete()
+    if machine_ids is not None:
+        machine_ids = list(machine_ids)
+        latest = latest.where(metrics.c.machine_id.in_(machine_ids))
+        delete = delete.where(projection.c.machine_id.in_(machine_ids))
+    latest = latest.subquery()
+
+    rows = (
+        select(metrics.c.machine_id, metrics.c.id, *[metrics.c[name] for name in LATEST_STATUS_COLUMNS])
+        .join(latest, metrics.c.id == latest.c.metric_id)
+    )
+    connection.execute(delete)
+    connection.execute(projection.insert().from_select(['machine_id', 'metric_id', *LATEST_STATUS_COLUMNS], rows))
+
+
+def latest_status_for(connection, machine_ids):
+    """
+    Reads the latest status of the given machines straight from machine_metrics.
+
+    WHY: Only the metrics of the given machines are ranked (ROW_NUMBER per machine, found
+    through the machine_id index), so the cost follows the page size and not the history.
+    Used for machines missing from the projection, e.g. metrics written by another tool
+    directly in the database.
+
+    @return Dict mapping machine id to its latest status
+    """
+    metrics = MachineMetric.__table__
+    ranked = (
+        select(
+            metrics.c.machine_id,
+            metrics.c.status,
+            func.row_number().over(partition_by=metrics.c.machine_id, order_by=metrics.c.id.desc()).label('rank')
+        )
+        .where(metrics.c.machine_id.in_(list(machine_ids)))
+        .subquery()
+    )
+    query = select(ranked.c.machine_id, ranked.c.status).where(ranked.c.rank == 1)
+    return dict(connection.execute(query).all())
+
+
+def record_latest_status(connection, metrics):
+    """
+    Updates machine_latest_status with freshly written metrics.
+
+    @param connection SQLAlchemy connection used for the metric insert
+    @param metrics Iterable of dicts holding the machine_metrics columns (id included)
+    """
+    latest = {}
+    for metric in metrics:
+        current = latest.get(metric['machine_id'])
+        if current is None or metric['id'] > current['id']:
+            latest[metric['machine_id']] = metric
+    if not latest:
+        return
+
+    dialect = connection.dialect.name
+    if dialect not in _INSERT_CONSTRUCTS:
+        refresh_latest_status(connection, latest.keys())
+        return
+
+    projection = MachineLatestStatus.__table__
+    statement = _INSERT_CONSTRUCTS[dialect](projection)
+    statement = statement.on_conflict_do_update(
+        index_elements=[projection.c.machine_id],
+        set_={name: statement.excluded[name] for name in ['metric_id', *LATEST_STATUS_COLUMNS]},
+        # an older metric written late must not replace a newer status
+        where=statement.excluded.metric_id >= projection.c.metric_id
+    )
+    connection.execute(statement, [
+        {'machine_id': m['machine_id'], 'metric_id': m['id'], **{name: m[name] for name in LATEST_STATUS_COLUMNS}}
+        for m in latest.values()
+    ])
+
+
+def refresh_rollups(connection, machine_ids=None, since=None):
+    """
+    Recomputes machine_metric_rollups from machine_metrics, for every granularity of BUCKETS.
+
+    WHY: Only the buckets that can have changed are deleted and aggregated again (one
+    GROUP BY per granularity). Used after imports, updates and deletes: appends go through
+    add_to_rollups() instead, whose cost does not grow with the records of the buckets.
+    A refresh of some machines also moves their totals in machine_fleet_rollups, a full one
+    leaves it to refresh_fleet_rollups().
+
+    @param connection SQLAlchemy connection, the caller owns the transaction
+    @param machine_ids Machines to refresh, None for every machine
+    @param since Oldest timestamp written, None to rebuild the whole history (after an import)
+    """
+    rollups = MachineMetricRollup.__table__
+    fleet = MachineFleetRollup.__table__
+    metrics = MachineMetric.__table__
+    dialect = connection.dialect.name
+    if machine_ids is not None:
+        machine_ids = list(machine_ids)
+
+    aggregates = [func.count().label('count')]
+    for kpi in ROLLUP_KPIS:
+        aggregates += [
+            func.sum(metrics.c[kpi]).label(f'{kpi}_sum'),
+            func.min(metrics.c[kpi]).label(f'{kpi}_min'),
+            func.max(metrics.c[kpi]).label(f'{kpi}_max'),
+        ]
+
+    for bucket in BUCKETS:
+        start = bucket_start(dialect, bucket, metrics.c.timestamp)
+        rows = (
+            select(metrics.c.machine_id, literal(bucket, String).label('granularity'),
+                   start.label('bucket_start'), *aggregates)
+            .group_by(metrics.c.machine_id, start)
+        )
+        refreshed = [rollups.c.granularity == bucket]
+        if machine_ids is not None:
+            rows = rows.where(metrics.c.machine_id.in_(machine_ids))
+            refreshed.append(rollups.c.machine_id.in_(machine_ids))
+        if since is not None:
+            first = bucket_floor(bucket, since)
+            rows = rows.where(metrics.c.timestamp >= datetime.combine(first, time()))
+            refreshed.append(rollups.c.bucket_start >= first)
+
+        # the fleet totals lose the old buckets of the machines and gain the new ones
+        incremental = machine_ids is not None and dialect in _INSERT_CONSTRUCTS
+        if incremental:
+            add_fleet_totals(connection, refreshed, -1)
+        connection.execute(rollups.delete().where(*refreshed))
+        connection.execute(rollups.insert().from_select([column.name for column in rows.selected_columns], rows))
+        if incremental:
+            add_fleet_totals(connection, refreshed)
+            connection.execute(fleet.delete().where(fleet.c.granularity == bucket, fleet.c.count == 0,
+                                                    *([fleet.c.bucket_start >= first] if since is not None else [])))
+
+    if machine_ids is not None and dialect not in _INSERT_CONSTRUCTS:
+        refresh_fleet_rollups(connection)
+
+
+def add_to_rollups(connection, metrics):
+    """
+    Adds freshly inserted metrics to machine_metric_rollups and machine_fleet_rollups.
+
+    WHY: An append only raises the count, sums, minimums and maximums of its buckets, so
+    they are upserted (ON CONFLICT DO UPDATE) from the new rows alone, without reading
+    the records already in the buckets.
+
+    @param connection SQLAlchemy connection, the caller owns the transaction
+    @param metrics List of dicts holding the machine_metrics columns
+    """
+    dialect = connection.dialect.name
+    if dialect not in _INSERT_CONSTRUCTS:
+        refresh_rollups(connection, {m['machine_id'] for m in metrics}, since=min(m['timestamp'] for m in metrics))
+        return
+
+    totals = {}
+    for metric in metrics:
+        for bucket in BUCKETS:
+            key = (metric['machine_id'], bucket, bucket_floor(bucket, metric['timestamp']))
+            total = totals.get(key)
+            if total is None:
+                total = totals[key] = {'machine_id': key[0], 'granularity': bucket, 'bucket_start': key[2], 'count': 0}
+                for kpi in ROLLUP_KPIS:
+                    total.update({f'{kpi}_sum': 0, f'{kpi}_min': metric[kpi], f'{kpi}_max': metric[kpi]})
+            total['count'] += 1
+            for kpi in ROLLUP_KPIS:
+                total[f'{kpi}_sum'] += metric[kpi]
+                total[f'{kpi}_min'] = min(total[f'{kpi}_min'], metric[kpi])
+                total[f'{kpi}_max'] = max(total[f'{kpi}_max'], metric[kpi])
+
+    rollups = MachineMetricRollup.__table__
+    # scalar min()/max() of SQLite, least()/greatest() of PostgreSQL
+    least, greatest = (func.least, func.greatest) if dialect == 'postgresql' else (func.min, func.max)
+    statement = _INSERT_CONSTRUCTS[dialect](rollups)
+    merged = {'count': rollups.c.count + statement.excluded.count}
+    for kpi in ROLLUP_KPIS:
+        merged[f'{kpi}_sum'] = rollups.c[f'{kpi}_sum'] + statement.excluded[f'{kpi}_sum']
+        merged[f'{kpi}_min'] = least(rollups.c[f'{kpi}_min'], statement.excluded[f'{kpi}_min'])
+        merged[f'{kpi}_max'] = greatest(rollups.c[f'{kpi}_max'], statement.excluded[f'{kpi}_max'])
+    statement = statement.on_conflict_do_update(index_elements=list(rollups.primary_key), set_=merged)
+    connection.execute(statement, list(totals.values()))
+
+    # the same totals summed per machine group, category and manufacturer
+    machines = Machine.__table__
+    attributes = {
+        row.id: row for row in connection.execute(
+            select(machines.c.id, *[machines.c[grouping] for grouping in FLEET_GROUPINGS])
+            .where(machines.c.id.in_({m['machine_id'] for m in metrics}))
+        )
+    }
+    fleet_rows = {}
+    for total in totals.values():
+        machine = attributes.get(total['machine_id'])
+        if machine is None:
+            continue
+        for grouping in FLEET_GROUPINGS:
+            key = (total['granularity'], total['bucket_start'], grouping, machine._mapping[grouping])
+            row = fleet_rows.get(key)
+            if row is None:
+                row = fleet_rows[key] = {**dict(zip(['granularity', 'bucket_start', 'grouping', 'name'], key)),
+                                         **dict.fromkeys(FLEET_ROLLUP_COLUMNS, 0)}
+            for column in FLEET_ROLLUP_COLUMNS:
+                row[column] += total[column]
+    if fleet_rows:
+        upsert_fleet_totals(connection, list(fleet_rows.values()))
+
+
+def fleet_totals(grouping, conditions, sign=1):
+    """
+    Rows of machine_fleet_rollups summing the machine_metric_rollups rows matching the conditions.
+
+    @param grouping One of FLEET_GROUPINGS
+    @param sign -1 for the totals to subtract
+    """
+    rollups = MachineMetricRollup.__table__
+    machines = Machine.__table__
+    return (
+        select(rollups.c.granularity, rollups.c.bucket_start, literal(grouping, String).label('grouping'),
+               machines.c[grouping].label('name'),
+               *[(sign * func.sum(rollups.c[column])).label(column) for column in FLEET_ROLLUP_COLUMNS])
+        .join_from(rollups, machines, machines.c.id == rollups.c.machine_id)
+        .where(*conditions)
+        .group_by(rollups.c.granularity, rollups.c.bucket_start, machines.c[grouping])
+    )
+
+
+def upsert_fleet_totals(connection, rows=None, select_rows=None):
+    """
+    Adds totals to machine_fleet_rollups: parameter dicts (rows) or the rows of a SELECT.
+    """
+    fleet = MachineFleetRollup.__table__
+    statement = _INSERT_CONSTRUCTS[connection.dialect.name](fleet)
+    if select_rows is not None:
+        statement = statement.from_select([column.name for column in select_rows.selected_columns], select_rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(fleet.primary_key),
+        set_={column: fleet.c[column] + statement.excluded[column] for column in FLEET_ROLLUP_COLUMNS}
+    )
+    connection.execute(statement, rows) if rows is not None else connection.execute(statement)
+
+
+def add_fleet_totals(connection, conditions, sign=1):
+    """
+    Adds the machine_metric_rollups rows matching the conditions to machine_fleet_rollups (upsert).
+    """
+    for grouping in FLEET_GROUPINGS:
+        upsert_fleet_totals(connection, select_rows=fleet_totals(grouping, conditions, sign))
+
+
+def refresh_fleet_rollups(connection):
+    """
+    Rebuilds machine_fleet_rollups from machine_metric_rollups (after an import or a change
+    of the machines' attributes).
+    """
+    fleet = MachineFleetRollup.__table__
+    connection.execute(fleet.delete())
+    for grouping in FLEET_GROUPINGS:
+        rows = fleet_totals(grouping, [])
+        connection.execute(fleet.insert().from_select([column.name for column in rows.selected_columns], rows))
+
+
+def metrics_written(connection, metrics):
+    """
+    Keeps every projection in sync with freshly inserted metrics and queues their live events.
+
+    @param connection SQLAlchemy connection used for the metric writes
+    @param metrics List of dicts holding the machine_metrics columns (id included)
+    """
+    if not metrics:
+        return
+    record_latest_status(connection, metrics)
+    add_to_rollups(connection, metrics)
+    events.metrics_written(connection, metrics)
+    cache.invalidate_on_commit(connection, MachineMetric.__tablename__)
+
+
+def metrics_changed(connection, metrics):
+    """
+    Keeps every projection in sync after metrics were updated, moved to another machine or
+    day, or deleted, and queues the new latest reading of their machines.
+
+    @param connection SQLAlchemy connection used for the metric writes
+    @param metrics List of dicts holding a machine_id and timestamp the metrics had or have
+    """
+    if not metrics:
+        return
+    machine_ids = {m['machine_id'] for m in metrics}
+    refresh_latest_status(connection, machine_ids)
+    refresh_rollups(connection, machine_ids, since=min(m['timestamp'] for m in metrics))
+
+    projection = MachineLatestStatus.__table__
+    latest = connection.execute(select(projection).where(projection.c.machine_id.in_(machine_ids))).mappings()
+    events.metrics_written(connection, [{**row, 'id': row['metric_id']} for row in latest], replace=True)
+    cache.invalidate_on_commit(connection, MachineMetric.__tablename__)
+
+
+def rebuild_projections(connection):
+    """
+    Rebuilds every projection from machine_metrics (after an import).
+    """
+    refresh_latest_status(connection)
+    refresh_rollups(connection)
+    refresh_fleet_rollups(connection)
+
+
+def _previous(metric, name):
+    # value of an attribute before the flush, None when it did not change
+    changed = inspect(metric).attrs[name].history.deleted
+    return changed[0] if changed else None
+
+
+@event.listens_for(Session, 'after_flush')
+def _metrics_flushed(session, flush_context):
+    # metrics added, changed or deleted through the ORM session, once per flush
+    inserted = [obj for obj in session.new if isinstance(obj, MachineMetric) and obj.id is not None]
+    # where the changed and deleted metrics were and are: those buckets are recomputed
+    changed = []
+    for metric in session.dirty:
+        if isinstance(metric, MachineMetric) and session.is_modified(metric):
+            changed.append({'machine_id': metric.machine_id, 'timestamp': metric.timestamp})
+            machine_id, timestamp = _previous(metric, 'machine_id'), _previous(metric, 'timestamp')
+            if machine_id is not None or timestamp is not None:
+                changed.append({'machine_id': machine_id or metric.machine_id, 'timestamp': timestamp or metric.timestamp})
+    for metric in session.deleted:
+        if isinstance(metric, MachineMetric):
+            changed.append({'machine_id': _previous(metric, 'machine_id') or metric.machine_id,
+                            'timestamp': _previous(metric, 'timestamp') or metric.timestamp})
+    if not inserted and not changed:
+        return
+
+    connection = session.connection()
+    metrics_written(connection, [{
+        'id': metric.id,
+        'machine_id': metric.machine_id,
+        **{name: getattr(metric, name) for name in ['oee', 'availability', 'performance', 'output_quality', *LATEST_STATUS_COLUMNS]}
+    } for metric in inserted])
+    metrics_changed(connection, changed)
@@ -4,6 +4,8 @@ from .maintenance import bp as maintenance_bp
 from .dashboard import bp as dashboard_bp
 from .admin_routes import bp as admin_routes_bp
 from .users import bp as users_bp
+from .metrics import bp as metrics_bp
+import projections  # noqa: F401  keeps the metric projections in sync with metric writes
 
 def register_routes(app):
     app.register_blueprint(machines_bp)
@@ -12,3 +14,4 @@ def register_routes(app):
     app.register_blueprint(dashboard_bp)
     app.register_blueprint(admin_routes_bp)
     app.register_blueprint(users_bp)
+    app.register_blueprint(metrics_bp)
@@ -1,124 +1,121 @@
-import os
-import csv
-from flask import Blueprint, jsonify
-from models import db, Machine, Tool, User, MaintenanceLog, MachineMetric, ToolMetric, ToolAssignment
-from datetime import datetime
-from sqlalchemy.exc import SQLAlchemyError
+from flask import Blueprint, current_app, jsonify, request, url_for
+from importer import CSV_DIR, DEFAULT_CHUNK_SIZE, IMPORT_MODES, ImportJobRunner
 
 bp = Blueprint('admin_routes', __name__)
 
-CSV_DIR = os.path.join(os.path.dirname(__file__), '..', 'csv')
+# imports run in the background, one at a time
+import_jobs = ImportJobRunner()
 
-def parse_date(date_str):
-    try:
-        # try full ISO format first
-        return datetime.fromisoformat(date_str)
-    except ValueError:
-        try:
-            # try date only
-            return datetime.strptime(date_str, "%Y-%m-%d")
-        except ValueError:
-            # try date with time 
-            return datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
 
 @bp.route('/import-csv', methods=['POST'])
 def import_csv():
-    try:
-        # Drop and recreate tables
-        db.drop_all()
-        db.create_all()
+    """
+    Start a background import of the CSV files
+    ---
+    parameters:
+      - name: mode
+        in: query
+        type: string
+        required: false
+        default: reset
+        enum: ['reset', 'stream', 'incremental', 'parallel']
+        description: >
+          reset loads everything in one transaction, stream commits in chunks,
+          incremental keeps the tables and only upserts rows whose content changed (keyed on the CSV id column),
+          parallel loads independent tables at the same time (one transaction per table)
+      - name: chunk_size
+        in: query
+        type: integer
+        required: false
+        description: Rows committed per chunk in stream and incremental mode (defaults to IMPORT_CHUNK_SIZE)
+    responses:
+      202:
+        description: Import queued, poll the status URL for progress
+        schema:
+          type: object
+          properties:
+            job_id:
+              type: string
+              example: "3f2b9c0e5d7a4e1f9b6c2d8a0e4f6b1c"
+            status:
+              type: string
+              example: "queued"
+            status_url:
+              type: string
+              example: "/import-jobs/3f2b9c0e5d7a4e1f9b6c2d8a0e4f6b1c"
+      400:
+        description: Invalid mode or chunk_size
+    """
+    mode = request.args.get('mode', 'reset')
+    if mode not in IMPORT_MODES:
+        return jsonify({"error": f"Invalid mode '{mode}'. Must be one of {list(IMPORT_MODES)}."}), 400
 
-        # Load machines.csv
-        with open(os.path.join(CSV_DIR, 'machines.csv')) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                machine = Machine(
-                    name=row['name'],
-                    category=row['category'],
-                    group=row['group'],
-                    manufacturer=row['manufacturer'],
-                    created_at=parse_date(row['created_at'])
-                )
-                db.session.add(machine)
-        #print("machines done")
-        # Load tools.csv
-        with open(os.path.join(CSV_DIR, 'tools.csv')) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                tool = Tool(
-                    name=row['name'],
-                    type=row['type'],
-                    created_at=parse_date(row['created_at'])
-                )
-                db.session.add(tool)
-        with open(os.path.join(CSV_DIR, 'tool_metrics.csv')) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                metric = ToolMetric(
-                    tool_id=int(row['tool_id']),
-                    status=row['status'],
-                    wear_level=int(row['wear_level']),
-                    storage_location=row['storage_location'] if row['status'] == 'in storage' else "N/A"
-                )
-                db.session.add(metric)
-
-        with open(os.path.join(CSV_DIR, 'tool_assignments.csv')) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                assign = ToolAssignment(
-                    machine_id=int(row['machine_id']),
-                    tool_id = int(row['tool_id'])
-                )
-                db.session.add(assign)
-        #print("tools done")
-        # Load users.csv
-        with open(os.path.join(CSV_DIR, 'users.csv')) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                user = User(
-                    username=row['username'],
-                    firstname=row['firstname'],
-                    lastname=row['lastname'],
-                    created_at=parse_date(row['created_at'])
-                )
-                db.session.add(user)
-        # Load maintenance.csv
-        db.session.flush()
+    config = current_app.config
+    chunk_size = request.args.get('chunk_size', config.get('IMPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+    try:
+        chunk_size = int(chunk_size)
+    except ValueError:
+        chunk_size = 0
+    if chunk_size < 1:
+        return jsonify({"error": f"Invalid chunk_size '{request.args.get('chunk_size')}'. Must be an integer of at least 1."}), 400
 
-        with open(os.path.join(CSV_DIR, 'maintenance_logs.csv')) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                log = MaintenanceLog(
-                    machine_id=int(row['machine_id']),
-                    performed_by=int(row['performed_by']),
-                    date=parse_date(row['date']),
-                    notes=row['notes'],
-                    planned=row['planned'].lower() == 'true'
-                )
-                db.session.add(log)
+    job = import_jobs.submit(
+        current_app._get_current_object(),
+        mode,
+        csv_dir=config.get('IMPORT_CSV_DIR', CSV_DIR),
+        chunk_size=chunk_size,
+        load_workers=config.get('IMPORT_LOAD_WORKERS', 4),
+        parse_workers=config.get('IMPORT_PARSE_WORKERS')
+    )
 
-        #print("maintenance done")
-        # Load dashboard.csv (machine_metrics)
-        with open(os.path.join(CSV_DIR, 'machine_metrics.csv')) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                metric = MachineMetric(
-                    machine_id=int(row['machine_id']),
-                    timestamp=parse_date(row['timestamp']),
-                    oee=float(row['oee']),
-                    availability=float(row['availability']),
-                    performance=float(row['performance']),
-                    output_quality=float(row['output_quality']),
-                    status=row['status']
-                )
-                db.session.add(metric)
-        #print("dashboard done")
-        db.session.commit()
-        return jsonify({"message": "Database reset and populated successfully"}), 200
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": url_for('admin_routes.get_import_job', job_id=job.id)
+    }), 202
 
-    except SQLAlchemyError as e:
-        db.session.rollback()
-        return jsonify({"error": str(e)}), 500
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+@bp.route('/import-jobs/<string:job_id>', methods=['GET'])
+def get_import_job(job_id):
+    """
+    Get the progress of a background import
+    ---
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Job status, rows loaded per table, throughput and ETA
+        schema:
+          type: object
+          properties:
+            id:
+              type: string
+            mode:
+              type: string
+              example: "reset"
+            status:
+              type: string
+              enum: ['queued', 'running', 'done', 'failed']
+            rows:
+              type: object
+              example: {"machines": {"loaded": 50, "expected": 50}}
+            rows_loaded:
+              type: integer
+            rows_expected:
+              type: integer
+            throughput_rows_per_second:
+              type: integer
+            eta_seconds:
+              type: number
+            error:
+              type: string
+      404:
+        description: Unknown job
+    """
+    job = import_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Import job not found"}), 404
+    return jsonify(job.to_dict())
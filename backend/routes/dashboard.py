@@ -1,9 +1,262 @@
+from datetime import datetime, time, timedelta
 from flask import Blueprint, request, jsonify
-from models import MachineMetric
+from sqlalchemy import and_, false, func, or_, select, tuple_
+from models import db, Machine, MachineMetric, MachineMetricRollup, MachineFleetRollup
+from projections import FLEET_GROUPINGS
+from timeseries import AGGREGATES, BUCKETS, bucket_floor, bucket_start, format_bucket, next_bucket, to_utc
+from cache import cached
+from pagination import parse_page_args, page_rows
 
 bp = Blueprint('dashboard', __name__)
 
+# numeric KPIs returned by default by the batched dashboard endpoint
+KPI_METRICS = ['oee', 'availability', 'performance', 'output_quality']
+ALLOWED_METRICS = KPI_METRICS + ['status']
+# largest page of raw points served with keyset pagination
+MAX_PAGE_SIZE = 10000
+
+
+def parse_bucketing(metrics):
+    """
+    Reads the bucket/agg query parameters.
+
+    @return (bucket, agg, error message); bucket is None when no bucketing is requested
+    """
+    bucket = request.args.get('bucket')
+    agg = request.args.get('agg', 'avg')
+    if bucket is None:
+        return None, None, None
+    if bucket not in BUCKETS:
+        return None, None, f"Invalid bucket '{bucket}'. Must be one of {BUCKETS}."
+    if agg not in AGGREGATES:
+        return None, None, f"Invalid agg '{agg}'. Must be one of {list(AGGREGATES)}."
+    if 'status' in metrics and agg != 'count':
+        return None, None, "Metric 'status' can only be bucketed with agg=count."
+    return bucket, agg, None
+
+
+def parse_window(bucket, points=True):
+    """
+    Reads the time window (days, from, to) and keyset pagination (limit, cursor) parameters.
+
+    @param bucket Requested bucket, None for raw points
+    @param points False when the endpoint serves no raw points to page through: limit and cursor are rejected
+    @return (window dict, error message)
+    """
+    if not points and ('limit' in request.args or 'cursor' in request.args):
+        return None, "limit and cursor are not supported by this endpoint."
+    window = {"days": request.args.get('days', type=int), "start": None, "end": None,
+              "limit": request.args.get('limit', type=int), "cursor": None}
+    try:
+        # offsets are converted, the records hold naive UTC timestamps
+        if request.args.get('from'):
+            window["start"] = to_utc(datetime.fromisoformat(request.args['from']))
+        if request.args.get('to'):
+            window["end"] = to_utc(datetime.fromisoformat(request.args['to']))
+    except ValueError as e:
+        return None, f"Invalid from/to timestamp: {e}"
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            timestamp, metric_id = cursor.rsplit('_', 1)
+            window["cursor"] = (datetime.fromisoformat(timestamp), int(metric_id))
+        except ValueError:
+            return None, f"Invalid cursor '{cursor}'."
+
+    if bucket and (window["limit"] or window["cursor"]):
+        return None, "limit and cursor cannot be combined with bucket."
+    if window["limit"] is not None and not 0 < window["limit"] <= MAX_PAGE_SIZE:
+        return None, f"limit must be between 1 and {MAX_PAGE_SIZE}."
+    return window, None
+
+
+def is_midnight(value):
+    return value.hour == value.minute == value.second == value.microsecond == 0
+
+
+def format_timestamps(values):
+    """
+    Dates only when every point is at midnight (daily data, the historical format), ISO timestamps otherwise.
+    """
+    if all(is_midnight(v) for v in values):
+        return [v.strftime('%Y-%m-%d') for v in values]
+    return [v.isoformat() for v in values]
+
+
+def latest_timestamp(machine_id):
+    """
+    Timestamp of the latest record of a machine (one step down the (machine_id, timestamp) index).
+    """
+    return db.session.execute(
+        select(MachineMetric.timestamp)
+        .where(MachineMetric.machine_id == machine_id)
+        .order_by(MachineMetric.timestamp.desc())
+        .limit(1)
+    ).scalar()
+
+
+def window_conditions(window, latest=None):
+    """
+    Conditions keeping the records inside the time window (days, from, to), not the cursor.
+
+    @param window Dict from parse_window()
+    @param latest Timestamp the days window is counted back from
+    """
+    conditions = []
+    if window["days"]:
+        conditions.append(MachineMetric.timestamp > latest - timedelta(days=window["days"]))
+    if window["start"]:
+        conditions.append(MachineMetric.timestamp >= window["start"])
+    if window["end"]:
+        conditions.append(MachineMetric.timestamp < window["end"])
+    return conditions
+
+
+def whole_buckets(bucket, window, latest=None):
+    """
+    Starts [first, last) of the buckets lying entirely inside the window, None meaning unbounded.
+
+    @param bucket One of BUCKETS
+    @param window Dict from parse_window()
+    @param latest Timestamp the days window is counted back from
+    """
+    first = last = None
+    if window["days"]:
+        # the records come strictly after the window start, so its bucket is never whole
+        first = next_bucket(bucket, bucket_floor(bucket, latest - timedelta(days=window["days"])))
+    if window["start"]:
+        start = window["start"]
+        day = bucket_floor(bucket, start)
+        if start != datetime.combine(day, time()):
+            day = next_bucket(bucket, day)
+        first = day if first is None else max(first, day)
+    if window["end"]:
+        last = bucket_floor(bucket, window["end"])
+    return first, last
+
+
+def covering_buckets(first, last):
+    """
+    Fewest rollup buckets covering the days [first, last): whole weeks, then the remaining days.
+
+    @return List of (granularity, first bucket start, bucket start to stop at) with None meaning unbounded
+    """
+    if first is None and last is None:
+        return [('month', None, None)]
+    week_first = first if first is None or first.weekday() == 0 else first + timedelta(days=7 - first.weekday())
+    week_last = last if last is None else last - timedelta(days=last.weekday())
+    if week_first is not None and week_last is not None and week_first >= week_last:
+        return [('day', first, last)]
+
+    ranges = [('week', week_first, week_last)]
+    if first is not None and first < week_first:
+        ranges.append(('day', first, week_first))
+    if last is not None and week_last < last:
+        ranges.append(('day', week_last, last))
+    return ranges
+
+
+def rollup_series(machine_id, metrics, window, bucket, agg):
+    """
+    Reads a bucketed series, the buckets inside the window from machine_metric_rollups.
+
+    WHY: The cost follows the number of buckets and not the number of raw records. Only the
+    buckets cut by the window edges (at most two) are aggregated from their raw records, so
+    every bucket holds the records of the window it contains, like without rollups.
+
+    @return List of (bucket label, value per metric) tuples, oldest first
+    """
+    rollup = MachineMetricRollup
+    latest = None
+    if window["days"]:
+        latest = latest_timestamp(machine_id)
+        if latest is None:
+            return []
+    first, last = whole_buckets(bucket, window, latest)
+
+    rows = []
+    if first is None or last is None or first < last:
+        conditions = [rollup.machine_id == machine_id, rollup.granularity == bucket]
+        if first is not None:
+            conditions.append(rollup.bucket_start >= first)
+        if last is not None:
+            conditions.append(rollup.bucket_start < last)
+
+        def value(row, metric):
+            if agg == 'count':
+                return row.count
+            if agg == 'avg':
+                return getattr(row, f'{metric}_sum') / row.count
+            return getattr(row, f'{metric}_{agg}')
+
+        buckets = db.session.execute(select(rollup).where(*conditions).order_by(rollup.bucket_start)).scalars()
+        rows = [(format_bucket(row.bucket_start), *[value(row, m) for m in metrics]) for row in buckets]
+        # the partial buckets before and after the whole ones
+        edges = [[MachineMetric.timestamp < datetime.combine(first, time())]] if first is not None else []
+        if last is not None:
+            edges.append([MachineMetric.timestamp >= datetime.combine(last, time())])
+    else:
+        # the window lies inside one or two partial buckets
+        edges = [[]]
+
+    start = bucket_start(db.engine.dialect.name, bucket, MachineMetric.timestamp).label('bucket')
+    for edge in edges:
+        query = (
+            select(start, *[AGGREGATES[agg](getattr(MachineMetric, m)) for m in metrics])
+            .where(MachineMetric.machine_id == machine_id, *window_conditions(window, latest), *edge)
+            .group_by(start)
+        )
+        rows += [(format_bucket(row[0]), *row[1:]) for row in db.session.execute(query)]
+    return sorted(rows)
+
+
+def metric_series(machine_id, metrics, window, bucket=None, agg='avg'):
+    """
+    Reads the series of a machine, oldest first, with one index range scan of its rows.
+
+    @param metrics Column names of MachineMetric to return
+    @param window Dict from parse_window():
+                  days keeps the records of the last `days` days before the machine's latest record,
+                  start/end bound the timestamps (start inclusive, end exclusive),
+                  limit/cursor page through raw points by (timestamp, id)
+    @param bucket None for raw points, or one of BUCKETS to read the pre-aggregated rollups
+    @param agg Aggregate function applied per bucket (key of AGGREGATES)
+    @return (list of (timestamp label, value per metric) tuples, cursor of the next page or None)
+    """
+    if bucket is not None:
+        return rollup_series(machine_id, metrics, window, bucket, agg), None
+
+    latest = None
+    if window["days"]:
+        latest = latest_timestamp(machine_id)
+        if latest is None:
+            return [], None
+    conditions = [MachineMetric.machine_id == machine_id, *window_conditions(window, latest)]
+
+    if window["cursor"]:
+        conditions.append(tuple_(MachineMetric.timestamp, MachineMetric.id) > tuple_(*window["cursor"]))
+    query = (
+        select(MachineMetric.timestamp, MachineMetric.id, *[getattr(MachineMetric, m) for m in metrics])
+        .where(*conditions)
+        .order_by(MachineMetric.timestamp, MachineMetric.id)
+    )
+    if window["limit"]:
+        # one extra row tells whether there is a next page
+        query = query.limit(window["limit"] + 1)
+
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if window["limit"] and len(rows) > window["limit"]:
+        rows = rows[:window["limit"]]
+        next_cursor = f"{rows[-1][0].isoformat()}_{rows[-1][1]}"
+
+    labels = format_timestamps([row[0] for row in rows])
+    return [(label, *row[2:]) for label, row in zip(labels, rows)], next_cursor
+
+
 @bp.route('/machines/<int:machine_id>/dashboard/<string:param>', methods=['GET'])
+@cached('machine_metrics')
 def get_machine_metric(machine_id, param):
     """
     Get machine metric data over time (OEE, availability, performance, etc.)
@@ -24,7 +277,42 @@ def get_machine_metric(machine_id, param):
         in: query
         type: integer
         required: false
-        description: Number of most recent records to retrieve (e.g. 30 = last 30 days)
+        description: Only the records of the last N days, counted back from the machine's latest record
+      - name: from
+        in: query
+        type: string
+        format: date-time
+        required: false
+        description: First timestamp to include (ISO format, an offset is converted to UTC)
+      - name: to
+        in: query
+        type: string
+        format: date-time
+        required: false
+        description: Timestamp to stop at, excluded (ISO format, an offset is converted to UTC)
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Page size for raw points (keyset pagination, at most 10000)
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: next_cursor returned by the previous page
+      - name: bucket
+        in: query
+        type: string
+        required: false
+        enum: ['day', 'week', 'month']
+        description: Aggregate the records per day, ISO week or month (timestamp = first day of the bucket, the buckets at the window edges only hold the records inside it)
+      - name: agg
+        in: query
+        type: string
+        required: false
+        default: avg
+        enum: ['avg', 'min', 'max', 'sum', 'count']
+        description: Aggregate function used with bucket
     responses:
       200:
         description: List of metric values for the machine
@@ -65,26 +353,383 @@ def get_machine_metric(machine_id, param):
     if param not in allowed_params:
         return jsonify({"error": f"Invalid parameter '{param}'. Must be one of {list(allowed_params)}."}), 400
 
-    days = request.args.get('days', type=int)  # e.g. ?days=30
-
-    query = MachineMetric.query.filter_by(machine_id=machine_id).order_by(MachineMetric.timestamp.desc())
-
-    if days:
-        query = query.limit(days)
-
-    metrics = query.all()
-    metrics.reverse()  # oldest to newest
+    bucket, agg, error = parse_bucketing([param])
+    window, error = (None, error) if error else parse_window(bucket)
+    if error:
+        return jsonify({"error": error}), 400
 
+    rows, next_cursor = metric_series(machine_id, [param], window, bucket, agg)
     result = [
         {
-            "timestamp": m.timestamp.strftime('%Y-%m-%d'),
-            "value": getattr(m, param)
-        } for m in metrics
+            "timestamp": timestamp,
+            "value": value
+        } for timestamp, value in rows
     ]
 
-    return jsonify({
+    response = {
         "machine_id": machine_id,
         "metric": param,
-        "days_requested": days,
+        "days_requested": window["days"],
         "data": result
-    })
\ No newline at end of file
+    }
+    if window["limit"]:
+        response["next_cursor"] = next_cursor
+    if bucket:
+        response.update(bucket=bucket, agg=agg)
+    return jsonify(response)
+
+@bp.route('/machines/<int:machine_id>/dashboard', methods=['GET'])
+@cached('machine_metrics')
+def get_machine_dashboard(machine_id):
+    """
+    Get several metric series of a machine in one request (columnar layout)
+    ---
+    parameters:
+      - name: machine_id
+        in: path
+        type: integer
+        required: true
+        description: ID of the machine
+      - name: metrics
+        in: query
+        type: string
+        required: false
+        default: oee,availability,performance,output_quality
+        description: Comma-separated metrics (oee, availability, performance, output_quality, status)
+      - name: days
+        in: query
+        type: integer
+        required: false
+        description: Only the records of the last N days, counted back from the machine's latest record
+      - name: from
+        in: query
+        type: string
+        format: date-time
+        required: false
+        description: First timestamp to include (ISO format, an offset is converted to UTC)
+      - name: to
+        in: query
+        type: string
+        format: date-time
+        required: false
+        description: Timestamp to stop at, excluded (ISO format, an offset is converted to UTC)
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Page size for raw points (keyset pagination, at most 10000)
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: next_cursor returned by the previous page
+      - name: bucket
+        in: query
+        type: string
+        required: false
+        enum: ['day', 'week', 'month']
+        description: Aggregate the records per day, ISO week or month (timestamp = first day of the bucket, the buckets at the window edges only hold the records inside it)
+      - name: agg
+        in: query
+        type: string
+        required: false
+        default: avg
+        enum: ['avg', 'min', 'max', 'sum', 'count']
+        description: Aggregate function used with bucket
+    responses:
+      200:
+        description: One timestamp array and one value array per requested metric
+        schema:
+          type: object
+          properties:
+            machine_id:
+              type: integer
+              example: 7
+            metrics:
+              type: array
+              items:
+                type: string
+              example: ["oee", "availability"]
+            days_requested:
+              type: integer
+              example: 30
+            timestamps:
+              type: array
+              items:
+                type: string
+                format: date
+              example: ["2024-06-14", "2024-06-15"]
+            series:
+              type: object
+              example: {"oee": [81.2, 79.5], "availability": [92.0, 90.1]}
+      400:
+        description: Invalid metric name
+    """
+    requested = request.args.get('metrics')
+    metrics = [m.strip() for m in requested.split(',') if m.strip()] if requested else KPI_METRICS
+    invalid = [m for m in metrics if m not in ALLOWED_METRICS]
+    if invalid or not metrics:
+        return jsonify({"error": f"Invalid metrics {invalid}. Must be among {ALLOWED_METRICS}."}), 400
+    metrics = list(dict.fromkeys(metrics))  # drop duplicates, keep order
+
+    bucket, agg, error = parse_bucketing(metrics)
+    window, error = (None, error) if error else parse_window(bucket)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # one scan of the machine's rows, only the requested columns
+    rows, next_cursor = metric_series(machine_id, metrics, window, bucket, agg)
+
+    response = {
+        "machine_id": machine_id,
+        "metrics": metrics,
+        "days_requested": window["days"],
+        "timestamps": [row[0] for row in rows],
+        "series": {metric: [row[i + 1] for row in rows] for i, metric in enumerate(metrics)}
+    }
+    if window["limit"]:
+        response["next_cursor"] = next_cursor
+    if bucket:
+        response.update(bucket=bucket, agg=agg)
+    return jsonify(response)
+
+
+def fleet_latest_timestamp():
+    """
+    Timestamp of the latest record of the fleet.
+
+    WHY: The latest day is one step down the rollup (granularity, bucket_start) index, then
+    only that day of the machines having records on it is read from machine_metrics.
+    """
+    rollup = MachineMetricRollup
+    day = db.session.execute(select(func.max(rollup.bucket_start)).where(rollup.granularity == 'day')).scalar()
+    if day is None:
+        return None
+    machines = select(rollup.machine_id).where(rollup.granularity == 'day', rollup.bucket_start == day)
+    return db.session.execute(
+        select(func.max(MachineMetric.timestamp))
+        .where(MachineMetric.machine_id.in_(machines), MachineMetric.timestamp >= datetime.combine(day, time()))
+    ).scalar()
+
+
+def fleet_buckets(window):
+    """
+    Rollup buckets covering the window: whole weeks and the days at its edges (whole months
+    for the whole history). Partial days at the edges are left out.
+
+    @return List of (granularity, first bucket start, bucket start to stop at) with None meaning unbounded
+    """
+    latest = None
+    if window["days"]:
+        # days are counted back from the latest record of the fleet
+        latest = fleet_latest_timestamp()
+        if latest is None:
+            return []
+    return covering_buckets(*whole_buckets('day', window, latest))
+
+
+def in_buckets(rollup, buckets):
+    """
+    Condition keeping the rows of a rollup model inside the buckets from fleet_buckets().
+    """
+    conditions = []
+    for granularity, first, last in buckets:
+        bucket = [rollup.granularity == granularity]
+        if first is not None:
+            bucket.append(rollup.bucket_start >= first)
+        if last is not None:
+            bucket.append(rollup.bucket_start < last)
+        conditions.append(and_(*bucket))
+    return or_(*conditions) if conditions else false()
+
+
+def fleet_kpis(buckets, args):
+    """
+    Record count and KPI sums over the buckets of one page of machines.
+
+    WHY: Only the rollups of the machines on the page are summed (one grouped query), so the
+    cost follows per_page instead of the size of the fleet.
+
+    @param args Dict from parse_page_args(), paged by offset
+    @return Dicts of id, name, group, category, manufacturer, records and sum per KPI, machines without data included
+    """
+    machines, _ = page_rows(
+        select(Machine.id, Machine.name, *[getattr(Machine, g) for g in FLEET_GROUPINGS]), args,
+        key=lambda row: [getattr(row, c.key) for c in args["columns"]]
+    )
+    rollup = MachineMetricRollup
+    totals = {
+        machine_id: sums for machine_id, *sums in db.session.execute(
+            select(rollup.machine_id, func.sum(rollup.count),
+                   *[func.sum(getattr(rollup, f'{kpi}_sum')) for kpi in KPI_METRICS])
+            .where(rollup.machine_id.in_([row.id for row in machines]), in_buckets(rollup, buckets))
+            .group_by(rollup.machine_id)
+        )
+    }
+    columns = ['records', *KPI_METRICS]
+    return [{**row._asdict(), **dict(zip(columns, totals.get(row.id, [None] * len(columns))))}
+            for row in machines]
+
+
+def fleet_group_kpis(buckets, groupings):
+    """
+    Machine count, record count and KPI sums of every group, category or manufacturer over the buckets.
+
+    WHY: Read from machine_fleet_rollups, a few rows per bucket whatever the number of machines.
+
+    @return Dict mapping each grouping to {name: {"machines", "records", sum per KPI}}, groups without data included
+    """
+    fleet = MachineFleetRollup
+    groups = {grouping: {} for grouping in groupings}
+    machines = (
+        select(*[getattr(Machine, g) for g in FLEET_GROUPINGS], func.count())
+        .group_by(*[getattr(Machine, g) for g in FLEET_GROUPINGS])
+    )
+    for *names, count in db.session.execute(machines):
+        for grouping, name in zip(FLEET_GROUPINGS, names):
+            if grouping in groups:
+                total = groups[grouping].setdefault(name, {"machines": 0, "records": 0, **dict.fromkeys(KPI_METRICS, 0)})
+                total["machines"] += count
+
+    totals = (
+        select(fleet.grouping, fleet.name, func.sum(fleet.count),
+               *[func.sum(getattr(fleet, f'{kpi}_sum')) for kpi in KPI_METRICS])
+        .where(fleet.grouping.in_(groupings), in_buckets(fleet, buckets))
+        .group_by(fleet.grouping, fleet.name)
+    )
+    for grouping, name, count, *sums in db.session.execute(totals):
+        total = groups[grouping].get(name)
+        if total is not None:
+            total["records"] = count
+            total.update(zip(KPI_METRICS, sums))
+    return groups
+
+
+def kpi_averages(count, sums):
+    """
+    Record-weighted KPI averages, None when there is no record.
+    """
+    return {kpi: (sums[kpi] / count if count else None) for kpi in KPI_METRICS}
+
+
+@bp.route('/fleet/dashboard', methods=['GET'])
+@cached('machines', 'machine_metrics')
+def get_fleet_dashboard():
+    """
+    Get the average KPIs of every machine group, category and manufacturer, and of a page of machines
+    ---
+    parameters:
+      - name: group_by
+        in: query
+        type: string
+        required: false
+        default: group,category,manufacturer
+        description: Comma-separated levels to return (machine, group, category, manufacturer). The group levels read a few rows per day, the machine level is paged with page/per_page.
+      - name: page
+        in: query
+        type: integer
+        required: false
+        default: 1
+        description: Page of the machine level
+      - name: per_page
+        in: query
+        type: integer
+        required: false
+        default: 30
+        description: Machines per page of the machine level
+      - name: sort
+        in: query
+        type: string
+        required: false
+        default: id
+        enum: ['id', 'name']
+      - name: order
+        in: query
+        type: string
+        required: false
+        default: asc
+        enum: ['asc', 'desc']
+      - name: days
+        in: query
+        type: integer
+        required: false
+        description: Only the last N days (whole days), counted back from the latest record of the fleet
+      - name: from
+        in: query
+        type: string
+        format: date
+        required: false
+        description: First day to include (ISO format, an offset is converted to UTC)
+      - name: to
+        in: query
+        type: string
+        format: date
+        required: false
+        description: Day to stop at, excluded (ISO format, an offset is converted to UTC)
+    responses:
+      200:
+        description: Averages weighted by the number of records of each machine
+        schema:
+          type: object
+          properties:
+            days_requested:
+              type: integer
+              example: 30
+            page:
+              type: integer
+              description: Only with the machine level
+            machines:
+              type: array
+              items:
+                type: object
+              example: [{"machine_id": 7, "name": "Lathe 7", "group": "CNC", "category": "Manual",
+                         "manufacturer": "Fanuc", "records": 30, "oee": 81.2, "availability": 92.0,
+                         "performance": 88.4, "output_quality": 99.1}]
+            groups:
+              type: object
+              example: {"group": [{"name": "CNC", "machines": 12, "records": 360, "oee": 80.3,
+                                   "availability": 91.5, "performance": 87.9, "output_quality": 98.8}]}
+      400:
+        description: Invalid group_by level, window or page parameters
+    """
+    levels = ['machine', *FLEET_GROUPINGS]
+    requested = request.args.get('group_by')
+    group_by = [g.strip() for g in requested.split(',') if g.strip()] if requested else FLEET_GROUPINGS
+    invalid = [g for g in group_by if g not in levels]
+    if invalid or not group_by:
+        return jsonify({"error": f"Invalid group_by {invalid}. Must be among {levels}."}), 400
+
+    window, error = parse_window(None, points=False)
+    if error:
+        return jsonify({"error": error}), 400
+    if 'machine' in group_by:
+        args, error = parse_page_args({'id': Machine.id, 'name': Machine.name})
+        if error:
+            return jsonify({"error": error}), 400
+
+    buckets = fleet_buckets(window)
+
+    machines = []
+    if 'machine' in group_by:
+        for machine in fleet_kpis(buckets, args):
+            count = machine.pop('records') or 0
+            sums = {kpi: machine.pop(kpi) or 0 for kpi in KPI_METRICS}
+            machine["machine_id"] = machine.pop('id')
+            machines.append({**machine, "records": count, **kpi_averages(count, sums)})
+    groups = fleet_group_kpis(buckets, [grouping for grouping in FLEET_GROUPINGS if grouping in group_by])
+
+    response = {
+        "days_requested": window["days"],
+        "groups": {
+            grouping: [
+                {"name": name, "machines": total["machines"], "records": total["records"],
+                 **kpi_averages(total["records"], total)}
+                for name, total in sorted(totals.items())
+            ]
+            for grouping, totals in groups.items()
+        }
+    }
+    if 'machine' in group_by:
+        response["page"] = args["page"]
+        response["machines"] = machines
+    return jsonify(response)
@@ -1,10 +1,24 @@
-from flask import Blueprint, jsonify, request
+import json
+from math import ceil
+from flask import Blueprint, Response, jsonify, request
 from datetime import datetime
-from models import db, Machine, ToolAssignment, MachineMetric, Tool, ToolMetric
+from models import db, Machine, ToolAssignment, MachineLatestStatus, Tool, ToolMetric
+from projections import latest_status_for
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+from events import KEEPALIVE_SECONDS, publisher
+from pagination import parse_page_args, page_rows
+from cache import cached, invalidate
 
 bp = Blueprint('machines', __name__)
 
+# machines accepted by one GET /machines/tools call
+MAX_TOOL_LOOKUP_IDS = 1000
+# sort orders of GET /machines, each backed by an index ending with the id
+MACHINE_SORTS = {'id': Machine.id, 'name': Machine.name, 'created_at': Machine.created_at}
+
 @bp.route('/machines', methods=['GET'])
+@cached('machines', 'machine_metrics')
 def get_machines():
     """
     Get a paginated list of machines with their latest status
@@ -22,6 +36,29 @@ def get_machines():
         required: false
         default: 30
         description: Number of machines per page
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: Keyset pagination, next_cursor of the previous page (empty for the first page); page is ignored
+      - name: sort
+        in: query
+        type: string
+        required: false
+        default: id
+        enum: ['id', 'name', 'created_at']
+      - name: order
+        in: query
+        type: string
+        required: false
+        default: asc
+        enum: ['asc', 'desc']
+      - name: count
+        in: query
+        type: boolean
+        required: false
+        default: true
+        description: false skips counting the machines (total and pages are then null)
     responses:
       200:
         description: List of machines
@@ -54,24 +91,30 @@ def get_machines():
               type: integer
             pages:
               type: integer
+            next_cursor:
+              type: string
+              description: Only with cursor, null on the last page
+      400:
+        description: Invalid sort, order or cursor
     """
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 30, type=int)
+    args, error = parse_page_args(MACHINE_SORTS)
+    if error:
+        return jsonify({"error": error}), 400
 
-    machines_paginated = Machine.query.paginate(page=page, per_page=per_page, error_out=False)
-    machines = machines_paginated.items
-
-    latest_metrics = (
-        db.session.query(MachineMetric)
-        .distinct(MachineMetric.machine_id)
-        .order_by(MachineMetric.machine_id, MachineMetric.id.desc())
-        .all()
+    # status comes from the machine_latest_status projection: one primary-key join per listed machine
+    statement = (
+        select(Machine, MachineLatestStatus.status)
+        .outerjoin(MachineLatestStatus, MachineLatestStatus.machine_id == Machine.id)
     )
+    rows, next_cursor = page_rows(statement, args, key=lambda row: [getattr(row[0], c.key) for c in args["columns"]])
+    total = db.session.execute(select(func.count()).select_from(Machine)).scalar() if args["count"] else None
 
-    latest_status_map = {metric.machine_id: metric.status for metric in latest_metrics}
+    # machines without projection row: rank the metrics of this page only
+    missing = [m.id for m, status in rows if status is None]
+    fallback = latest_status_for(db.session.connection(), missing) if missing else {}
 
     machine_list = []
-    for m in machines:
+    for m, status in rows:
         machine_list.append({
             "id": m.id,
             "name": m.name,
@@ -79,16 +122,69 @@ def get_machines():
             "group": m.group,
             "manufacturer": m.manufacturer,
             "created_at": m.created_at.strftime('%Y-%m-%d'),
-            "status": latest_status_map.get(m.id)
+            "status": status if status is not None else fallback.get(m.id)
         })
 
+    if args["keyset"]:
+        return jsonify({"machines": machine_list, "total": total, "next_cursor": next_cursor})
     return jsonify({
         "machines": machine_list,
-        "total": machines_paginated.total,
-        "page": machines_paginated.page,
-        "pages": machines_paginated.pages
+        "total": total,
+        "page": args["page"],
+        "pages": ceil(total / args["per_page"]) if total is not None else None
     })
 
+
+@bp.route('/machines/stream', methods=['GET'])
+def stream_machines():
+    """
+    Live feed (Server-Sent Events) of machine status and KPI changes
+    ---
+    produces:
+      - text/event-stream
+    parameters:
+      - name: machine_ids
+        in: query
+        type: string
+        required: false
+        description: Comma-separated machine ids to follow, all machines when omitted
+    responses:
+      200:
+        description: >
+          Event stream. "metric" events carry the latest reading of a machine as soon as it is
+          written ({"machine_id", "metric_id", "timestamp", "status", "oee", "availability",
+          "performance", "output_quality"}). "reload" events ask the client to fetch /machines
+          again (after an import, or when it fell too far behind).
+      400:
+        description: Invalid machine_ids
+    """
+    machine_ids = None
+    if request.args.get('machine_ids'):
+        try:
+            machine_ids = [int(i) for i in request.args['machine_ids'].split(',') if i.strip()]
+        except ValueError:
+            return jsonify({"error": "machine_ids must be comma-separated integers"}), 400
+
+    # subscribed before the response starts, so nothing written from now on is missed
+    subscription = publisher.subscribe(machine_ids)
+
+    def generate():
+        try:
+            yield f"retry: {KEEPALIVE_SECONDS * 1000}\n\n"
+            while True:
+                item = subscription.get(timeout=KEEPALIVE_SECONDS)
+                if item is None:
+                    yield ": keepalive\n\n"
+                    continue
+                event_id, event_type, data = item
+                head = f"id: {event_id}\n" if event_id is not None else ""
+                yield f"{head}event: {event_type}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            publisher.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @bp.route('/machines/<int:machine_id>/tool', methods=['PUT'])
 def update_machine_tool(machine_id):
     """
@@ -131,11 +227,13 @@ def update_machine_tool(machine_id):
         db.session.add(assignment)
 
     db.session.commit()
+    invalidate('tool_assignment')
 
     return jsonify({"message": f"Tool assigned to machine {machine_id} updated successfully."})
 
 
 @bp.route('/machines/<int:machine_id>/tool', methods=['GET'])
+@cached('tool_assignment', 'tools', 'tool_metrics')
 def get_machine_tool(machine_id):
     """
     Get the tool assigned to a machine
@@ -158,15 +256,84 @@ def get_machine_tool(machine_id):
               type: number
               example: 15.2
     """
-    assignment = ToolAssignment.query.filter_by(machine_id=machine_id).first()
-    
-    if assignment is None:
-        return jsonify({"tool_name": None, "wear_level": None}), 200
+    tool = machine_tools([machine_id]).get(machine_id)
+    return jsonify(tool or {"tool_name": None, "wear_level": None}), 200
+
 
-    tool = Tool.query.get(assignment.tool_id)
-    metric = ToolMetric.query.filter_by(tool_id=tool.id).first()
+@bp.route('/machines/tools', methods=['GET'])
+@cached('tool_assignment', 'tools', 'tool_metrics')
+def get_machines_tools():
+    """
+    Get the tool assigned to several machines at once
+    ---
+    parameters:
+      - name: ids
+        in: query
+        type: string
+        required: true
+        description: Comma-separated machine ids (at most 1000)
+    responses:
+      200:
+        description: Tool name and wear level per requested machine (null when no tool is assigned)
+        schema:
+          type: object
+          properties:
+            machines:
+              type: array
+              items:
+                type: object
+                properties:
+                  machine_id:
+                    type: integer
+                    example: 7
+                  tool_name:
+                    type: string
+                    example: "Drill Bit A"
+                  wear_level:
+                    type: number
+                    example: 15.2
+      400:
+        description: Missing or invalid ids
+    """
+    try:
+        machine_ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be comma-separated integers"}), 400
+    if not machine_ids or len(machine_ids) > MAX_TOOL_LOOKUP_IDS:
+        return jsonify({"error": f"Between 1 and {MAX_TOOL_LOOKUP_IDS} ids are required"}), 400
 
+    tools = machine_tools(machine_ids)
     return jsonify({
-        "tool_name": tool.name if tool else None,
-        "wear_level": metric.wear_level if metric else None
-    }), 200
\ No newline at end of file
+        "machines": [
+            {"machine_id": machine_id, **tools.get(machine_id, {"tool_name": None, "wear_level": None})}
+            for machine_id in dict.fromkeys(machine_ids)
+        ]
+    }), 200
+
+
+def machine_tools(machine_ids):
+    """
+    Tool name and wear level of the tools assigned to the given machines, in one query.
+
+    WHY: Assignment, tool and its first metric (lowest id, found through the tool_id index)
+    are joined instead of being looked up one after the other for every machine.
+
+    @return Dict mapping machine id to {"tool_name", "wear_level"}, machines without tool left out
+    """
+    metrics = aliased(ToolMetric)
+    first_metric = (
+        select(func.min(metrics.id))
+        .where(metrics.tool_id == ToolAssignment.tool_id)
+        .correlate(ToolAssignment)
+        .scalar_subquery()
+    )
+    query = (
+        select(ToolAssignment.machine_id, Tool.name, ToolMetric.wear_level)
+        .outerjoin(Tool, Tool.id == ToolAssignment.tool_id)
+        .outerjoin(ToolMetric, ToolMetric.id == first_metric)
+        .where(ToolAssignment.machine_id.in_(list(machine_ids)))
+    )
+    return {
+        machine_id: {"tool_name": name, "wear_level": wear_level}
+        for machine_id, name, wear_level in db.session.execute(query)
+    }
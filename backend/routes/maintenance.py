@@ -1,9 +1,12 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime
+from sqlalchemy.orm import joinedload
 from models import db, MaintenanceLog, User
+from cache import cached, invalidate
 bp = Blueprint('maintenance', __name__)
 
 @bp.route('/machines/<int:machine_id>/maintenance', methods=['GET'])
+@cached('maintenance_logs', 'users')
 def get_machine_maintenance(machine_id):
     """
     Get maintenance logs for a specific machine
@@ -48,7 +51,14 @@ def get_machine_maintenance(machine_id):
                     type: boolean
                     example: false
     """
-    logs = MaintenanceLog.query.filter_by(machine_id=machine_id).order_by(MaintenanceLog.date.asc()).all()
+    # performers joined in the same query (performed_by is mandatory), not looked up log by log
+    logs = (
+        MaintenanceLog.query
+        .options(joinedload(MaintenanceLog.performer, innerjoin=True))
+        .filter_by(machine_id=machine_id)
+        .order_by(MaintenanceLog.date.asc())
+        .all()
+    )
 
     data = [
         {
@@ -154,6 +164,7 @@ def add_maintenance():
 
         db.session.add(maintenance)
         db.session.commit()
+        invalidate('maintenance_logs')
         return jsonify({"message": "Maintenance log added successfully!"}), 201
 
     except Exception as e:
@@ -0,0 +1,220 @@
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy.exc import SQLAlchemyError
+from models import db
+from ingestion import (MAX_BATCH_ROWS, MAX_REPORTED_ERRORS, BufferFull, InvalidReadings, MetricBuffer,
+                       insert_readings, parse_readings, validate_readings)
+
+bp = Blueprint('metrics', __name__)
+
+@bp.route('/machine-metrics/batch', methods=['POST'])
+def post_machine_metrics_batch():
+    """
+    Write a batch of machine metric readings (all or nothing)
+    ---
+    consumes:
+      - application/json
+      - application/x-ndjson
+      - text/csv
+    parameters:
+      - in: body
+        name: body
+        required: true
+        description: >
+          JSON array of readings, one JSON reading per line (NDJSON) or CSV with the header
+          machine_id,timestamp,oee,availability,performance,output_quality,status
+        schema:
+          type: array
+          items:
+            type: object
+            required: [machine_id, timestamp, oee, availability, performance, output_quality, status]
+            properties:
+              machine_id:
+                type: integer
+                example: 7
+              timestamp:
+                type: string
+                format: date-time
+                description: Without offset in UTC, timestamps with an offset are converted to UTC
+                example: "2024-06-15T08:30:00"
+              oee:
+                type: number
+                example: 81.2
+              availability:
+                type: number
+                example: 92.0
+              performance:
+                type: number
+                example: 88.4
+              output_quality:
+                type: number
+                example: 99.1
+              status:
+                type: string
+                example: "Running"
+    responses:
+      201:
+        description: Readings written
+        schema:
+          type: object
+          properties:
+            inserted:
+              type: integer
+              example: 2500
+      400:
+        description: Body cannot be parsed or holds invalid readings (first errors listed, nothing written)
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              example: "2 invalid value(s)"
+            errors:
+              type: array
+              items:
+                type: object
+              example: [{"row": 3, "field": "oee", "error": "must be between 0 and 100"}]
+      413:
+        description: More readings than accepted in one batch
+      500:
+        description: Database error, nothing written
+    """
+    try:
+        readings = parse_readings(request.get_data(), request.mimetype)
+    except (UnicodeDecodeError, ValueError) as e:
+        return jsonify({"error": f"Invalid body: {e}"}), 400
+
+    if not readings:
+        return jsonify({"error": "No readings in body"}), 400
+    if len(readings) > MAX_BATCH_ROWS:
+        return jsonify({"error": f"At most {MAX_BATCH_ROWS} readings per batch."}), 413
+
+    try:
+        connection = db.session.connection()
+        rows = validate_readings(connection, readings)
+        insert_readings(connection, rows)
+        db.session.commit()
+    except InvalidReadings as e:
+        db.session.rollback()
+        return jsonify({"error": str(e), "errors": e.errors[:MAX_REPORTED_ERRORS]}), 400
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.exception("Could not write a batch of %d machine metrics", len(readings))
+        return jsonify({"error": f"Could not write the readings: {getattr(e, 'orig', None) or e}"}), 500
+    return jsonify({"inserted": len(rows)}), 201
+
+
+@bp.route('/machine-metrics', methods=['POST'])
+def post_machine_metric():
+    """
+    Queue one machine metric reading, written to the database in the background
+    ---
+    consumes:
+      - application/json
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required: [machine_id, timestamp, oee, availability, performance, output_quality, status]
+          properties:
+            machine_id:
+              type: integer
+              example: 7
+            timestamp:
+              type: string
+              format: date-time
+              description: Without offset in UTC, timestamps with an offset are converted to UTC
+              example: "2024-06-15T08:30:00"
+            oee:
+              type: number
+              example: 81.2
+            availability:
+              type: number
+              example: 92.0
+            performance:
+              type: number
+              example: 88.4
+            output_quality:
+              type: number
+              example: 99.1
+            status:
+              type: string
+              example: "Running"
+    responses:
+      202:
+        description: Reading accepted, written with the next batch (within METRIC_BUFFER_FLUSH_INTERVAL seconds)
+        schema:
+          type: object
+          properties:
+            queue_depth:
+              type: integer
+              example: 118
+      400:
+        description: Invalid reading
+      503:
+        description: Write buffer full, retry after the delay given in Retry-After
+    """
+    reading = request.get_json(silent=True)
+    if not isinstance(reading, dict):
+        return jsonify({"error": "Body must be a JSON object"}), 400
+
+    buffer = MetricBuffer.for_app(current_app._get_current_object())
+    try:
+        # machines already seen are not looked up again
+        row, = validate_readings(db.session, [reading], known_machines=buffer.known_machines)
+    except InvalidReadings as e:
+        return jsonify({"error": str(e), "errors": e.errors}), 400
+
+    try:
+        depth = buffer.put(row)
+    except BufferFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(max(1, round(buffer.flush_interval)))}
+    return jsonify({"queue_depth": depth}), 202
+
+
+@bp.route('/machine-metrics/buffer', methods=['GET'])
+def get_metric_buffer_stats():
+    """
+    Get the queue depth and flush latency of the write-behind buffer of this process
+    ---
+    responses:
+      200:
+        description: Buffer metrics
+        schema:
+          type: object
+          properties:
+            queue_depth:
+              type: integer
+              example: 118
+            in_flight:
+              type: integer
+              example: 0
+            flushes:
+              type: integer
+              example: 4211
+            rows_written:
+              type: integer
+              example: 2104377
+            rows_failed:
+              type: integer
+              example: 0
+            rejected:
+              type: integer
+              example: 0
+            dead_letters:
+              type: array
+              description: Last readings that could not be written, with the database error
+              items:
+                type: object
+            last_flush_seconds:
+              type: number
+              example: 0.041
+            avg_flush_seconds:
+              type: number
+              example: 0.038
+            max_flush_seconds:
+              type: number
+              example: 0.212
+    """
+    return jsonify(MetricBuffer.for_app(current_app._get_current_object()).stats())
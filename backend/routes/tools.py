@@ -1,9 +1,18 @@
-from flask import Blueprint, request, jsonify
-from models import Tool
+from math import ceil
+from flask import Blueprint, jsonify
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
+from models import db, Tool
+from pagination import parse_page_args, page_rows
+from cache import cached
 
 bp = Blueprint('tools', __name__)
 
+# sort orders of GET /tools, each backed by an index ending with the id
+TOOL_SORTS = {'id': Tool.id, 'name': Tool.name, 'created_at': Tool.created_at}
+
 @bp.route('/tools', methods=['GET'])
+@cached('tools', 'tool_metrics')
 def get_tools():
     """
     Get a paginated list of tools
@@ -21,6 +30,29 @@ def get_tools():
         required: false
         default: 30
         description: Number of tools per page
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: Keyset pagination, next_cursor of the previous page (empty for the first page); page is ignored
+      - name: sort
+        in: query
+        type: string
+        required: false
+        default: id
+        enum: ['id', 'name', 'created_at']
+      - name: order
+        in: query
+        type: string
+        required: false
+        default: asc
+        enum: ['asc', 'desc']
+      - name: count
+        in: query
+        type: boolean
+        required: false
+        default: true
+        description: false skips counting the tools (total and pages are then null)
     responses:
       200:
         description: A paginated list of tools with associated metrics
@@ -68,14 +100,33 @@ def get_tools():
             pages:
               type: integer
               example: 2
+            next_cursor:
+              type: string
+              description: Only with cursor, null on the last page
+      400:
+        description: Invalid sort, order or cursor
     """
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 30, type=int)
+    args, error = parse_page_args(TOOL_SORTS)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # the metrics of all the tools of the page come with one selectinload IN query
+    statement = select(Tool).options(selectinload(Tool.metrics))
+    counted = args["count"] and not args["keyset"]
+    if counted:
+        # offset pages count the tools in the same query (window function)
+        statement = statement.add_columns(func.count().over().label('total'))
+    rows, next_cursor = page_rows(statement, args, key=lambda row: [getattr(row[0], c.key) for c in args["columns"]])
 
-    tools_paginated = Tool.query.paginate(page=page, per_page=per_page, error_out=False)
+    total = None
+    if counted and rows:
+        total = rows[0].total
+    elif args["count"]:
+        # cursor pages, or past the last page
+        total = db.session.execute(select(func.count()).select_from(Tool)).scalar()
 
     result = []
-    for tool in tools_paginated.items:
+    for tool in (row[0] for row in rows):
         tool_data = {
             "id": tool.id,
             "name": tool.name,
@@ -93,10 +144,11 @@ def get_tools():
 
         result.append(tool_data)
 
-    print("result: ", result)
+    if args["keyset"]:
+        return jsonify({"tools": result, "total": total, "next_cursor": next_cursor})
     return jsonify({
         "tools": result,
-        "total": tools_paginated.total,
-        "page": tools_paginated.page,
-        "pages": tools_paginated.pages
-    })
\ No newline at end of file
+        "total": total,
+        "page": args["page"],
+        "pages": ceil(total / args["per_page"]) if total is not None else None
+    })
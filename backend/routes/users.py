@@ -3,10 +3,12 @@ from models import User
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 from models import db
+from cache import cached, invalidate
 
 bp = Blueprint('users', __name__)
 
 @bp.route('/users', methods=['GET'])
+@cached('users')
 def get_users():
     """
     Get all users
@@ -97,11 +99,12 @@ def register_user():
             username=data['username'],
             firstname=data['first_name'],
             lastname=data['last_name'],
-            created_at=datetime.utcnow().strftime("%Y-%m-%d")
+            created_at=datetime.utcnow()
         )
 
         db.session.add(user)
         db.session.commit()
+        invalidate('users')
         return jsonify({"message": "New user added successfully!"}), 201
 
     except Exception as e:
@@ -0,0 +1,86 @@
+"""
+Routes the read-only queries of GET requests to the read replica.
+
+WHY: The heavy read paths (/machines, dashboards, maintenance history) compete with writes
+for the primary's connections. When SQLALCHEMY_REPLICA_URI is set, the session sends the
+queries of GET/HEAD/OPTIONS requests to the 'replica' bind, everything else (POST/PUT/DELETE
+requests, flushes, imports and background threads) stays on the primary.
+
+Read-your-writes: the response to a write request carries the REPLICA_STICKY_HEADER header
+(epoch seconds, DB_REPLICA_STICKY_SECONDS from now, longer than the expected replication lag).
+Clients send it back on their next requests, which read from the primary until then. A
+header, unlike a cookie, also works for the frontend calling from another origin without
+credentials. A request that flushes changes also reads from the primary afterwards.
+"""
+import time
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND = 'replica'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+REPLICA_STICKY_HEADER = 'X-Read-Primary-Until'
+# seconds a client reads from the primary after a write
+DEFAULT_STICKY_SECONDS = 5
+
+# WSGI environ key of the routing decision of a request
+_READ_REPLICA = 'machine_management.read_replica'
+
+
+def is_sticky():
+    """
+    Whether the client of the current request wrote recently and must read from the primary.
+    """
+    try:
+        return float(request.headers.get(REPLICA_STICKY_HEADER, 0)) >= time.time()
+    except ValueError:
+        return False
+
+
+def reads_from_replica():
+    """
+    Whether the queries of the current request may go to the replica.
+    """
+    if not has_request_context():
+        return False
+    # kept on the request, an app context can outlive several requests (test clients)
+    if _READ_REPLICA not in request.environ:
+        request.environ[_READ_REPLICA] = request.method in READ_METHODS and not is_sticky()
+    return request.environ[_READ_REPLICA]
+
+
+def replica_may_lag(last_write):
+    """
+    Whether the current request reads from a replica that may not have replayed a write yet.
+
+    @param last_write Epoch seconds of the last write to the tables read, None if unknown
+    """
+    if last_write is None or REPLICA_BIND not in current_app.config.get('SQLALCHEMY_BINDS', {}):
+        return False
+    lag = current_app.config.get('DB_REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+    return reads_from_replica() and time.time() - last_write < lag
+
+
+class RoutingSession(Session):
+    """
+    Session choosing between the primary and the 'replica' bind for each statement.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and REPLICA_BIND in self._db.engines and reads_from_replica():
+            if not self._flushing:
+                return self._db.engines[REPLICA_BIND]
+            # the request writes, later reads must see its changes
+            request.environ[_READ_REPLICA] = False
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def init_app(app):
+    """
+    Sets the stickiness header on the responses to write requests.
+    """
+    @app.after_request
+    def stick_to_primary(response):
+        if REPLICA_BIND in app.config.get('SQLALCHEMY_BINDS', {}) and request.method not in READ_METHODS:
+            seconds = app.config.get('DB_REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+            response.headers[REPLICA_STICKY_HEADER] = f"{time.time() + seconds:.3f}"
+        return response
@@ -1,4 +1,5 @@
 import pytest
+from sqlalchemy import event
 from app import create_app
 from models import db as _db
 from datetime import datetime, timedelta
@@ -98,8 +99,8 @@ def setup_metrics(db):
 def app():
     app = create_app(testing=True)
     with app.app_context():
-        _db.drop_all()
-        _db.create_all()
+        _db.drop_all(bind_key=None)
+        _db.create_all(bind_key=None)
         yield app
 
 @pytest.fixture
@@ -108,4 +109,16 @@ def client(app):
 
 @pytest.fixture
 def db(app):
-    return _db
\ No newline at end of file
+    return _db
+
+@pytest.fixture
+def query_log(db):
+    """Statements (and their parameters) sent to the database during the test."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', record)
@@ -51,6 +51,37 @@ def test_assign_and_get_tool(client, db):
     assert data["tool_name"] == "Drill Bit A"
     assert data["wear_level"] == 23.5
 
+def test_get_machines_tools_batch(client, db, query_log):
+    from models import Tool, ToolMetric, ToolAssignment
+    from datetime import datetime
+    add_machines(db, [1, 2, 3])
+    tools = [Tool(name=f"Drill {i}", type="Drill", created_at=datetime(2024, 1, 1)) for i in range(2)]
+    db.session.add_all(tools)
+    db.session.flush()
+    db.session.add_all([
+        ToolMetric(tool_id=tools[0].id, status="attached", storage_location="N/A", wear_level=40),
+        ToolMetric(tool_id=tools[0].id, status="attached", storage_location="N/A", wear_level=90),
+        ToolAssignment(machine_id=1, tool_id=tools[0].id),
+        ToolAssignment(machine_id=2, tool_id=tools[1].id),
+    ])
+    db.session.commit()
+
+    query_log.clear()
+    assert client.get('/machines/1/tool').get_json() == {"tool_name": "Drill 0", "wear_level": 40}
+    assert len(query_log) == 1
+
+    query_log.clear()
+    data = client.get('/machines/tools?ids=3,1,2').get_json()
+    assert data['machines'] == [
+        {"machine_id": 3, "tool_name": None, "wear_level": None},
+        {"machine_id": 1, "tool_name": "Drill 0", "wear_level": 40},
+        {"machine_id": 2, "tool_name": "Drill 1", "wear_level": None},
+    ]
+    assert len(query_log) == 1
+
+    assert client.get('/machines/tools').status_code == 400
+    assert client.get('/machines/tools?ids=1,x').status_code == 400
+
 def test_get_valid_metric(client, setup_metrics):
     resp = client.get('/machines/1/dashboard/performance')
     assert resp.status_code == 200
@@ -97,6 +128,28 @@ def test_get_machine_maintenance(client, setup_user_and_logs):
     dates = [log['date'] for log in data['maintenance_logs']]
     assert dates == sorted(dates)
 
+def test_get_machine_maintenance_query_count(client, db, query_log):
+    from models import MaintenanceLog, User
+    from datetime import datetime, timedelta
+    add_machines(db, [1])
+    users = [User(username=f"tech{i}", firstname=f"First{i}", lastname=f"Last{i}",
+                  created_at=datetime(2024, 1, 1)) for i in range(20)]
+    db.session.add_all(users)
+    db.session.flush()
+    db.session.add_all([
+        MaintenanceLog(machine_id=1, performed_by=users[i % 20].id, date=datetime(2020, 1, 1) + timedelta(days=i),
+                       notes="Checked", planned=i % 2 == 0)
+        for i in range(1000)
+    ])
+    db.session.commit()
+    db.session.expunge_all()
+
+    query_log.clear()
+    data = client.get('/machines/1/maintenance').get_json()
+    assert len(data['maintenance_logs']) == 1000
+    assert data['maintenance_logs'][21]['performed_by'] == "First1 Last1"
+    assert len(query_log) == 1
+
 def test_post_maintenance_success(client, setup_user_and_logs):
     user, _ = setup_user_and_logs
     new_log = {
@@ -183,6 +236,71 @@ def test_get_tools_with_custom_pagination(client, setup_tools_with_metrics):
     assert data['pages'] == 3
     assert len(data['tools']) == 2
 
+def test_get_tools_query_count(client, db, query_log):
+    from models import Tool, ToolMetric
+    from datetime import datetime
+    for i in range(120):
+        tool = Tool(name=f"Tool {i}", type="Drill", created_at=datetime(2024, 6, 1))
+        tool.metrics = [ToolMetric(status="attached", storage_location="N/A", wear_level=i + w) for w in range(2)]
+        db.session.add(tool)
+    db.session.commit()
+
+    for per_page in (5, 50):
+        query_log.clear()
+        data = client.get(f'/tools?per_page={per_page}&page=2').get_json()
+        assert len(data['tools']) == per_page
+        assert all(len(tool['metrics']) == 2 for tool in data['tools'])
+        assert data['total'] == 120
+        assert len(query_log) <= 2
+
+    data = client.get('/tools?per_page=50&page=4').get_json()
+    assert data['tools'] == [] and data['total'] == 120 and data['pages'] == 3
+
+def test_keyset_pagination_machines_and_tools(client, db, query_log):
+    from models import Machine, Tool, ToolMetric
+    from datetime import datetime
+    db.session.add_all([
+        Machine(id=i, name=f"Machine {i % 7}", category="Manual", group="CNC", manufacturer="Fanuc",
+                created_at=datetime(2024, 1, 1 + i % 5))
+        for i in range(1, 51)
+    ])
+    for i in range(1, 51):
+        db.session.add(Tool(id=i, name=f"Tool {i % 3}", type="Drill", created_at=datetime(2024, 1, 1),
+                            metrics=[ToolMetric(status="attached", storage_location="N/A", wear_level=i)]))
+    db.session.commit()
+
+    expected = [m.id for m in Machine.query.order_by(Machine.name.desc(), Machine.id.desc())]
+    ids, cursor, pages = [], '', 0
+    while cursor is not None:
+        data = client.get(f'/machines?sort=name&order=desc&per_page=8&count=false&cursor={cursor}').get_json()
+        assert data['total'] is None
+        ids += [m['id'] for m in data['machines']]
+        cursor = data['next_cursor']
+        pages += 1
+    assert ids == expected and pages == 7
+
+    # a deep page is one range scan of the (name, id) index, not an OFFSET walk
+    query_log.clear()
+    client.get(f'/machines?sort=name&per_page=8&count=false&cursor=')
+    statement, parameters = query_log[0]
+    plan = ' '.join(row[-1] for row in db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters))
+    assert "ix_machines_name_id" in plan and "TEMP B-TREE" not in plan
+
+    first = client.get('/tools?sort=created_at&per_page=20&cursor=').get_json()
+    assert first['total'] == 50 and len(first['tools']) == 20
+    query_log.clear()
+    second = client.get(f"/tools?sort=created_at&per_page=20&count=false&cursor={first['next_cursor']}").get_json()
+    assert [t['id'] for t in second['tools']] == list(range(21, 41))
+    assert all(t['metrics'][0]['wear_level'] == t['id'] for t in second['tools'])
+    assert len(query_log) == 2
+
+    # offset pages can skip the count too
+    data = client.get('/machines?page=2&per_page=10&count=false').get_json()
+    assert data['total'] is None and data['pages'] is None and data['machines'][0]['id'] == 11
+
+    assert client.get('/machines?cursor=bogus').status_code == 400
+    assert client.get('/tools?sort=type').status_code == 400
+
 def test_get_tools_empty_result(client):
     response = client.get('/tools')
     assert response.status_code == 200
@@ -240,4 +358,1021 @@ def test_register_user_missing_field(client):
 
     data = response.get_json()
     assert "error" in data
-    assert "last_name" in data["error"]  # should raise a KeyError
\ No newline at end of file
+    assert "last_name" in data["error"]  # should raise a KeyError
+
+def import_and_wait(client, query=''):
+    """Starts an import job and waits for it to finish, returns the final job status."""
+    import time
+    response = client.post(f'/import-csv{query}')
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+    for _ in range(200):
+        job = client.get(status_url).get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("import job did not finish")
+
+def test_import_csv_bulk_load(client, db):
+    from models import Machine, MachineMetric, ToolMetric
+    job = import_and_wait(client)
+    assert job['status'] == 'done'
+
+    assert job['result']['machines'] == 50
+    assert job['result']['machine_metrics'] == MachineMetric.query.count()
+    assert Machine.query.count() == 50
+    # locations are only kept for tools in storage
+    assert all(m.storage_location == "N/A" for m in ToolMetric.query.filter(ToolMetric.status != 'in storage'))
+
+def test_import_job_reports_progress(client, db):
+    from models import MachineMetric
+    job = import_and_wait(client, '?mode=stream&chunk_size=1000')
+    assert job['status'] == 'done'
+
+    total = MachineMetric.query.count()
+    assert job['rows']['machine_metrics'] == {"loaded": total, "expected": total}
+    assert job['rows_loaded'] == job['rows_expected']
+    assert job['eta_seconds'] == 0
+    assert job['throughput_rows_per_second'] > 0
+
+def test_import_csv_invalid_mode(client):
+    response = client.post('/import-csv?mode=nope')
+    assert response.status_code == 400
+    assert "Invalid mode" in response.get_json()['error']
+
+def test_import_csv_invalid_chunk_size(client, db):
+    from importer import CSV_SOURCES, stream_load
+    import pytest
+    for chunk_size in ('0', '-5', 'many'):
+        response = client.post(f'/import-csv?mode=stream&chunk_size={chunk_size}')
+        assert response.status_code == 400
+        assert "chunk_size" in response.get_json()['error']
+    # a stream that would never yield a chunk fails instead of loading nothing
+    with pytest.raises(ValueError):
+        next(stream_load(db.session, CSV_SOURCES[0], chunk_size=0))
+
+def test_import_job_not_found(client):
+    assert client.get('/import-jobs/unknown').status_code == 404
+
+def test_import_csv_incremental_mode(app, client, db, tmp_path):
+    import csv
+    from importer import CSV_DIR
+    from models import MachineMetric
+    assert import_and_wait(client)['status'] == 'done'
+
+    with open(f"{CSV_DIR}/machine_metrics.csv", newline='') as f:
+        reader = csv.DictReader(f)
+        header = reader.fieldnames
+        unchanged, modified = next(reader), next(reader)
+    total = MachineMetric.query.count()
+    modified['oee'] = '12.5'
+    new_row = dict(unchanged, id=str(total + 1))
+
+    with open(tmp_path / 'machine_metrics.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=header)
+        writer.writeheader()
+        writer.writerows([unchanged, modified, new_row])
+
+    app.config['IMPORT_CSV_DIR'] = str(tmp_path)
+    job = import_and_wait(client, '?mode=incremental')
+    assert job['result'] == {"machine_metrics": {"read": 3, "written": 2}}
+    assert MachineMetric.query.count() == total + 1
+    assert db.session.get(MachineMetric, int(modified['id'])).oee == 12.5
+    # the new metric is now the latest one of its machine
+    machine = client.get('/machines?per_page=1').get_json()['machines'][0]
+    assert machine['id'] == int(new_row['machine_id']) and machine['status'] == new_row['status']
+
+def test_import_csv_incremental_mode_moves_a_metric(app, client, db, tmp_path):
+    import csv
+    from importer import CSV_DIR
+    from models import MachineLatestStatus, MachineMetricRollup, MachineFleetRollup
+    from projections import rebuild_projections
+    assert import_and_wait(client)['status'] == 'done'
+
+    with open(f"{CSV_DIR}/machine_metrics.csv", newline='') as f:
+        reader = csv.DictReader(f)
+        header = reader.fieldnames
+        # the latest metric of the last machine moves to machine 1, a year later
+        moved = list(reader)[-1]
+    old_machine = int(moved['machine_id'])
+    moved.update(machine_id='1', timestamp='2026-01-15')
+    with open(tmp_path / 'machine_metrics.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=header)
+        writer.writeheader()
+        writer.writerow(moved)
+
+    app.config['IMPORT_CSV_DIR'] = str(tmp_path)
+    assert import_and_wait(client, '?mode=incremental')['result'] == {"machine_metrics": {"read": 1, "written": 1}}
+    assert db.session.get(MachineLatestStatus, old_machine).metric_id != int(moved['id'])
+
+    # the machine and buckets the metric left match a rebuild (sums rounded, their order differs)
+    projections = lambda: [
+        sorted(tuple(round(value, 6) if isinstance(value, float) else value for value in row)
+               for row in db.session.query(*model.__table__.c))
+        for model in (MachineLatestStatus, MachineMetricRollup, MachineFleetRollup)
+    ]
+    incremental = projections()
+    rebuild_projections(db.session.connection())
+    db.session.commit()
+    assert incremental == projections()
+
+def test_incremental_lookup_only_reads_the_delta_ids(client, db, query_log):
+    from importer import CSV_SOURCES
+    from importer.incremental import stored_hashes
+    from models import MachineMetric
+    assert import_and_wait(client)['status'] == 'done'
+    source = next(s for s in CSV_SOURCES if s.table is MachineMetric.__table__)
+    last = db.session.query(db.func.max(MachineMetric.id)).scalar()
+
+    del query_log[:]
+    hashes = stored_hashes(db.session.connection(), source, [1, 2, last, last + 1])
+    assert set(hashes) == {1, 2, last}
+    assert hashes[last][1][0] == last
+    statement, parameters = query_log[-1]
+    assert "IN" in statement and "BETWEEN" not in statement
+
+
+def test_import_dependencies_from_metadata():
+    from importer import dependencies
+    graph = dependencies()
+    assert graph['machines'] == graph['tools'] == graph['users'] == set()
+    assert graph['machine_metrics'] == {'machines'}
+    assert graph['maintenance_logs'] == {'machines', 'users'}
+    assert graph['tool_assignment'] == {'machines', 'tools'}
+
+def test_import_csv_parallel_mode(app, client, db):
+    from models import MachineMetric, MaintenanceLog
+    app.config['IMPORT_PARSE_WORKERS'] = 2
+    job = import_and_wait(client, '?mode=parallel')
+    assert job['status'] == 'done'
+
+    rows = job['result']
+    assert rows['machines'] == 50
+    assert rows['machine_metrics'] == MachineMetric.query.count()
+    assert rows['maintenance_logs'] == MaintenanceLog.query.count()
+
+def test_hot_queries_use_indexes(client, db, query_log, setup_metrics, setup_user_and_logs, setup_tools_with_metrics):
+    import re
+    from migrations.m0001_hot_path_indexes import INDEXES
+    assert len(INDEXES) == 4
+
+    hot_paths = [
+        ('/machines/1/dashboard/oee?days=5', 'machine_metrics'),
+        ('/machines/1/maintenance', 'maintenance_logs'),
+        ('/tools', 'tool_metrics'),
+    ]
+    for url, table in hot_paths:
+        query_log.clear()
+        assert client.get(url).status_code == 200
+        statements = [(s, p) for s, p in query_log if f"FROM {table}" in s]
+        assert statements, url
+        for statement, parameters in statements:
+            plan = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            details = ' | '.join(row[-1] for row in plan)
+            assert re.search(f"SEARCH {table} USING (COVERING )?INDEX ix_{table}", details), details
+
+def test_get_machines_latest_status(client, db):
+    from models import Machine, MachineMetric
+    from datetime import datetime
+    machine = Machine(name="Press", category="Automatic", group="Press", manufacturer="Bosch",
+                      created_at=datetime(2024, 1, 1))
+    db.session.add(machine)
+    db.session.flush()
+
+    def metric(id, status):
+        return MachineMetric(id=id, machine_id=machine.id, timestamp=datetime(2024, 6, id), oee=80,
+                             availability=90, performance=85, output_quality=99, status=status)
+
+    db.session.add_all([metric(1, "Offline"), metric(3, "Running")])
+    db.session.commit()
+    # a late metric older than the current one must not replace the status
+    db.session.add(metric(2, "Offline"))
+    db.session.commit()
+
+    data = client.get('/machines').get_json()
+    assert data['total'] == 1
+    assert data['machines'][0]['status'] == "Running"
+
+def test_projections_follow_moved_and_deleted_metrics(client, db):
+    from models import MachineMetric, MachineLatestStatus, MachineMetricRollup
+    from datetime import datetime
+    import events
+    add_machines(db, [1, 2])
+
+    def metric(id, machine_id, day, status):
+        return MachineMetric(id=id, machine_id=machine_id, timestamp=datetime(2024, 6, day), oee=80,
+                             availability=90, performance=85, output_quality=99, status=status)
+
+    db.session.add_all([metric(1, 1, 1, "Offline"), metric(2, 2, 1, "Offline"), metric(3, 1, 10, "Running")])
+    db.session.commit()
+
+    def state():
+        statuses = {row.machine_id: row.status for row in MachineLatestStatus.query}
+        days = sorted((r.machine_id, r.bucket_start.day) for r in MachineMetricRollup.query.filter_by(granularity='day'))
+        return statuses, days
+
+    # the latest metric of machine 1 is moved to machine 2, machine 1 falls back to its previous one
+    subscription = events.publisher.subscribe()
+    moved = db.session.get(MachineMetric, 3)
+    moved.machine_id = 2
+    db.session.commit()
+    assert state() == ({1: "Offline", 2: "Running"}, [(1, 1), (2, 1), (2, 10)])
+    published = {data['machine_id']: data['status'] for _, event_type, data in [subscription.get(1), subscription.get(1)]}
+    assert published == {1: "Offline", 2: "Running"}
+    events.publisher.unsubscribe(subscription)
+
+    # moved to another day
+    moved.timestamp = datetime(2024, 6, 5)
+    db.session.commit()
+    assert state()[1] == [(1, 1), (2, 1), (2, 5)]
+
+    db.session.delete(moved)
+    db.session.commit()
+    assert state() == ({1: "Offline", 2: "Offline"}, [(1, 1), (2, 1)])
+
+def test_import_refreshes_latest_status(client, db):
+    from models import MachineMetric
+    assert import_and_wait(client)['status'] == 'done'
+
+    machines = client.get('/machines?per_page=100').get_json()['machines']
+    assert len(machines) == 50
+    for machine in machines[:5]:
+        latest = MachineMetric.query.filter_by(machine_id=machine['id']).order_by(MachineMetric.id.desc()).first()
+        assert machine['status'] == latest.status
+
+def test_get_machines_status_without_projection_row(client, db, query_log):
+    from models import Machine, MachineMetric
+    from datetime import datetime
+    db.session.add_all([
+        Machine(id=i, name=f"Lathe {i}", category="Manual", group="CNC", manufacturer="Fanuc",
+                created_at=datetime(2024, 1, 1))
+        for i in (1, 2, 3)
+    ])
+    db.session.commit()
+    # written with Core, bypassing the projection listener
+    db.session.execute(MachineMetric.__table__.insert(), [
+        {"id": i, "machine_id": machine_id, "timestamp": datetime(2024, 6, i), "oee": 80, "availability": 90,
+         "performance": 85, "output_quality": 99, "status": status}
+        for i, machine_id, status in [(1, 1, "Running"), (2, 1, "Offline"), (3, 3, "Running")]
+    ])
+    db.session.commit()
+
+    query_log.clear()
+    data = client.get('/machines?per_page=2').get_json()
+    assert [m['status'] for m in data['machines']] == ["Offline", None]
+    # only the machines of the page are looked up in machine_metrics
+    lookups = [p for s, p in query_log if "FROM machine_metrics" in s]
+    assert lookups == [(1, 2, 1)]
+
+def test_get_batched_dashboard(client, setup_metrics):
+    resp = client.get('/machines/1/dashboard?metrics=oee,performance&days=5')
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['metrics'] == ['oee', 'performance']
+    assert data['days_requested'] == 5
+    assert len(data['timestamps']) == 5
+    assert data['timestamps'] == sorted(data['timestamps'])
+    assert set(data['series']) == {'oee', 'performance'}
+
+    # same values as the single-metric endpoint
+    single = client.get('/machines/1/dashboard/oee?days=5').get_json()['data']
+    assert data['series']['oee'] == [point['value'] for point in single]
+    assert data['timestamps'] == [point['timestamp'] for point in single]
+
+def test_get_batched_dashboard_defaults_and_errors(client, setup_metrics):
+    data = client.get('/machines/1/dashboard').get_json()
+    assert data['metrics'] == ['oee', 'availability', 'performance', 'output_quality']
+    assert all(len(values) == 10 for values in data['series'].values())
+
+    resp = client.get('/machines/1/dashboard?metrics=oee,bogus')
+    assert resp.status_code == 400
+    assert "bogus" in resp.get_json()['error']
+
+def test_dashboard_bucketing(client, db):
+    from models import MachineMetric
+    from datetime import datetime
+    # Monday 2024-06-03 to Sunday 2024-06-16, oee = day of month - 2
+    db.session.add_all([
+        MachineMetric(machine_id=1, timestamp=datetime(2024, 6, day), oee=day - 2, availability=90,
+                      performance=80, output_quality=99, status="Running")
+        for day in range(3, 17)
+    ])
+    db.session.commit()
+
+    data = client.get('/machines/1/dashboard/oee?bucket=week').get_json()
+    assert data['bucket'] == 'week' and data['agg'] == 'avg'
+    assert data['data'] == [{"timestamp": "2024-06-03", "value": 4}, {"timestamp": "2024-06-10", "value": 11}]
+
+    data = client.get('/machines/1/dashboard?metrics=oee,performance&bucket=month&agg=max').get_json()
+    assert data['timestamps'] == ["2024-06-01"]
+    assert data['series'] == {"oee": [14], "performance": [80]}
+
+    # days keeps the most recent records before bucketing
+    data = client.get('/machines/1/dashboard?metrics=oee&days=7&bucket=day&agg=count').get_json()
+    assert data['timestamps'][0] == "2024-06-10" and len(data['timestamps']) == 7
+
+    assert client.get('/machines/1/dashboard/oee?bucket=year').status_code == 400
+    assert client.get('/machines/1/dashboard/oee?bucket=week&agg=median').status_code == 400
+    assert client.get('/machines/1/dashboard/status?bucket=week').status_code == 400
+
+def test_dashboard_reads_incrementally_refreshed_rollups(client, db, query_log):
+    from models import MachineMetric, MachineMetricRollup
+    from datetime import datetime
+    db.session.add_all([
+        MachineMetric(machine_id=1, timestamp=datetime(2024, 6, day, 8), oee=day, availability=90,
+                      performance=80, output_quality=99, status="Running")
+        for day in (3, 4, 10)
+    ])
+    db.session.commit()
+    weeks = MachineMetricRollup.query.filter_by(machine_id=1, granularity='week').order_by('bucket_start').all()
+    assert [(w.bucket_start.isoformat(), w.count, w.oee_sum) for w in weeks] == [("2024-06-03", 2, 7), ("2024-06-10", 1, 10)]
+
+    # a later write only refreshes the buckets it falls in
+    db.session.add(MachineMetric(machine_id=1, timestamp=datetime(2024, 6, 12), oee=20, availability=90,
+                                 performance=80, output_quality=99, status="Running"))
+    db.session.commit()
+    assert MachineMetricRollup.query.filter_by(machine_id=1, granularity='week').count() == 2
+
+    query_log.clear()
+    data = client.get('/machines/1/dashboard?metrics=oee&bucket=week&agg=avg').get_json()
+    assert data['series']['oee'] == [3.5, 15]
+    assert not any("FROM machine_metrics " in s for s, p in query_log)
+
+    data = client.get('/machines/1/dashboard/oee?bucket=day&agg=min&from=2024-06-04&to=2024-06-12').get_json()
+    assert data['data'] == [{"timestamp": "2024-06-04", "value": 4}, {"timestamp": "2024-06-10", "value": 10}]
+
+def test_dashboard_rollups_clip_the_window_edges(client, db, query_log):
+    from models import MachineMetric
+    from datetime import datetime
+    # Monday 2024-06-03 to Sunday 2024-06-23, oee = day of month
+    db.session.add_all([
+        MachineMetric(machine_id=1, timestamp=datetime(2024, 6, day, 12), oee=day, availability=90,
+                      performance=80, output_quality=99, status="Running")
+        for day in range(3, 24)
+    ])
+    db.session.commit()
+
+    # the weeks cut by from/to only aggregate the records inside the window
+    query_log.clear()
+    data = client.get('/machines/1/dashboard/oee?bucket=week&agg=count&from=2024-06-05T13:00&to=2024-06-19').get_json()
+    assert data['data'] == [{"timestamp": "2024-06-03", "value": 4}, {"timestamp": "2024-06-10", "value": 7},
+                            {"timestamp": "2024-06-17", "value": 2}]
+    # the whole week comes from the rollups, the two edges from the raw records
+    assert len([s for s, p in query_log if "FROM machine_metric_rollups" in s]) == 1
+    assert len([s for s, p in query_log if "FROM machine_metrics " in s]) == 2
+
+    data = client.get('/machines/1/dashboard/oee?bucket=week&agg=avg&from=2024-06-05&to=2024-06-07').get_json()
+    assert data['data'] == [{"timestamp": "2024-06-03", "value": 5.5}]
+    data = client.get('/machines/1/dashboard/oee?bucket=month&agg=min&days=3').get_json()
+    assert data['data'] == [{"timestamp": "2024-06-01", "value": 21}]
+
+def test_dashboard_window_offsets_are_converted_to_utc(client, db):
+    from models import MachineMetric
+    from datetime import datetime
+    add_machines(db, [1])
+    db.session.add_all([
+        MachineMetric(machine_id=1, timestamp=datetime(2024, 6, day, hour), oee=hour, availability=90,
+                      performance=80, output_quality=99, status="Running")
+        for day, hour in [(5, 10), (5, 12), (6, 0), (6, 12)]
+    ])
+    db.session.commit()
+
+    # 13:00+02:00 is 11:00 UTC
+    data = client.get('/machines/1/dashboard/oee', query_string={"from": "2024-06-05T13:00:00+02:00",
+                                                                   "to": "2024-06-06T01:00:00Z"}).get_json()
+    assert data['data'] == [{"timestamp": "2024-06-05T12:00:00", "value": 12},
+                            {"timestamp": "2024-06-06T00:00:00", "value": 0}]
+    # 02:00+02:00 is midnight UTC: June 6th is a whole day of the fleet window
+    data = client.get('/fleet/dashboard', query_string={"group_by": "group", "from": "2024-06-06T02:00:00+02:00"}).get_json()
+    assert data['groups']['group'][0]['records'] == 2
+
+def test_fleet_dashboard(client, db, query_log):
+    from models import Machine, MachineMetric
+    from datetime import datetime
+    db.session.add_all([
+        Machine(id=i, name=f"Machine {i}", category=category, group=group, manufacturer="Fanuc",
+                created_at=datetime(2024, 1, 1))
+        for i, group, category in [(1, "CNC", "Manual"), (2, "CNC", "Auto"), (3, "Press", "Auto")]
+    ])
+    db.session.add_all([
+        MachineMetric(machine_id=machine_id, timestamp=datetime(2024, 6, day), oee=oee, availability=90,
+                      performance=80, output_quality=99, status="Running")
+        for machine_id, day, oee in [(1, 1, 60), (1, 10, 80), (2, 10, 90)]
+    ])
+    db.session.commit()
+
+    query_log.clear()
+    data = client.get('/fleet/dashboard?group_by=machine,group,category,manufacturer').get_json()
+    assert data['page'] == 1
+    assert [(m['machine_id'], m['records'], m['oee']) for m in data['machines']] == [(1, 2, 70), (2, 1, 90), (3, 0, None)]
+    assert data['groups']['group'] == [
+        {"name": "CNC", "machines": 2, "records": 3, "oee": 230 / 3, "availability": 90, "performance": 80,
+         "output_quality": 99},
+        {"name": "Press", "machines": 1, "records": 0, "oee": None, "availability": None, "performance": None,
+         "output_quality": None},
+    ]
+    assert [g['name'] for g in data['groups']['category']] == ["Auto", "Manual"]
+    # grouped queries of the rollups, raw metrics untouched
+    assert not any("FROM machine_metrics " in s for s, p in query_log)
+
+    query_log.clear()
+    data = client.get('/fleet/dashboard?group_by=group&days=5').get_json()
+    assert 'machines' not in data and set(data['groups']) == {'group'}
+    assert data['groups']['group'][0]['oee'] == 85
+    # the group levels only read the fleet rollups, not a row per machine
+    assert not any("sum(machine_metric_rollups.count)" in s for s, p in query_log)
+    assert any("FROM machine_fleet_rollups" in s for s, p in query_log)
+    assert client.get('/fleet/dashboard?group_by=plant').status_code == 400
+
+    # the machine level is opt-in and paged, the group levels are the default
+    data = client.get('/fleet/dashboard').get_json()
+    assert 'machines' not in data and set(data['groups']) == {'group', 'category', 'manufacturer'}
+    data = client.get('/fleet/dashboard?group_by=machine&per_page=2&page=2&sort=name&order=desc').get_json()
+    assert data['page'] == 2 and [m['machine_id'] for m in data['machines']] == [1]
+    # no raw points to page through
+    for query in ('limit=10', 'cursor=', 'group_by=machine&cursor=abc'):
+        resp = client.get(f'/fleet/dashboard?{query}')
+        assert resp.status_code == 400 and "limit and cursor" in resp.get_json()['error']
+
+def test_fleet_dashboard_window_and_fleet_rollups(client, db):
+    from models import Machine, MachineMetric, MachineFleetRollup
+    from projections import refresh_fleet_rollups
+    from datetime import datetime
+    db.session.add_all([
+        Machine(id=i, name=f"Machine {i}", category="Auto", group=group, manufacturer="Fanuc",
+                created_at=datetime(2024, 1, 1))
+        for i, group in [(1, "CNC"), (2, "Press")]
+    ])
+    db.session.commit()
+
+    # a days window without any record still lists every machine
+    data = client.get('/fleet/dashboard?days=7&group_by=machine,group').get_json()
+    assert [(m['machine_id'], m['records']) for m in data['machines']] == [(1, 0), (2, 0)]
+    assert [(g['name'], g['machines'], g['oee']) for g in data['groups']['group']] == [("CNC", 1, None), ("Press", 1, None)]
+
+    def reading(machine_id, day, oee):
+        return MachineMetric(machine_id=machine_id, timestamp=datetime(2024, 6, day, 12), oee=oee, availability=90,
+                             performance=80, output_quality=99, status="Running")
+
+    db.session.add_all([reading(1, 20, 80), reading(2, 10, 60)])
+    db.session.commit()
+    # a late reading of an older day gets the highest id, days still count back from June 20th
+    db.session.add(reading(2, 1, 10))
+    db.session.commit()
+    data = client.get('/fleet/dashboard?days=15&group_by=machine,group').get_json()
+    assert [(m['machine_id'], m['records'], m['oee']) for m in data['machines']] == [(1, 1, 80), (2, 1, 60)]
+    assert [(g['name'], g['records'], g['oee']) for g in data['groups']['group']] == [("CNC", 1, 80), ("Press", 1, 60)]
+
+    # rewriting a reading moves its totals, the incremental fleet rollups match a rebuild
+    metric = MachineMetric.query.filter_by(machine_id=2, oee=60).one()
+    metric.oee = 70
+    db.session.commit()
+    columns = ['granularity', 'bucket_start', 'grouping', 'name', 'count', 'oee_sum']
+    rows = lambda: sorted(tuple(getattr(r, c) for c in columns) for r in MachineFleetRollup.query)
+    incremental = rows()
+    refresh_fleet_rollups(db.session.connection())
+    db.session.commit()
+    assert incremental == rows()
+    assert ('week', datetime(2024, 6, 10).date(), 'group', 'Press', 1, 70) in incremental
+
+def add_machines(db, ids):
+    from models import Machine
+    from datetime import datetime
+    db.session.add_all([
+        Machine(id=i, name=f"Machine {i}", category="Manual", group="CNC", manufacturer="Fanuc",
+                created_at=datetime(2024, 1, 1))
+        for i in ids
+    ])
+    db.session.commit()
+
+def test_post_metrics_batch_json(client, db, query_log):
+    from models import MachineMetric
+    add_machines(db, [1, 2])
+    readings = [
+        {"machine_id": 1 + i % 2, "timestamp": f"2024-06-{1 + i // 2:02d}T08:00:00", "oee": 80, "availability": 90,
+         "performance": 85.5, "output_quality": 99, "status": "Running" if i < 8 else "Offline"}
+        for i in range(10)
+    ]
+    query_log.clear()
+    resp = client.post('/machine-metrics/batch', json=readings)
+    assert resp.status_code == 201
+    assert resp.get_json() == {"inserted": 10}
+    # one multi-row insert for the whole batch
+    assert len([s for s, p in query_log if s.startswith("INSERT INTO machine_metrics")]) == 1
+    assert MachineMetric.query.count() == 10
+
+    # projections follow the new readings
+    machines = client.get('/machines').get_json()['machines']
+    assert [m['status'] for m in machines] == ["Offline", "Offline"]
+    data = client.get('/machines/1/dashboard?metrics=performance&bucket=month&agg=count').get_json()
+    assert data['series'] == {"performance": [5]}
+
+def test_appended_metrics_upsert_rollup_deltas(client, db, query_log):
+    from models import MachineMetricRollup, MachineFleetRollup
+    from projections import rebuild_projections
+    add_machines(db, [1, 2])
+
+    def post(day, hour, oee):
+        reading = {"machine_id": 1, "timestamp": f"2024-06-{day:02d}T{hour:02d}:00:00", "oee": oee,
+                   "availability": 90, "performance": 80, "output_quality": 99, "status": "Running"}
+        assert client.post('/machine-metrics/batch', json=[reading, {**reading, "machine_id": 2}]).status_code == 201
+
+    post(3, 8, 60)
+    post(4, 8, 90)
+    query_log.clear()
+    post(4, 9, 30)
+    # the append adds its totals to the buckets without reading their records
+    assert not any("FROM machine_metrics" in s for s, p in query_log)
+    assert not any(s.startswith("DELETE") for s, p in query_log)
+
+    week = MachineMetricRollup.query.filter_by(machine_id=1, granularity='week').one()
+    assert (week.count, week.oee_sum, week.oee_min, week.oee_max) == (3, 180, 30, 90)
+    rollups = lambda: sorted(
+        tuple(getattr(r, c) for c in ['machine_id', 'granularity', 'bucket_start', 'count', 'oee_sum', 'oee_min', 'oee_max'])
+        for r in MachineMetricRollup.query
+    )
+    fleet = lambda: sorted(tuple(getattr(r, c) for c in ['granularity', 'bucket_start', 'grouping', 'name', 'count', 'oee_sum'])
+                           for r in MachineFleetRollup.query)
+    incremental = rollups(), fleet()
+    rebuild_projections(db.session.connection())
+    db.session.commit()
+    assert incremental == (rollups(), fleet())
+
+def test_post_metrics_batch_ndjson_and_csv(client, db):
+    from models import MachineMetric
+    add_machines(db, [1])
+    ndjson = "\n".join([
+        '{"machine_id": 1, "timestamp": "2024-06-01", "oee": 80, "availability": 90, "performance": 85, "output_quality": 99, "status": "Running"}',
+        '',
+        '{"machine_id": 1, "timestamp": "2024-06-02", "oee": 81, "availability": 90, "performance": 85, "output_quality": 99, "status": "Running"}',
+    ])
+    resp = client.post('/machine-metrics/batch', data=ndjson, content_type='application/x-ndjson')
+    assert resp.status_code == 201 and resp.get_json()['inserted'] == 2
+
+    body = "machine_id,timestamp,oee,availability,performance,output_quality,status\n1,2024-06-03 08:00:00,82.5,90,85,99,Offline\n"
+    resp = client.post('/machine-metrics/batch', data=body, content_type='text/csv')
+    assert resp.status_code == 201 and resp.get_json()['inserted'] == 1
+    assert [m.oee for m in MachineMetric.query.order_by(MachineMetric.id)] == [80, 81, 82.5]
+
+def test_post_metrics_batch_rejects_invalid_readings(client, db):
+    from models import MachineMetric
+    add_machines(db, [1])
+    valid = {"machine_id": 1, "timestamp": "2024-06-01", "oee": 80, "availability": 90, "performance": 85,
+             "output_quality": 99, "status": "Running"}
+    readings = [valid, {**valid, "oee": 180}, {**valid, "machine_id": 42}, {**valid, "timestamp": "soon", "status": ""}]
+    resp = client.post('/machine-metrics/batch', json=readings)
+    assert resp.status_code == 400
+    errors = resp.get_json()['errors']
+    assert [(e['row'], e['field']) for e in errors] == [(1, 'oee'), (2, 'machine_id'), (3, 'timestamp'), (3, 'status')]
+    # all or nothing
+    assert MachineMetric.query.count() == 0
+
+    assert client.post('/machine-metrics/batch', json={"machine_id": 1}).status_code == 400
+    assert client.post('/machine-metrics/batch', data="x", content_type='text/plain').status_code == 400
+    assert client.post('/machine-metrics/batch', json=[]).status_code == 400
+
+def test_post_metrics_batch_utc_timestamps_and_database_errors(client, db, monkeypatch):
+    from models import MachineMetric
+    from datetime import datetime
+    from sqlalchemy.exc import OperationalError
+    import routes.metrics
+    add_machines(db, [1])
+    valid = {"machine_id": 1, "oee": 80, "availability": 90, "performance": 85, "output_quality": 99, "status": "Running"}
+    readings = [{**valid, "timestamp": "2024-06-01T10:00:00+02:00"}, {**valid, "timestamp": "2024-06-01T09:00:00Z"}]
+    assert client.post('/machine-metrics/batch', json=readings).status_code == 201
+    # offsets are converted to UTC instead of being dropped
+    assert [m.timestamp for m in MachineMetric.query.order_by(MachineMetric.id)] == [datetime(2024, 6, 1, 8), datetime(2024, 6, 1, 9)]
+
+    def fail(connection, rows):
+        raise OperationalError("INSERT INTO machine_metrics", {}, Exception("disk full"))
+    monkeypatch.setattr(routes.metrics, 'insert_readings', fail)
+    resp = client.post('/machine-metrics/batch', json=readings)
+    assert resp.status_code == 500 and resp.is_json
+    assert "disk full" in resp.get_json()['error']
+    assert MachineMetric.query.count() == 2
+
+def test_post_single_metrics_write_behind(app, client, db, query_log):
+    from models import MachineMetric
+    from ingestion import MetricBuffer
+    add_machines(db, [1])
+    app.config.update(METRIC_BUFFER_BATCH_SIZE=10, METRIC_BUFFER_FLUSH_INTERVAL=60)
+    reading = {"machine_id": 1, "timestamp": "2024-06-01T08:00:00", "oee": 80, "availability": 90, "performance": 85,
+               "output_quality": 99, "status": "Running"}
+    for i in range(25):
+        if i == 1:
+            query_log.clear()
+        resp = client.post('/machine-metrics', json={**reading, "oee": i})
+        assert resp.status_code == 202
+    # the machine is only looked up by the first reading
+    assert not [s for s, p in query_log if s.startswith("SELECT machines.id")]
+
+    buffer = MetricBuffer.for_app(app)
+    assert buffer.flush(timeout=10)
+    assert MachineMetric.query.count() == 25
+    stats = client.get('/machine-metrics/buffer').get_json()
+    assert stats['queue_depth'] == 0 and stats['rows_written'] == 25
+    # two full batches on the size threshold, the rest on flush()
+    assert stats['flushes'] == 3 and stats['max_flush_seconds'] > 0
+
+    assert client.post('/machine-metrics', json={**reading, "machine_id": 2}).status_code == 400
+    buffer.close()
+
+def test_metric_buffer_backpressure(app, db):
+    from models import MachineMetric
+    from ingestion import BufferFull, MetricBuffer
+    from datetime import datetime
+    import pytest
+    add_machines(db, [1])
+    buffer = MetricBuffer(app, max_size=2, batch_size=100, flush_interval=60, put_timeout=0.01)
+    row = {"machine_id": 1, "timestamp": datetime(2024, 6, 1), "oee": 80, "availability": 90, "performance": 85,
+           "output_quality": 99, "status": "Running"}
+    buffer.put(row)
+    assert buffer.put(row) == 2
+    with pytest.raises(BufferFull):
+        buffer.put(row)
+    assert buffer.stats()['rejected'] == 1
+
+    # close() writes what is left
+    buffer.close()
+    assert MachineMetric.query.count() == 2
+
+def test_metric_buffer_dead_letters_only_the_failing_readings(app, db):
+    from models import MachineMetric
+    from ingestion import MetricBuffer
+    from datetime import datetime
+    add_machines(db, [1])
+    buffer = MetricBuffer(app, batch_size=100, flush_interval=60)
+    row = {"machine_id": 1, "timestamp": datetime(2024, 6, 1), "oee": 80, "availability": 90, "performance": 85,
+           "output_quality": 99, "status": "Running"}
+    for i in range(10):
+        buffer.put({**row, "oee": i, "status": None if i == 6 else "Running"})
+    buffer.close(timeout=10)
+
+    # the batch is split until the bad reading is isolated, the others are written
+    assert sorted(m.oee for m in MachineMetric.query) == [0, 1, 2, 3, 4, 5, 7, 8, 9]
+    stats = buffer.stats()
+    assert stats['rows_written'] == 9 and stats['rows_failed'] == 1
+    dead, = stats['dead_letters']
+    assert dead['reading']['oee'] == 6 and 'status' in dead['error'].lower()
+
+def test_machine_stream_pushes_committed_deltas(client, db):
+    import json
+    from models import MachineMetric
+    from events import publisher
+    from datetime import datetime
+    add_machines(db, [1, 2])
+    resp = client.get('/machines/stream?machine_ids=1', buffered=False)
+    assert resp.mimetype == 'text/event-stream'
+    chunks = iter(resp.response)
+    assert next(chunks).startswith(b"retry:")
+
+    def metric(machine_id, status):
+        return MachineMetric(machine_id=machine_id, timestamp=datetime(2024, 6, 1), oee=80, availability=90,
+                             performance=85, output_quality=99, status=status)
+
+    # rolled back writes are never published
+    db.session.add(metric(1, "Broken"))
+    db.session.flush()
+    db.session.rollback()
+    db.session.add_all([metric(2, "Running"), metric(1, "Running"), metric(1, "Offline")])
+    db.session.commit()
+
+    # one delta per machine and commit, machines not followed are filtered out
+    lines = next(chunks).decode().splitlines()
+    assert lines[1] == "event: metric"
+    data = json.loads(lines[2][len("data: "):])
+    assert data['machine_id'] == 1 and data['status'] == "Offline" and data['oee'] == 80
+
+    assert publisher.subscribers == 1
+    resp.close()
+    assert publisher.subscribers == 0
+
+
+def test_machine_events_published_only_after_commit_succeeds(db):
+    import pytest
+    from sqlalchemy import event
+    from models import MachineMetric
+    from events import publisher
+    from datetime import datetime
+    add_machines(db, [1])
+    subscription = publisher.subscribe()
+
+    def failing_commit(connection):
+        raise RuntimeError("disk full")
+
+    # the DBAPI commit fails after the Engine 'commit' event
+    event.listen(db.engine, 'commit', failing_commit)
+    try:
+        db.session.add(MachineMetric(machine_id=1, timestamp=datetime(2024, 6, 1), oee=80, availability=90,
+                                     performance=85, output_quality=99, status="Running"))
+        with pytest.raises(RuntimeError):
+            db.session.commit()
+        db.session.rollback()
+    finally:
+        event.remove(db.engine, 'commit', failing_commit)
+    assert subscription.get(timeout=0.1) is None
+
+    # the events of a later transaction are not mixed with the failed one
+    db.session.add(MachineMetric(machine_id=1, timestamp=datetime(2024, 6, 2), oee=70, availability=90,
+                                 performance=85, output_quality=99, status="Offline"))
+    db.session.commit()
+    _, event_type, data = subscription.get(timeout=1)
+    assert event_type == 'metric' and data['status'] == "Offline"
+    assert subscription.get(timeout=0.1) is None
+    publisher.unsubscribe(subscription)
+
+def test_dashboard_time_window_and_keyset_pagination(client, db, query_log):
+    from models import MachineMetric
+    from datetime import datetime, timedelta
+    # three days of hourly metrics
+    start = datetime(2024, 6, 1)
+    db.session.add_all([
+        MachineMetric(machine_id=1, timestamp=start + timedelta(hours=h), oee=h, availability=90,
+                      performance=80, output_quality=99, status="Running")
+        for h in range(72)
+    ])
+    db.session.commit()
+
+    # days is a real window: 24 hourly points, not 1 row per day
+    data = client.get('/machines/1/dashboard/oee?days=1').get_json()
+    assert len(data['data']) == 24
+    assert data['data'][0]['timestamp'] == "2024-06-03T00:00:00"
+
+    data = client.get('/machines/1/dashboard?metrics=oee&from=2024-06-02&to=2024-06-02T06:00:00').get_json()
+    assert data['series']['oee'] == [24, 25, 26, 27, 28, 29]
+
+    # the window is an index range scan
+    statement, parameters = [(s, p) for s, p in query_log if "FROM machine_metrics" in s][-1]
+    plan = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    assert "timestamp>? AND timestamp<?" in ' '.join(row[-1] for row in plan)
+
+    values, cursor, pages = [], None, 0
+    while True:
+        url = '/machines/1/dashboard/oee?from=2024-06-02&limit=10' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(url).get_json()
+        values += [point['value'] for point in page['data']]
+        pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert values == list(range(24, 72))
+    assert pages == 5
+
+    assert client.get('/machines/1/dashboard/oee?from=yesterday').status_code == 400
+    assert client.get('/machines/1/dashboard/oee?cursor=garbage').status_code == 400
+    assert client.get('/machines/1/dashboard/oee?bucket=day&limit=10').status_code == 400
+
+
+def test_create_app_profiles_and_engine_options(monkeypatch):
+    from app import create_app
+    from config import ProductionConfig, engine_options
+    import pytest
+
+    app = create_app(testing=True)
+    assert app.config['TESTING'] and app.config['APP_PROFILE'] == 'test'
+    assert not app.config['CREATE_SCHEMA_ON_STARTUP']
+    with pytest.raises(ValueError):
+        create_app('staging')
+
+    # pool sizing only applies to server databases
+    config = {key: getattr(ProductionConfig, key) for key in dir(ProductionConfig) if key.isupper()}
+    options = engine_options('postgresql://db/mesdb', config)
+    assert options['pool_size'] == 10 and options['max_overflow'] == 5 and options['pool_pre_ping']
+    # the statement timeout is set per request transaction, imports and migrations run without it
+    assert config['DB_STATEMENT_TIMEOUT_MS'] == 30000 and 'connect_args' not in options
+    assert engine_options('sqlite://', config) == {'pool_pre_ping': True}
+
+    app = create_app('test', config={'SQLALCHEMY_REPLICA_URI': 'sqlite://', 'DB_POOL_PRE_PING': False})
+    assert app.config['SQLALCHEMY_BINDS'] == {'replica': {'url': 'sqlite://', 'pool_pre_ping': False}}
+
+def test_statement_timeout_only_limits_request_transactions():
+    from app import create_app
+    from types import SimpleNamespace
+    import timeouts
+
+    statements = []
+    connection = SimpleNamespace(dialect=SimpleNamespace(name='postgresql'), exec_driver_sql=statements.append)
+    app = create_app('test', config={'DB_STATEMENT_TIMEOUT_MS': 30000})
+    with app.app_context():
+        # import jobs and the CLI have no request
+        timeouts._limit_request_statements(None, None, connection)
+    with app.test_request_context('/machines'):
+        timeouts._limit_request_statements(None, None, connection)
+    assert statements == ["SET LOCAL statement_timeout = 30000"]
+
+
+def test_reads_go_to_replica_until_a_write(tmp_path):
+    from app import create_app
+    from models import db, User
+    from datetime import datetime
+    from sqlalchemy import text
+
+    app = create_app('test', config={
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'primary.db'}",
+        'SQLALCHEMY_REPLICA_URI': f"sqlite:///{tmp_path / 'replica.db'}",
+    })
+    with app.app_context():
+        db.create_all(bind_key=None)
+        db.metadata.create_all(db.engines['replica'])
+        # a row only the replica has tells which database answered
+        with db.engines['replica'].begin() as connection:
+            connection.execute(text(
+                "INSERT INTO users (username, firstname, lastname, created_at) "
+                "VALUES ('replica', 'Re', 'Plica', '2024-06-01 00:00:00')"
+            ))
+
+        client = app.test_client()
+        # the frontend calls from another origin, without credentials
+        origin = {'Origin': 'http://localhost:5173'}
+        assert [u['username'] for u in client.get('/users', headers=origin).get_json()] == ['replica']
+
+        response = client.post('/user', headers=origin,
+                               json={'username': 'jdoe', 'first_name': 'John', 'last_name': 'Doe'})
+        assert response.status_code == 201
+        assert db.session.execute(db.select(User.username)).scalars().all() == ['jdoe']
+        sticky = response.headers['X-Read-Primary-Until']
+        assert 'X-Read-Primary-Until' in response.headers['Access-Control-Expose-Headers']
+        assert 'Set-Cookie' not in response.headers
+
+        # the browser may send the header back (preflight)
+        preflight = client.options('/users', headers={**origin, 'Access-Control-Request-Method': 'GET',
+                                                      'Access-Control-Request-Headers': 'x-read-primary-until'})
+        assert 'x-read-primary-until' in preflight.headers['Access-Control-Allow-Headers'].lower()
+
+        # read-your-writes: the writer reads from the primary while its header lasts
+        response = client.get('/users', headers={**origin, 'X-Read-Primary-Until': sticky})
+        assert [u['username'] for u in response.get_json()] == ['jdoe']
+        assert [u['username'] for u in client.get('/users', headers=origin).get_json()] == ['replica']
+        assert [u['username'] for u in client.get('/users', headers={'X-Read-Primary-Until': '1'}).get_json()] == ['replica']
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_startup_without_schema_work_and_lazy_swagger(tmp_path):
+    from app import create_app
+    from sqlalchemy import create_engine, inspect
+
+    url = f"sqlite:///{tmp_path / 'mesdb.db'}"
+    app = create_app('prod', config={'SQLALCHEMY_DATABASE_URI': url})
+    assert inspect(create_engine(url)).get_table_names() == []
+    assert not app.wsgi_app.loaded
+
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=['schema', 'status']).exit_code == 1
+    result = runner.invoke(args=['schema', 'upgrade'])
+    assert result.exit_code == 0 and "Applied migrations: 0001_hot_path_indexes" in result.output
+    result = runner.invoke(args=['schema', 'status'])
+    assert result.exit_code == 0 and "Pending migrations: none" in result.output
+
+    client = app.test_client()
+    assert client.get('/machines').status_code == 200
+    assert not app.wsgi_app.loaded
+    spec = client.get('/apispec_1.json').get_json()
+    assert app.wsgi_app.loaded
+    assert '/machines' in spec['paths'] and spec['info']['title'] == 'Machine Management API'
+    assert client.get('/apidocs/').status_code == 200
+
+
+def test_response_cache_invalidated_by_write_paths(app, client, db, create_users, query_log):
+    # one TTL window for the whole test, memory validators change with each window
+    app.config['CACHE_DEFAULT_TTL'] = 3600
+    add_machines(db, [1])
+    response = client.get('/users')
+    assert response.headers['X-Cache'] == 'MISS'
+    statements = len(query_log)
+    response = client.get('/users')
+    assert response.headers['X-Cache'] == 'HIT' and len(response.get_json()) == 2
+    assert len(query_log) == statements
+
+    # other arguments are other entries, writes to other tables keep the entry
+    assert client.get('/machines?per_page=5').headers['X-Cache'] == 'MISS'
+    assert client.post('/maintenance', json={'machine_id': 1, 'performed_by': 'jdoe', 'notes': 'Oil',
+                                             'date': '2024-06-22T10:00:00', 'planned': True}).status_code == 201
+    assert client.get('/users').headers['X-Cache'] == 'HIT'
+
+    assert client.post('/user', json={'username': 'bkim', 'first_name': 'Bo', 'last_name': 'Kim'}).status_code == 201
+    response = client.get('/users')
+    assert response.headers['X-Cache'] == 'MISS' and len(response.get_json()) == 3
+
+    # metric writes invalidate once committed
+    reading = {'machine_id': 1, 'timestamp': '2024-06-15T08:30:00', 'oee': 81.2, 'availability': 92.0,
+               'performance': 88.4, 'output_quality': 99.1, 'status': 'Running'}
+    assert client.post('/machine-metrics/batch', json=[reading]).status_code == 201
+    response = client.get('/machines?per_page=5')
+    assert response.headers['X-Cache'] == 'MISS' and response.get_json()['machines'][0]['status'] == 'Running'
+
+
+def test_memory_cache_backend_lru_and_ttl(monkeypatch):
+    import cache
+    backend = cache.MemoryBackend(max_entries=2)
+    backend.set('a', 1, ttl=60)
+    backend.set('b', 2, ttl=60)
+    assert backend.get('a') == 1
+    backend.set('c', 3, ttl=60)  # evicts b, the least recently used
+    assert (backend.get('a'), backend.get('b'), backend.get('c')) == (1, None, 3)
+
+    now = cache.time.monotonic()
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now + 61)
+    assert backend.get('a') is None
+
+    backend.bump(['users', 'users', 'tools'])
+    versions, modified = backend.state(['users', 'tools', 'machines'])
+    assert versions == [2, 1, 0] and modified is not None
+
+
+def test_conditional_get_answers_304_without_database(app, client, db, create_users, query_log, monkeypatch):
+    import cache
+    # a clock the test moves, one TTL window for the whole test
+    clock = [cache.time.time()]
+    monkeypatch.setattr(cache.time, 'time', lambda: clock[0])
+    app.config['CACHE_DEFAULT_TTL'] = 3600
+    cache.ResponseCache.for_app(app)
+    clock[0] += 2
+
+    response = client.get('/users')
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    assert etag.startswith('W/"') and response.headers['Cache-Control'] == 'no-cache'
+
+    statements = len(query_log)
+    response = client.get('/users', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+    assert response.headers['ETag'] == etag
+    assert client.get('/users', headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert len(query_log) == statements
+
+    # a write to the table changes the validators, other tables keep theirs
+    tools_etag = client.get('/tools').headers['ETag']
+    assert client.post('/user', json={'username': 'bkim', 'first_name': 'Bo', 'last_name': 'Kim'}).status_code == 201
+    response = client.get('/users', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and len(response.get_json()) == 3
+    assert response.headers['ETag'] != etag
+    assert client.get('/tools', headers={'If-None-Match': tools_etag}).status_code == 304
+
+    # no Last-Modified while the second of the write may see other writes
+    response = client.get('/users', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 200 and 'Last-Modified' not in response.headers
+    clock[0] += 1
+    last_modified = client.get('/users').headers['Last-Modified']
+    assert client.get('/users', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+
+def test_cache_versions_bumped_after_commit_only(app, db):
+    import pytest
+    from sqlalchemy import event
+    from cache import ResponseCache
+    from ingestion import insert_readings
+    from datetime import datetime
+    add_machines(db, [1])
+    cache = ResponseCache.for_app(app)
+    row = {'machine_id': 1, 'timestamp': datetime(2024, 6, 1), 'oee': 80.0, 'availability': 90.0,
+           'performance': 85.0, 'output_quality': 99.0, 'status': 'Running'}
+
+    insert_readings(db.session.connection(), [row])
+    assert cache.backend.state(['machine_metrics'])[0] == [0]
+    db.session.commit()
+    assert cache.backend.state(['machine_metrics'])[0] == [1]
+
+    def failing_commit(connection):
+        raise RuntimeError("disk full")
+
+    event.listen(db.engine, 'commit', failing_commit)
+    try:
+        insert_readings(db.session.connection(), [row])
+        with pytest.raises(RuntimeError):
+            db.session.commit()
+        db.session.rollback()
+    finally:
+        event.remove(db.engine, 'commit', failing_commit)
+    assert cache.backend.state(['machine_metrics'])[0] == [1]
+
+
+def test_cache_not_filled_from_lagging_replica(tmp_path):
+    import time
+    from app import create_app
+    from models import db
+
+    app = create_app('test', config={
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'primary.db'}",
+        'SQLALCHEMY_REPLICA_URI': f"sqlite:///{tmp_path / 'replica.db'}",
+        'DB_REPLICA_STICKY_SECONDS': 1,
+    })
+    with app.app_context():
+        db.create_all(bind_key=None)
+        db.metadata.create_all(db.engines['replica'])
+        writer, reader = app.test_client(), app.test_client()
+        assert reader.get('/users').headers['X-Cache'] == 'MISS'
+        assert writer.post('/user', json={'username': 'bkim', 'first_name': 'Bo', 'last_name': 'Kim'}).status_code == 201
+
+        # the replica may not have replayed the write: served but not stored
+        for _ in range(2):
+            response = reader.get('/users')
+            assert response.get_json() == [] and 'X-Cache' not in response.headers
+            assert 'ETag' not in response.headers and 'Last-Modified' not in response.headers
+
+        time.sleep(1)
+        assert reader.get('/users').headers['X-Cache'] == 'MISS'
+        assert reader.get('/users').headers['X-Cache'] == 'HIT'
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
@@ -0,0 +1,22 @@
+"""
+PostgreSQL statement_timeout of the queries run by HTTP requests.
+
+WHY: A runaway query of a request must not hold a pooled connection forever, but the CSV
+import (COPY of millions of rows, projection rebuilds) and the schema upgrade legitimately run
+for minutes. DB_STATEMENT_TIMEOUT_MS is therefore set with SET LOCAL at the start of each Session
+transaction opened by a request (one extra statement per transaction): the import jobs, the
+CLI and the migrations, which run outside of any request, keep the server default.
+"""
+from flask import current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+@event.listens_for(Session, 'after_begin')
+def _limit_request_statements(session, transaction, connection):
+    if not has_request_context() or connection.dialect.name != 'postgresql':
+        return
+    timeout = current_app.config.get('DB_STATEMENT_TIMEOUT_MS')
+    if timeout:
+        # only lasts until the end of the transaction, the pooled connection is left unchanged
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
@@ -0,0 +1,80 @@
+"""
+Time bucketing helpers shared by the dashboard queries.
+
+WHY: Long ranges are aggregated by the database (date_trunc on PostgreSQL, date()/strftime()
+on SQLite) so that only one point per bucket travels to the client.
+"""
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import Date, cast, func
+
+BUCKETS = ['day', 'week', 'month']
+AGGREGATES = {
+    'avg': func.avg,
+    'min': func.min,
+    'max': func.max,
+    'sum': func.sum,
+    'count': func.count,
+}
+
+
+def bucket_start(dialect, bucket, column):
+    """
+    SQL expression (a date) giving the first day of the bucket a timestamp falls in (weeks start on Monday).
+
+    @param dialect Name of the database dialect ('postgresql', 'sqlite', ...)
+    @param bucket One of BUCKETS
+    @param column Timestamp column or expression
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"Invalid bucket '{bucket}'. Must be one of {BUCKETS}.")
+
+    if dialect == 'postgresql':
+        return cast(func.date_trunc(bucket, column), Date)
+
+    if bucket == 'day':
+        return func.date(column, type_=Date)
+    if bucket == 'week':
+        # next Sunday (or the same day), then back to its Monday
+        return func.date(column, 'weekday 0', '-6 days', type_=Date)
+    return func.strftime('%Y-%m-01', column, type_=Date)
+
+
+def to_utc(value):
+    """
+    Naive UTC datetime, as stored in the timestamp columns: an offset is applied, not dropped.
+    """
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def bucket_floor(bucket, value):
+    """
+    Python counterpart of bucket_start(): first day of the bucket holding a date or datetime.
+    """
+    day = value.date() if isinstance(value, datetime) else value
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(bucket, day):
+    """
+    First day of the bucket following the one starting on day.
+    """
+    if bucket == 'week':
+        return day + timedelta(days=7)
+    if bucket == 'month':
+        return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def format_bucket(value):
+    """
+    Bucket start as 'YYYY-MM-DD', whatever type the database returned.
+    """
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    return str(value)[:10]
@@ -3,6 +3,11 @@ import App from './App.vue'
 import router from './router'
 import store from './store'
 import keycloak from './keycloak'  // 🔐 Keycloak instance initialized separately
+import axios from 'axios'
+import { readYourWrites } from './readYourWrites'
+
+// Reads after a write go to the primary database (read replica deployments)
+readYourWrites(axios)
 
 // Initialize Keycloak before mounting the Vue app
 keycloak.init({
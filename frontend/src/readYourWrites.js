@@ -0,0 +1,22 @@
+// src/readYourWrites.js
+// With a read replica, write responses carry X-Read-Primary-Until. Sending it back
+// makes the following reads go to the primary, so a view sees its own writes
+// (the server ignores the header once that time has passed).
+const HEADER = 'x-read-primary-until'
+let primaryUntil = null
+
+export function readYourWrites(instance) {
+  instance.interceptors.request.use(config => {
+    if (primaryUntil) {
+      config.headers[HEADER] = primaryUntil
+    }
+    return config
+  })
+  instance.interceptors.response.use(response => {
+    if (response.headers[HEADER]) {
+      primaryUntil = response.headers[HEADER]
+    }
+    return response
+  })
+  return instance
+}
@@ -9,6 +9,9 @@
 import { createStore } from 'vuex';
 import axios from 'axios';
 
+// Live feed of status/KPI changes, shared by every component watching the machines
+let machineStream = null;
+
 /**
  * Create Vuex store instance.
  * State:
@@ -18,6 +21,8 @@ import axios from 'axios';
  * - updateMachine: updates a single machine in-place by ID
  * Actions:
  * - fetchMachines: retrieves machine data from the backend and commits it to the store
+ * - watchMachines: applies the live status changes pushed by /machines/stream
+ * - unwatchMachines: closes the live feed
  */
 export default createStore({
   state: {
@@ -60,12 +65,41 @@ export default createStore({
     async fetchMachines({ commit }) {
       try {
         const response = await axios.get('http://127.0.0.1:5000/machines', {
-          params: { page: 1, per_page: 50 }, // Pagination parameters
+          params: { page: 1, per_page: 50, count: false }, // Pagination parameters, total not needed
         });
         commit('setMachines', response.data.machines);
       } catch (error) {
         console.error('Error fetching machines:', error); // Log for debugging
       }
     },
+
+    /**
+     * Opens the Server-Sent Events feed of machine changes instead of polling /machines.
+     * "metric" events update the status of the listed machine in place,
+     * "reload" events (after an import) fetch the list again.
+     * EventSource reconnects by itself when the connection drops.
+     *
+     * @param {Function} commit - Vuex commit function
+     * @param {Function} dispatch - Vuex dispatch function
+     */
+    watchMachines({ commit, dispatch }) {
+      if (machineStream) return;
+      machineStream = new EventSource('http://127.0.0.1:5000/machines/stream');
+      machineStream.addEventListener('metric', (event) => {
+        const metric = JSON.parse(event.data);
+        commit('updateMachine', { id: metric.machine_id, status: metric.status });
+      });
+      machineStream.addEventListener('reload', () => dispatch('fetchMachines'));
+    },
+
+    /**
+     * Closes the live feed opened by watchMachines.
+     */
+    unwatchMachines() {
+      if (machineStream) {
+        machineStream.close();
+        machineStream = null;
+      }
+    },
   },
 });